@@ -0,0 +1,69 @@
+"""
+Parser benchmark: time and peak memory of parse_program on generated
+sources.
+
+    python benchmarks/bench_parser.py
+"""
+
+import random
+import time
+import tracemalloc
+
+from retro16sim.parser import parse_program
+
+OPS = ["+", "-", "*", "/"]
+
+
+def deep_expr(depth: int, rng: random.Random) -> str:
+    # right-nested: a - (b + (c * (...)))
+    expr = "x"
+    for _ in range(depth):
+        expr = f"{rng.choice('abcxyz')} {rng.choice(OPS)} ({expr})"
+    return expr
+
+
+def long_expr(terms: int, rng: random.Random) -> str:
+    parts = [rng.choice("abcxyz")]
+    for _ in range(terms - 1):
+        parts.append(rng.choice(OPS))
+        parts.append(rng.choice(["a", "b", "x", str(rng.randrange(100))]))
+    return " ".join(parts)
+
+
+def program(stmts: int, rng: random.Random) -> str:
+    lines = []
+    for i in range(stmts):
+        expr = long_expr(8, rng)
+        if i % 10 == 0:
+            lines.append(f"while (x != {i}) {{ x = {expr}; }}")
+        elif i % 10 == 5:
+            lines.append(f"if (a == b) {{ a = {expr}; }} else {{ b = 0; }}")
+        else:
+            lines.append(f"{rng.choice('abxy')} = {expr};")
+    return "\n".join(lines)
+
+
+def bench(name: str, src: str, repeat: int) -> None:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        parse_program(src)
+        best = min(best, time.perf_counter() - t0)
+
+    tracemalloc.start()
+    prog = parse_program(src)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del prog
+    print(f"{name:<24} {best * 1e3:9.2f} ms {peak / 1024:10.0f} KiB")
+
+
+def main() -> None:
+    rng = random.Random(0)
+    bench("deep expr (250)", f"y = {deep_expr(250, rng)};", 50)
+    bench("long expr (20000 terms)", f"y = {long_expr(20000, rng)};", 5)
+    bench("program (5000 stmts)", program(5000, rng), 5)
+
+
+if __name__ == "__main__":
+    main()
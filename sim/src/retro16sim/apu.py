@@ -0,0 +1,246 @@
+import bisect
+import functools
+import os
+import wave
+from collections.abc import Callable
+
+import numpy as np
+
+from .bus import Bus
+from .const import APU_REG_BASE, FRAME_CYCLES, FRAME_RATE, PAGE_SIZE
+
+SAMPLE_RATE = 48000  # mono, int16
+FRAME_SAMPLES = SAMPLE_RATE // FRAME_RATE
+
+# channels; registers (words) at APU_REG_BASE + CHANNEL_STRIDE * channel
+CH_SQUARE1 = 0
+CH_SQUARE2 = 1
+CH_WAVE = 2
+CH_NOISE = 3
+CHANNEL_COUNT = 4
+CHANNEL_STRIDE = 8
+
+REG_FREQ = 0  # Hz, 0 is silent (noise: LFSR clocks per second)
+REG_VOLUME = 2  # 0-15
+REG_DUTY = 4  # square: 12.5%, 25%, 50%, 75%
+
+APU_WAVE = APU_REG_BASE + 0x20  # WAVE_LENGTH 4-bit samples, first one high
+APU_CTRL = APU_REG_BASE + 0x30  # bit n enables channel n
+
+WAVE_LENGTH = 32
+# the write log is compacted once it grows past this many entries
+LOG_LIMIT = 4096
+NOISE_PERIOD = (1 << 15) - 1
+
+_DUTY = np.array([0.125, 0.25, 0.5, 0.75])
+
+# cycle-stamped clock for register writes
+type Clock = Callable[[], int]
+
+
+@functools.cache
+def _noise_table() -> np.ndarray:
+    # one period of the 15-bit LFSR (x^15 + x^14 + 1) as -1/+1
+    out = np.empty(NOISE_PERIOD, dtype=np.float64)
+    lfsr = 1
+    for i in range(NOISE_PERIOD):
+        bit = (lfsr ^ (lfsr >> 1)) & 1
+        lfsr = (lfsr >> 1) | (bit << 14)
+        out[i] = 1.0 if lfsr & 1 else -1.0
+    return out
+
+
+class SampleRing:
+    """
+    Bounded FIFO of samples; when full, the oldest samples are dropped
+    (counted in dropped).
+    """
+
+    def __init__(self, capacity: int = SAMPLE_RATE):
+        self.buf = np.zeros(capacity, dtype=np.int16)
+        self.start = 0
+        self.size = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def write(self, samples: np.ndarray) -> None:
+        cap = len(self.buf)
+        if len(samples) > cap:
+            self.dropped += len(samples) - cap
+            samples = samples[-cap:]
+        overflow = self.size + len(samples) - cap
+        if overflow > 0:
+            self.dropped += overflow
+            self.start = (self.start + overflow) % cap
+            self.size -= overflow
+
+        end = (self.start + self.size) % cap
+        first = min(len(samples), cap - end)
+        self.buf[end : end + first] = samples[:first]
+        self.buf[: len(samples) - first] = samples[first:]
+        self.size += len(samples)
+
+    def read(self, n: int | None = None) -> np.ndarray:
+        # removes and returns up to n of the oldest samples (all by default)
+        n = self.size if n is None else min(n, self.size)
+        idx = (self.start + np.arange(n)) % len(self.buf)
+        out = self.buf[idx]
+        self.start = (self.start + n) % len(self.buf)
+        self.size -= n
+        return out
+
+
+class WavWriter:
+    # streams samples into a mono 16-bit WAV file
+    def __init__(self, path: str | os.PathLike):
+        self._wav = wave.open(os.fspath(path), "wb")
+        self._wav.setnchannels(1)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(SAMPLE_RATE)
+
+    def write(self, samples: np.ndarray) -> None:
+        self._wav.writeframes(samples.astype("<i2").tobytes())
+
+    def close(self) -> None:
+        self._wav.close()
+
+    def __enter__(self) -> "WavWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class APU:
+    """
+    Sound device mapped at APU_REG_BASE (one page).
+
+    Registers live in bus memory; every store is logged with clock()
+    so that end_frame can synthesize the frame afterwards: the register
+    values are piecewise constant between writes, and each channel is
+    generated for the whole frame with NumPy, FRAME_SAMPLES samples per
+    FRAME_CYCLES. The mixed samples go to ring and, while recording, to
+    the WAV file.
+    """
+
+    def __init__(self, bus: Bus, clock: Clock):
+        self.bus = bus
+        self.clock = clock
+        # (cycle, offset, value before and after the write)
+        self._log: list[tuple[int, int, int, int]] = []
+        self._log_limit = LOG_LIMIT
+        # oscillator phases in periods (noise: LFSR clocks)
+        self._phase = np.zeros(CHANNEL_COUNT)
+        self.ring = SampleRing()
+        self.wav: WavWriter | None = None
+        self.samples = np.zeros(0, dtype=np.int16)  # the last frame
+        bus.map_device(APU_REG_BASE, PAGE_SIZE, self)
+
+    def reset(self) -> None:
+        # drops the register writes of the frame being run
+        self._log.clear()
+
+    def load8(self, addr: int) -> int:
+        return self.bus.mem[addr]
+
+    def store8(self, addr: int, val: int) -> None:
+        mem = self.bus.mem
+        now = self.clock()
+        self._log.append((now, addr - APU_REG_BASE, mem[addr], val))
+        mem[addr] = val
+        if len(self._log) > self._log_limit:
+            self._compact(now - FRAME_CYCLES)
+
+    def start_wav(self, path: str | os.PathLike) -> None:
+        self.stop_wav()
+        self.wav = WavWriter(path)
+
+    def stop_wav(self) -> None:
+        if self.wav is not None:
+            self.wav.close()
+            self.wav = None
+
+    def end_frame(self, start: int) -> np.ndarray:
+        # synthesize the frame that began at cycle start
+        regs, lengths = self._segments(start)
+        words = regs.view("<u2")  # [segment, register word]
+        ctrl = words[:, (APU_CTRL - APU_REG_BASE) >> 1]
+
+        mix = np.zeros(FRAME_SAMPLES)
+        for ch in range(CHANNEL_COUNT):
+            base = (CHANNEL_STRIDE * ch) >> 1
+            freq = words[:, base + (REG_FREQ >> 1)].astype(np.float64)
+            volume = (words[:, base + (REG_VOLUME >> 1)] & 0x0F) / 15
+            volume[(ctrl >> ch) & 1 == 0] = 0
+            period = NOISE_PERIOD if ch == CH_NOISE else 1.0
+            if not (volume * freq).any():
+                # silent, but the oscillator keeps running
+                advance = (freq * lengths).sum() / SAMPLE_RATE
+                self._phase[ch] = (self._phase[ch] + advance) % period
+                continue
+
+            step = np.repeat(freq / SAMPLE_RATE, lengths)
+            phase = self._phase[ch] + np.cumsum(step) - step
+            self._phase[ch] = (phase[-1] + step[-1]) % period
+            if ch == CH_NOISE:
+                out = _noise_table()[phase.astype(np.int64) % NOISE_PERIOD]
+            elif ch == CH_WAVE:
+                out = self._wave(regs, lengths, phase % 1.0)
+            else:
+                duty = np.repeat(_DUTY[words[:, base + (REG_DUTY >> 1)] & 3], lengths)
+                out = np.where(phase % 1.0 < duty, 1.0, -1.0)
+            mix += out * np.repeat(volume, lengths)
+
+        samples = (mix * (32767 / CHANNEL_COUNT)).astype(np.int16)
+        self.samples = samples
+        self.ring.write(samples)
+        if self.wav is not None:
+            self.wav.write(samples)
+        return samples
+
+    def _compact(self, before: int) -> None:
+        # Writes before the cycle before cannot fall into the current frame;
+        # the starting registers that _segments rebuilds from mem by undoing
+        # the log already include them.
+        log = self._log
+        del log[: bisect.bisect_left(log, before, key=lambda e: e[0])]
+        self._log_limit = max(LOG_LIMIT, 2 * len(log))
+
+    def _segments(self, start: int) -> tuple[np.ndarray, np.ndarray]:
+        # register page per stretch of constant values, [segment, byte],
+        # and the number of samples in each
+        log, self._log = self._log, []
+        page = bytearray(self.bus.mem[APU_REG_BASE : APU_REG_BASE + PAGE_SIZE])
+        for _, offset, old, _ in reversed(log):
+            page[offset] = old
+
+        pages = [bytes(page)]
+        bounds = [0]
+        for cycle, offset, _, new in log:
+            at = (cycle - start) * FRAME_SAMPLES // FRAME_CYCLES
+            at = min(max(at, bounds[-1]), FRAME_SAMPLES)
+            page[offset] = new
+            if at == bounds[-1]:
+                pages[-1] = bytes(page)
+            else:
+                bounds.append(at)
+                pages.append(bytes(page))
+
+        regs = np.frombuffer(b"".join(pages), dtype=np.uint8).reshape(-1, PAGE_SIZE)
+        lengths = np.diff(np.array(bounds + [FRAME_SAMPLES]))
+        return regs, lengths
+
+    def _wave(
+        self, regs: np.ndarray, lengths: np.ndarray, frac: np.ndarray
+    ) -> np.ndarray:
+        # the wave table of each segment, -1..1, read at frac
+        offset = APU_WAVE - APU_REG_BASE
+        packed = regs[:, offset : offset + WAVE_LENGTH // 2]
+        table = np.empty((len(regs), WAVE_LENGTH))
+        table[:, 0::2] = packed >> 4
+        table[:, 1::2] = packed & 0x0F
+        table = table / 7.5 - 1
+        segment = np.repeat(np.arange(len(regs)), lengths)
+        return table[segment, (frac * WAVE_LENGTH).astype(np.intp)]
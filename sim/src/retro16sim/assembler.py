@@ -1,6 +1,7 @@
+import sys
+from array import array
+
 from .const import (
-    BYTE_BITS,
-    BYTE_MASK,
     IMM6_MASK,
     OPCODE_SHIFT,
     OPCODE_MASK,
@@ -9,6 +10,7 @@ from .const import (
     REG_SHIFT_RS1,
     REG_SHIFT_RS2,
     REG_SHIFT_RD,
+    WORD_MASK,
 )
 
 from .isa import Op
@@ -29,6 +31,14 @@ def asm_addi(rd: Reg, rs: Reg, imm: Imm) -> int:
     return _encode_i(opcode=Op.ADDI, rd=rd, rs=rs, imm=imm)
 
 
+def asm_ld(rd: Reg, base: Reg, off: Imm) -> int:
+    return _encode_m(opcode=Op.LD, r=rd, base=base, off=off)
+
+
+def asm_st(rs: Reg, base: Reg, off: Imm) -> int:
+    return _encode_m(opcode=Op.ST, r=rs, base=base, off=off)
+
+
 def asm_cmp(rs1: Reg, rs2: Reg) -> int:
     return _encode_r(opcode=Op.CMP, rd=0, rs1=rs1, rs2=rs2)
 
@@ -53,6 +63,14 @@ def asm_halt():
     return _encode_j(opcode=Op.HALT, off_words=0)
 
 
+def asm_reti() -> int:
+    return _encode_j(opcode=Op.RETI, off_words=0)
+
+
+def asm_wait() -> int:
+    return _encode_j(opcode=Op.WAIT, off_words=0)
+
+
 def _encode_i(*, opcode: Op, rd: Reg, rs: Reg, imm: Imm) -> int:
     imm &= IMM6_MASK  # use 6 bits only (decoder takes care of sign)
     return (
@@ -63,6 +81,16 @@ def _encode_i(*, opcode: Op, rd: Reg, rs: Reg, imm: Imm) -> int:
     )
 
 
+def _encode_m(*, opcode: Op, r: Reg, base: Reg, off: Imm) -> int:
+    off &= IMM6_MASK  # same layout as I-type
+    return (
+        ((opcode & OPCODE_MASK) << OPCODE_SHIFT)
+        | ((r & REG_MASK) << REG_SHIFT_RD)
+        | ((base & REG_MASK) << REG_SHIFT_RS1)
+        | off
+    )
+
+
 def _encode_r(*, opcode: Op, rd: Reg, rs1: Reg, rs2: Reg) -> int:
     return (
         ((opcode & OPCODE_MASK) << OPCODE_SHIFT)
@@ -84,8 +112,7 @@ def build_test_rom(rom_words: list[int]) -> bytes:
     # w1 = assemble_jmp(Op.JMP, off_words=-2)  # JMP -2
     # rom_words = [w0, w1]
 
-    rom_bytes = bytearray()
-    for w in rom_words:
-        rom_bytes.append(w & BYTE_MASK)  # low byte
-        rom_bytes.append((w >> BYTE_BITS) & BYTE_MASK)  # high byte
-    return bytes(rom_bytes)
+    rom = array("H", [w & WORD_MASK for w in rom_words])
+    if sys.byteorder != "little":
+        rom.byteswap()  # ROM words are little-endian
+    return rom.tobytes()
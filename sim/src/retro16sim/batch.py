@@ -0,0 +1,180 @@
+import numpy as np
+
+from .const import (
+    ADDR_MASK,
+    BYTE_BITS,
+    FRAME_CYCLES,
+    IMM6_MASK,
+    IMM6_SIGNBIT,
+    MEM_SIZE,
+    NEGATIVE_BIT,
+    OFF12_MASK,
+    OFF12_SIGNBIT,
+    OPCODE_SHIFT,
+    OPCODE_MASK,
+    REG_MASK,
+    REG_SHIFT_RD,
+    REG_SHIFT_RS1,
+    REG_SHIFT_RS2,
+    ROM_END,
+    WORD_MASK,
+)
+from .isa import Op
+
+_KNOWN_OPS = np.zeros(OPCODE_MASK + 1, dtype=bool)
+# no interrupts here: RETI and WAIT fault like unknown opcodes
+_KNOWN_OPS[[int(op) for op in Op if op not in (Op.RETI, Op.WAIT)]] = True
+
+
+class MachineBatch:
+    """
+    N independent machines stepped in lockstep with NumPy.
+
+    Lane i has registers reg[i], memory mem[i], pc[i] and so on. Each step
+    fetches and decodes one instruction for every running lane at once and
+    executes it grouped by opcode. All memory is plain RAM/ROM (no MMIO).
+
+    Unlike CPU.step, an unknown opcode does not raise: the lane halts with
+    faulted[i] set and pc[i] at the offending instruction.
+    """
+
+    def __init__(self, n: int):
+        self.n = n
+        self.reg = np.zeros((n, 8), dtype=np.uint16)
+        self.mem = np.zeros((n, MEM_SIZE), dtype=np.uint8)
+        self.pc = np.zeros(n, dtype=np.uint16)
+        self.flag_z = np.zeros(n, dtype=bool)
+        self.flag_n = np.zeros(n, dtype=bool)
+        self.flag_c = np.zeros(n, dtype=bool)
+        self.flag_v = np.zeros(n, dtype=bool)
+        self.halted = np.zeros(n, dtype=bool)
+        self.faulted = np.zeros(n, dtype=bool)
+        self.cycles = np.zeros(n, dtype=np.int64)
+
+    def reset(self) -> None:
+        self.pc[:] = 0x0000
+        self.reg[:] = 0
+        self.flag_z[:] = self.flag_n[:] = self.flag_c[:] = self.flag_v[:] = False
+        self.halted[:] = False
+        self.faulted[:] = False
+
+    def load_rom(self, data: bytes, addr=0x0000) -> None:
+        # same image in every lane
+        self.mem[:, addr : addr + len(data)] = np.frombuffer(data, dtype=np.uint8)
+
+    def load_roms(self, images: list[bytes], addr=0x0000) -> None:
+        # one image per lane
+        if len(images) != self.n:
+            raise ValueError(f"expected {self.n} ROM images, got {len(images)}")
+        for lane, data in enumerate(images):
+            self.mem[lane, addr : addr + len(data)] = np.frombuffer(
+                data, dtype=np.uint8
+            )
+
+    def run_frame(self) -> None:
+        self.run_n_steps(FRAME_CYCLES)
+
+    def run_n_steps(self, n: int) -> None:
+        for _ in range(n):
+            if not self.step():
+                break
+
+    def step(self) -> bool:
+        # returns False once every lane is halted
+        lanes = np.flatnonzero(~self.halted)
+        if lanes.size == 0:
+            return False
+
+        # fetch
+        pc = self.pc[lanes].astype(np.int64)
+        lo = self.mem[lanes, pc].astype(np.int64)
+        hi = self.mem[lanes, (pc + 1) & ADDR_MASK].astype(np.int64)
+        instr = lo | (hi << BYTE_BITS)
+        opcode = (instr >> OPCODE_SHIFT) & OPCODE_MASK
+
+        unknown = ~_KNOWN_OPS[opcode]
+        if unknown.any():
+            bad = lanes[unknown]
+            self.halted[bad] = True
+            self.faulted[bad] = True
+            keep = ~unknown
+            lanes, pc, instr, opcode = lanes[keep], pc[keep], instr[keep], opcode[keep]
+
+        next_pc = (pc + 2) & ADDR_MASK
+        for op in np.flatnonzero(np.bincount(opcode, minlength=OPCODE_MASK + 1)):
+            sel = opcode == op
+            self._exec(Op(op), lanes[sel], instr[sel], next_pc, sel)
+
+        self.pc[lanes] = next_pc
+        self.cycles[lanes[opcode != Op.HALT]] += 1
+        return True
+
+    def _exec(
+        self,
+        op: Op,
+        lanes: np.ndarray,
+        instr: np.ndarray,
+        next_pc: np.ndarray,
+        sel: np.ndarray,
+    ) -> None:
+        reg = self.reg
+        rd = (instr >> REG_SHIFT_RD) & REG_MASK
+        rs1 = (instr >> REG_SHIFT_RS1) & REG_MASK
+
+        if op in (Op.ADD, Op.SUB, Op.ADDI, Op.CMP, Op.CMPI):
+            a = reg[lanes, rs1].astype(np.int64)
+            if op in (Op.ADDI, Op.CMPI):
+                b = _imm6(instr) & WORD_MASK
+            else:
+                b = reg[lanes, (instr >> REG_SHIFT_RS2) & REG_MASK].astype(np.int64)
+
+            if op in (Op.ADD, Op.ADDI):
+                result = (a + b) & WORD_MASK
+                self.flag_c[lanes] = a + b > WORD_MASK
+                self.flag_v[lanes] = (a ^ result) & (b ^ result) & NEGATIVE_BIT != 0
+            else:
+                result = (a - b) & WORD_MASK
+                self.flag_c[lanes] = a >= b
+                self.flag_v[lanes] = (a ^ b) & (a ^ result) & NEGATIVE_BIT != 0
+            self.flag_z[lanes] = result == 0
+            self.flag_n[lanes] = result >= NEGATIVE_BIT
+
+            if op in (Op.ADD, Op.SUB, Op.ADDI):
+                reg[lanes, rd] = result
+
+        elif op == Op.LD:
+            addr = (reg[lanes, rs1].astype(np.int64) + _imm6(instr)) & ADDR_MASK
+            lo = self.mem[lanes, addr].astype(np.int64)
+            hi = self.mem[lanes, (addr + 1) & ADDR_MASK].astype(np.int64)
+            val = lo | (hi << BYTE_BITS)
+            reg[lanes, rd] = val
+            self.flag_z[lanes] = val == 0
+            self.flag_n[lanes] = val >= NEGATIVE_BIT
+
+        elif op == Op.ST:
+            addr = (reg[lanes, rs1].astype(np.int64) + _imm6(instr)) & ADDR_MASK
+            val = reg[lanes, rd]
+            for offset, byte in ((0, val & 0xFF), (1, val >> BYTE_BITS)):
+                a = (addr + offset) & ADDR_MASK
+                writable = a > ROM_END  # ROM area is read-only
+                self.mem[lanes[writable], a[writable]] = byte[writable]
+
+        elif op in (Op.JMP, Op.JZ, Op.JNZ):
+            off = instr & OFF12_MASK
+            off = np.where(off & OFF12_SIGNBIT, off - (OFF12_MASK + 1), off)
+            taken = np.ones(lanes.size, dtype=bool)
+            if op == Op.JZ:
+                taken = self.flag_z[lanes]
+            elif op == Op.JNZ:
+                taken = ~self.flag_z[lanes]
+
+            pcs = next_pc[sel]
+            next_pc[sel] = np.where(taken, (pcs + off * 2) & ADDR_MASK, pcs)
+
+        elif op == Op.HALT:
+            self.halted[lanes] = True
+
+
+def _imm6(instr: np.ndarray) -> np.ndarray:
+    imm = instr & IMM6_MASK
+    return np.where(imm & IMM6_SIGNBIT, imm - (IMM6_MASK + 1), imm)
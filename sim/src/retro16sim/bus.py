@@ -1,33 +1,310 @@
-from .const import ADDR_MASK, BYTE_BITS, BYTE_MASK, MEM_SIZE, ROM_START, ROM_END
+import sys
+from collections.abc import Buffer
+from typing import Callable, Protocol
+
+from .const import (
+    ADDR_MASK,
+    BYTE_BITS,
+    BYTE_MASK,
+    MEM_SIZE,
+    PAGE_COUNT,
+    PAGE_SHIFT,
+    PAGE_SIZE,
+    ROM_START,
+    ROM_END,
+    VRAM_BLOCK_SHIFT,
+    VRAM_END,
+    VRAM_START,
+    WORD_MASK,
+)
+
+# called with [start, end) of the bytes that were overwritten
+type CodeWriteHook = Callable[[int, int], None]
+
+# why stores to a page must take the slow path
+WATCH_CODE = 0x01  # page holds predecoded or translated code
+WATCH_SNAPSHOT = 0x02  # page contents are shared with a snapshot
+WATCH_VRAM = 0x04  # page is in the VRAM window and tracked (track_vram)
+
+# one immutable copy per page, shared between snapshots of unchanged pages
+type PageCopies = tuple[bytes, ...]
+
+
+class Device(Protocol):
+    # addr is the full bus address
+    def load8(self, addr: int) -> int: ...
+
+    def store8(self, addr: int, val: int) -> None: ...
+
+
+class RamPage:
+    # plain read/write memory backed by Bus.mem
+    plain_load = True
+    plain_store = True
+
+    def __init__(self, mem: bytearray):
+        self.mem = mem
+
+    def load8(self, addr: int) -> int:
+        return self.mem[addr]
+
+    def store8(self, addr: int, val: int) -> None:
+        self.mem[addr] = val
+
+
+class RomPage(RamPage):
+    # read-only memory backed by Bus.mem
+    plain_store = False
+
+    def store8(self, addr: int, val: int) -> None:
+        # ROM area
+        return
+
+
+class MappedRomPage(RomPage):
+    # read-only memory served from an external image (e.g. an mmap)
+    plain_load = False
+
+    def __init__(self, image: Buffer):
+        self.image = image
+        self.size = len(image)
+
+    def load8(self, addr: int) -> int:
+        offset = addr - ROM_START
+        if offset < self.size:
+            return self.image[offset]
+        return 0
 
 
 class Bus:
+    """
+    64 KiB address space split into 256 pages of 256 bytes.
+
+    Each page is served by a handler: RAM, ROM or an MMIO device. RAM and
+    ROM pages are read straight from mem (words through a 16-bit view),
+    RAM pages are also written straight to mem unless something watches
+    them. Everything else goes through the page handler.
+    """
+
     def __init__(self):
         self.mem = bytearray(MEM_SIZE)
-        # TODO: PPU/APU connects here
 
-    def load8(self, addr: int) -> int:
-        addr &= ADDR_MASK
+        self._ram = RamPage(self.mem)
+        self._rom = RomPage(self.mem)
+        self._pages: list[Device] = [
+            self._rom if ROM_START <= (page << PAGE_SHIFT) <= ROM_END else self._ram
+            for page in range(PAGE_COUNT)
+        ]
+        self._watch = bytearray(PAGE_COUNT)  # WATCH_* bits
+        # copy of each page as of the last snapshot, None once written
+        self._page_copies: list[bytes | None] = [None] * PAGE_COUNT
 
-        # if VRAM_START <= addr <= VRAM_END:
-        #    return self.ppu.load_vram(addr)
+        # 1 if the page is accessed through mem directly
+        self._fast_load = bytearray(PAGE_COUNT)
+        self._fast_store = bytearray(PAGE_COUNT)
 
-        return self.mem[addr]
+        # aligned words; the 16-bit view is little-endian only on
+        # little-endian hosts, elsewhere words always take the byte path
+        self._words = memoryview(self.mem).cast("H")
+        if sys.byteorder == "little":
+            self._fast_word_load = self._fast_load
+            self._fast_word_store = self._fast_store
+        else:
+            self._fast_word_load = bytearray(PAGE_COUNT)
+            self._fast_word_store = bytearray(PAGE_COUNT)
+
+        for page in range(PAGE_COUNT):
+            self._refresh_page(page)
+
+        self._code_write_hooks: list[CodeWriteHook] = []
+
+        # one byte per VRAM block, set when the block changes while tracked;
+        # the reader clears it
+        self.vram_dirty = bytearray((VRAM_END + 1 - VRAM_START) >> VRAM_BLOCK_SHIFT)
+        self._vram_tracked = False
+
+    def load8(self, addr: int) -> int:
+        addr &= ADDR_MASK
+        page = addr >> PAGE_SHIFT
+        if self._fast_load[page]:
+            return self.mem[addr]
+        return self._pages[page].load8(addr)
 
     def store8(self, addr: int, val: int) -> None:
         addr &= ADDR_MASK
-        if ROM_START <= addr <= ROM_END:
-            # ROM area
+        page = addr >> PAGE_SHIFT
+        if self._fast_store[page]:
+            self.mem[addr] = val & BYTE_MASK
             return
 
-        val &= BYTE_MASK
-        self.mem[addr] = val
+        self._pages[page].store8(addr, val & BYTE_MASK)
+        if self._watch[page]:
+            self._watched_store(page, addr)
 
     def load16(self, addr: int) -> int:
+        addr &= ADDR_MASK
+        if not addr & 1 and self._fast_word_load[addr >> PAGE_SHIFT]:
+            return self._words[addr >> 1]
+
         l = self.load8(addr)
         h = self.load8(addr + 1)
         return l | (h << BYTE_BITS)
 
     def store16(self, addr: int, val: int) -> None:
+        addr &= ADDR_MASK
+        if not addr & 1 and self._fast_word_store[addr >> PAGE_SHIFT]:
+            self._words[addr >> 1] = val & WORD_MASK
+            return
+
         self.store8(addr, val & BYTE_MASK)
         self.store8(addr + 1, (val >> BYTE_BITS) & BYTE_MASK)
+
+    # bulk access
+    def write(self, addr: int, data: Buffer) -> None:
+        # privileged write (ignores ROM protection), e.g. to load a ROM
+        end = addr + len(data)
+        if addr < 0 or end > MEM_SIZE:
+            raise ValueError(f"write out of memory: {addr:04X}+{len(data)}")
+
+        for page in range(addr >> PAGE_SHIFT, (end + PAGE_SIZE - 1) >> PAGE_SHIFT):
+            handler = self._pages[page]
+            if isinstance(handler, MappedRomPage):
+                # serve the page from mem again, starting from its image bytes
+                start = page << PAGE_SHIFT
+                offset = start - ROM_START
+                image = bytes(handler.image[offset : offset + PAGE_SIZE])
+                self.mem[start : start + PAGE_SIZE] = image.ljust(PAGE_SIZE, b"\0")
+                self._pages[page] = self._rom
+                self._refresh_page(page)
+        self.mem[addr:end] = data
+        self.invalidate_code(addr, end)
+
+    def read(self, addr: int, length: int) -> bytes:
+        end = addr + length
+        pages = self._fast_load[
+            addr >> PAGE_SHIFT : (end + PAGE_SIZE - 1) >> PAGE_SHIFT
+        ]
+        if 0 <= addr and end <= MEM_SIZE and all(pages):
+            return bytes(self.mem[addr:end])
+        return bytes(self.load8(addr + i) for i in range(length))
+
+    # page table
+    def map_rom_image(self, image: Buffer) -> None:
+        # serve the ROM area from image without copying it into mem;
+        # bytes past the end of image read as 0
+        handler = MappedRomPage(image)
+        for page in range(ROM_START >> PAGE_SHIFT, (ROM_END >> PAGE_SHIFT) + 1):
+            self._pages[page] = handler
+            self._refresh_page(page)
+        self.invalidate_code(ROM_START, ROM_END + 1)
+
+    def map_device(self, base: int, size: int, device: Device) -> None:
+        # MMIO, e.g. at PPU_REG_BASE, APU_REG_BASE or IO_REG_BASE
+        if base % PAGE_SIZE or size % PAGE_SIZE or size <= 0:
+            raise ValueError(f"device range must be whole pages: {base:04X}+{size}")
+        if base + size > MEM_SIZE:
+            raise ValueError(f"device range out of memory: {base:04X}+{size}")
+
+        for page in range(base >> PAGE_SHIFT, (base + size) >> PAGE_SHIFT):
+            self._pages[page] = device
+            self._refresh_page(page)
+
+    def _refresh_page(self, page: int) -> None:
+        handler = self._pages[page]
+        plain_load = getattr(handler, "plain_load", False)
+        plain_store = getattr(handler, "plain_store", False)
+        self._fast_load[page] = plain_load
+        self._fast_store[page] = plain_store and not self._watch[page]
+
+    def _set_watch(self, page: int, bits: int) -> None:
+        if self._watch[page] & bits != bits:
+            self._watch[page] |= bits
+            self._refresh_page(page)
+
+    def _clear_watch(self, page: int, bits: int) -> None:
+        if self._watch[page] & bits:
+            self._watch[page] &= ~bits
+            self._refresh_page(page)
+
+    def _watched_store(self, page: int, addr: int) -> None:
+        if self._watch[page] & WATCH_SNAPSHOT:
+            self._drop_page_copy(page)
+        if self._watch[page] & WATCH_CODE:
+            self._notify_code_write(addr, addr + 1)
+        if self._watch[page] & WATCH_VRAM:
+            self.vram_dirty[(addr - VRAM_START) >> VRAM_BLOCK_SHIFT] = 1
+
+    # VRAM dirty tracking
+    def track_vram(self) -> None:
+        # from now on, changes to VRAM set vram_dirty; everything starts dirty
+        self._vram_tracked = True
+        self.vram_dirty[:] = b"\x01" * len(self.vram_dirty)
+        for page in range(VRAM_START >> PAGE_SHIFT, (VRAM_END >> PAGE_SHIFT) + 1):
+            self._set_watch(page, WATCH_VRAM)
+
+    def _mark_vram(self, start: int, end: int) -> None:
+        # [start, end) was changed without going through store8
+        if not self._vram_tracked:
+            return
+        start = max(start, VRAM_START)
+        end = min(end, VRAM_END + 1)
+        if start < end:
+            first = (start - VRAM_START) >> VRAM_BLOCK_SHIFT
+            last = (end - 1 - VRAM_START) >> VRAM_BLOCK_SHIFT
+            self.vram_dirty[first : last + 1] = b"\x01" * (last + 1 - first)
+
+    # snapshots (copy-on-write per page)
+    def snapshot_pages(self) -> PageCopies:
+        # only pages written since the previous snapshot are copied
+        copies = self._page_copies
+        mem = self.mem
+        for page in range(PAGE_COUNT):
+            if copies[page] is None:
+                start = page << PAGE_SHIFT
+                copies[page] = bytes(mem[start : start + PAGE_SIZE])
+                self._set_watch(page, WATCH_SNAPSHOT)
+        return tuple(copies)
+
+    def restore_pages(self, pages: PageCopies) -> None:
+        if len(pages) != PAGE_COUNT:
+            raise ValueError(f"expected {PAGE_COUNT} pages, got {len(pages)}")
+
+        copies = self._page_copies
+        for page, data in enumerate(pages):
+            if copies[page] is data:
+                # unchanged since it was shared with the snapshot
+                continue
+            start = page << PAGE_SHIFT
+            self.mem[start : start + PAGE_SIZE] = data
+            copies[page] = data
+            self._set_watch(page, WATCH_SNAPSHOT)
+            self._notify_code_write(start, start + PAGE_SIZE)
+            self._mark_vram(start, start + PAGE_SIZE)
+
+    def _drop_page_copy(self, page: int) -> None:
+        self._page_copies[page] = None
+        self._clear_watch(page, WATCH_SNAPSHOT)
+
+    # code cache support
+    def add_code_write_hook(self, hook: CodeWriteHook) -> None:
+        self._code_write_hooks.append(hook)
+
+    def watch_code(self, addr: int) -> None:
+        # an instruction word covers addr and addr + 1
+        for a in (addr, addr + 1):
+            page = (a & ADDR_MASK) >> PAGE_SHIFT
+            if not isinstance(self._pages[page], RomPage):
+                # stores never change ROM
+                self._set_watch(page, WATCH_CODE)
+
+    def invalidate_code(self, start: int, end: int) -> None:
+        # must be called after writing to mem directly (e.g. loading a ROM)
+        for page in range(start >> PAGE_SHIFT, (end + PAGE_SIZE - 1) >> PAGE_SHIFT):
+            if self._page_copies[page] is not None:
+                self._drop_page_copy(page)
+        self._notify_code_write(start, end)
+        self._mark_vram(start, end)
+
+    def _notify_code_write(self, start: int, end: int) -> None:
+        for hook in self._code_write_hooks:
+            hook(start, end)
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import struct
+import tempfile
+from collections import Counter, OrderedDict
+from collections.abc import Iterable
+from dataclasses import replace
+from pathlib import Path
+
+from . import lang
+from .lang import Compiler, If, Program, Stmt, While
+from .parser import KIND_CODES, Parser, TokenArrays, parse_program
+
+
+class CompileCache:
+    """
+    Content-addressed cache of compiled lang programs.
+
+    Entries are keyed by a hash of the source, lang.COMPILER_VERSION and
+    the Compiler options, kept in an in-process LRU and, if directory is
+    given, in one file of little-endian 16-bit words per entry. On a miss
+    the source is parsed one top-level statement at a time, reusing the
+    statements whose text was parsed before; code generation always sees
+    the whole program (register allocation is global).
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike | None = None,
+        max_entries: int = 256,
+        max_stmts: int = 4096,
+    ):
+        self.directory = Path(directory) if directory is not None else None
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_stmts = max_stmts
+        self._roms: OrderedDict[str, tuple[int, ...]] = OrderedDict()
+        # statement text -> statement parsed at offset 0
+        self._stmts: OrderedDict[str, Stmt] = OrderedDict()
+        # hits, disk_hits, misses, stmt_hits, stmt_misses
+        self.stats: Counter[str] = Counter()
+
+    def key(
+        self,
+        src: str,
+        live_out: Iterable[str] | None = None,
+        optimize: bool = True,
+        ir_passes: Iterable[str] | None = None,
+    ) -> str:
+        options = json.dumps(
+            {
+                "live_out": None if live_out is None else sorted(live_out),
+                "optimize": bool(optimize),
+                "ir_passes": None if ir_passes is None else list(ir_passes),
+            },
+            sort_keys=True,
+        )
+        h = hashlib.sha256()
+        for part in (str(lang.COMPILER_VERSION), options, src):
+            h.update(part.encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def compile(
+        self,
+        src: str,
+        live_out: Iterable[str] | None = None,
+        optimize: bool = True,
+        ir_passes: Iterable[str] | None = None,
+    ) -> list[int]:
+        # same words as Compiler(...).compile_program(parse_program(src))
+        if live_out is not None:
+            live_out = list(live_out)
+        if ir_passes is not None:
+            ir_passes = list(ir_passes)
+        key = self.key(src, live_out, optimize, ir_passes)
+
+        words = self._roms.get(key)
+        if words is not None:
+            self._roms.move_to_end(key)
+            self.stats["hits"] += 1
+            return list(words)
+
+        words = self._load(key)
+        if words is not None:
+            self.stats["disk_hits"] += 1
+        else:
+            self.stats["misses"] += 1
+            c = Compiler(live_out=live_out, optimize=optimize, ir_passes=ir_passes)
+            words = tuple(c.compile_program(self.parse(src)))
+            self._store(key, words)
+        self._remember(self._roms, key, words, self.max_entries)
+        return list(words)
+
+    def parse(self, src: str) -> Program:
+        # parse_program(src), reusing statements parsed before
+        tokens = TokenArrays(src)
+        bounds = _split_stmts(tokens)
+        if bounds is None:
+            # let the parser report the error
+            return parse_program(src)
+
+        stmts: list[Stmt] = []
+        for first, last in bounds:
+            start = tokens.starts[first]
+            end = tokens.ends[last]
+            text = src[start:end]
+            stmt = self._stmts.get(text)
+            if stmt is not None:
+                self._stmts.move_to_end(text)
+                self.stats["stmt_hits"] += 1
+            else:
+                self.stats["stmt_misses"] += 1
+                p = Parser(tokens.tokens(first, last))
+                stmt = p.parse_stmt()
+                if p.cur().kind != "EOF":
+                    return parse_program(src)
+                stmt = _shift_spans(stmt, -start)
+                self._remember(self._stmts, text, stmt, self.max_stmts)
+            stmts.append(_shift_spans(stmt, start))
+        return Program(stmts=stmts)
+
+    def clear(self) -> None:
+        # the in-process entries only
+        self._roms.clear()
+        self._stmts.clear()
+
+    def _path(self, key: str) -> Path:
+        assert self.directory is not None
+        return self.directory / f"{key}.rom"
+
+    def _load(self, key: str) -> tuple[int, ...] | None:
+        if self.directory is None:
+            return None
+        try:
+            data = self._path(key).read_bytes()
+        except OSError:
+            return None
+        if len(data) % 2:
+            return None
+        return struct.unpack(f"<{len(data) // 2}H", data)
+
+    def _store(self, key: str, words: tuple[int, ...]) -> None:
+        if self.directory is None:
+            return
+        data = struct.pack(f"<{len(words)}H", *words)
+        # write then rename, so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @staticmethod
+    def _remember(entries: OrderedDict, key: str, value, limit: int) -> None:
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > limit:
+            entries.popitem(last=False)
+
+
+_LBRACE = KIND_CODES["LBRACE"]
+_RBRACE = KIND_CODES["RBRACE"]
+_SEMICOLON = KIND_CODES["SEMICOLON"]
+_ELSE = KIND_CODES["ELSE"]
+
+
+def _split_stmts(tokens: TokenArrays) -> list[tuple[int, int]] | None:
+    # (first, last) token index of each top-level statement; None if the
+    # braces do not balance
+    bounds = []
+    depth = 0
+    first = 0
+    kinds = tokens.kinds
+    n = len(kinds) - 1  # EOF
+    for i in range(n):
+        kind = kinds[i]
+        if kind == _LBRACE:
+            depth += 1
+        elif kind == _RBRACE:
+            depth -= 1
+            if depth < 0:
+                return None
+        if depth:
+            continue
+        ends = kind == _SEMICOLON or (kind == _RBRACE and kinds[i + 1] != _ELSE)
+        if ends:
+            bounds.append((first, i))
+            first = i + 1
+    if depth or first != n:
+        return None
+    return bounds
+
+
+def _shift_spans(stmt: Stmt, delta: int) -> Stmt:
+    # copy of stmt with every span moved by delta (expressions are shared)
+    span = None if stmt.span is None else (stmt.span[0] + delta, stmt.span[1] + delta)
+    if isinstance(stmt, While):
+        body = [_shift_spans(s, delta) for s in stmt.body]
+        return replace(stmt, body=body, span=span)
+    if isinstance(stmt, If):
+        then_body = [_shift_spans(s, delta) for s in stmt.then_body]
+        else_body = stmt.else_body
+        if else_body is not None:
+            else_body = [_shift_spans(s, delta) for s in else_body]
+        return replace(stmt, then_body=then_body, else_body=else_body, span=span)
+    return replace(stmt, span=span)
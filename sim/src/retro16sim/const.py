@@ -11,6 +11,14 @@ BYTE_MASK = 0x00FF
 NEGATIVE_BIT = 0x8000  # bit 15
 IMM6_MASK = 0x003F  # 6 bits
 IMM6_SIGNBIT = 0x0020  # sign bit (bit 5)
+IMM6_MIN = -32
+IMM6_MAX = 31
+
+# packed flags (see CPU.flags)
+FLAG_Z = 0x8  # zero
+FLAG_N = 0x4  # negative
+FLAG_C = 0x2  # carry/borrow
+FLAG_V = 0x1  # overflow (signed)
 
 OFF12_MASK = 0x0FFF
 OFF12_SIGNBIT = 0x0800
@@ -36,11 +44,22 @@ SP = 7
 
 MEM_SIZE = 0x10000
 
+PAGE_SHIFT = 8
+PAGE_SIZE = 1 << PAGE_SHIFT  # 0x0100
+PAGE_COUNT = MEM_SIZE >> PAGE_SHIFT  # 256
+
 ROM_START = 0x0000
 ROM_END = 0x3FFF
+# interrupt handler addresses, one word per source (see interrupts.py)
+VECTOR_BASE = 0x3FF0
 
 VRAM_START = 0x8000
 VRAM_END = 0xBFFF
+VRAM_BLOCK_SHIFT = 5  # dirty tracking granule: 32 bytes, one 4bpp 8x8 tile
+
+# Machine.run_frame runs this many instructions, one cycle each (HALT none)
+FRAME_CYCLES = 10000
+FRAME_RATE = 60  # frames per second
 
 PPU_REG_BASE = 0xC000
 APU_REG_BASE = 0xC100
@@ -0,0 +1,161 @@
+from dataclasses import replace
+
+from .const import NEGATIVE_BIT, WORD_MASK
+from .lang_ast import (
+    Assign,
+    BinOp,
+    Cmp,
+    CmpZero,
+    Const,
+    Expr,
+    If,
+    Program,
+    Stmt,
+    Var,
+    While,
+)
+
+
+def to_word(value: int) -> int:
+    # signed 16-bit value of the machine word holding value
+    value &= WORD_MASK
+    return value - (WORD_MASK + 1) if value & NEGATIVE_BIT else value
+
+
+def eval_binop(op: str, a: int, b: int) -> int:
+    # same result as the code the compiler emits; "/" is unsigned, x / 0 = 0
+    a &= WORD_MASK
+    b &= WORD_MASK
+    if op == "+":
+        return to_word(a + b)
+    if op == "-":
+        return to_word(a - b)
+    if op == "*":
+        return to_word(a * b)
+    if op == "/":
+        return to_word(a // b) if b else 0
+    raise NotImplementedError(f"unknown op {op}")
+
+
+def fold_expr(expr: Expr) -> Expr:
+    if isinstance(expr, Const):
+        value = to_word(expr.value)
+        return expr if value == expr.value else Const(value)
+
+    if isinstance(expr, BinOp):
+        return _fold_binop(expr.op, fold_expr(expr.left), fold_expr(expr.right))
+
+    if isinstance(expr, CmpZero):
+        inner = fold_expr(expr.expr)
+        if isinstance(inner, Const):
+            return Const(int((inner.value == 0) == (expr.op == "==")))
+        return expr if inner is expr.expr else CmpZero(expr=inner, op=expr.op)
+
+    if isinstance(expr, Cmp):
+        left, right = fold_expr(expr.left), fold_expr(expr.right)
+        if isinstance(left, Const) and isinstance(right, Const):
+            return Const(int((left.value == right.value) == (expr.op == "==")))
+        if isinstance(right, Const) and right.value == 0:
+            return CmpZero(expr=left, op=expr.op)
+        if left is expr.left and right is expr.right:
+            return expr
+        return Cmp(left, op=expr.op, right=right)
+
+    return expr
+
+
+def _fold_binop(op: str, left: Expr, right: Expr) -> Expr:
+    lc = left.value if isinstance(left, Const) else None
+    rc = right.value if isinstance(right, Const) else None
+
+    if lc is not None and rc is not None:
+        return Const(eval_binop(op, lc, rc))
+
+    if op == "+":
+        if lc is not None:
+            # constant on the right
+            left, right, lc, rc = right, left, None, lc
+        if rc == 0:
+            return left
+    elif op == "-":
+        if rc == 0:
+            return left
+        if _same_var(left, right):
+            return Const(0)
+    elif op == "*":
+        if lc is not None:
+            left, right, lc, rc = right, left, None, lc
+        if rc == 0:
+            return Const(0)
+        if rc == 1:
+            return left
+    elif op == "/":
+        if rc == 1:
+            return left
+        if lc == 0:
+            return Const(0)
+
+    if (
+        op in ("+", "-")
+        and rc is not None
+        and isinstance(left, BinOp)
+        and left.op in ("+", "-")
+        and isinstance(left.right, Const)
+    ):
+        # (x +- a) +- b  ->  x + (+-a +- b)
+        a = left.right.value if left.op == "+" else -left.right.value
+        b = rc if op == "+" else -rc
+        return _fold_binop("+", left.left, Const(to_word(a + b)))
+
+    return BinOp(op, left, right)
+
+
+def _same_var(a: Expr, b: Expr) -> bool:
+    return isinstance(a, Var) and isinstance(b, Var) and a.name == b.name
+
+
+def fold_program(prog: Program, origin: dict[int, Stmt] | None = None) -> Program:
+    """
+    Fold constant subexpressions in every statement.
+
+    Statements without anything to fold are kept as they are; for the ones
+    rebuilt, origin (if given) maps id(new statement) to the original.
+    """
+    stmts = fold_stmts(prog.stmts, origin)
+    return prog if stmts is prog.stmts else Program(stmts=stmts)
+
+
+def fold_stmts(stmts: list[Stmt], origin: dict[int, Stmt] | None = None) -> list[Stmt]:
+    folded = [_fold_stmt(s, origin) for s in stmts]
+    if all(a is b for a, b in zip(folded, stmts)):
+        return stmts
+    return folded
+
+
+def _fold_stmt(s: Stmt, origin: dict[int, Stmt] | None) -> Stmt:
+    new = _fold_stmt_fields(s, origin)
+    if new is not s and origin is not None:
+        origin[id(new)] = s
+    return new
+
+
+def _fold_stmt_fields(s: Stmt, origin: dict[int, Stmt] | None) -> Stmt:
+    if isinstance(s, Assign):
+        expr = fold_expr(s.expr)
+        return s if expr == s.expr else replace(s, expr=expr)
+
+    if isinstance(s, While):
+        cond, body = fold_expr(s.cond), fold_stmts(s.body, origin)
+        if cond == s.cond and body is s.body:
+            return s
+        return replace(s, cond=cond, body=body)
+
+    if isinstance(s, If):
+        cond = fold_expr(s.cond)
+        then_body = fold_stmts(s.then_body, origin)
+        else_body = fold_stmts(s.else_body, origin) if s.else_body else s.else_body
+        if cond == s.cond and then_body is s.then_body and else_body is s.else_body:
+            return s
+        return replace(s, cond=cond, then_body=then_body, else_body=else_body)
+
+    raise NotImplementedError(f"unknown stmt: {s!r}")
@@ -1,3 +1,5 @@
+from typing import Callable
+
 from .const import (
     WORD_MASK,
     ADDR_MASK,
@@ -13,34 +15,77 @@ from .const import (
     REG_SHIFT_RS2,
     REG_SHIFT_RD,
     SP,
+    FLAG_Z,
+    FLAG_N,
+    FLAG_C,
+    FLAG_V,
 )
 from .isa import Op
 
+# how C/V are derived from _cv_a and _cv_b
+FLAGS_FIXED = 0  # _cv_a is C, _cv_b is V
+FLAGS_ADD = 1  # operands of the last a + b
+FLAGS_SUB = 2  # operands of the last a - b
+
 
 class CPU:
+    __slots__ = (
+        "reg",
+        "pc",
+        "bus",
+        "halted",
+        "waiting",
+        "preempted",
+        "ime",
+        "_zn",
+        "_cv_kind",
+        "_cv_a",
+        "_cv_b",
+        "_handlers",
+        "_decoded",
+    )
+
     def __init__(self, bus):
         self.reg = [0] * 8  # R0..R7, R0 is utilied as 0
         self.pc = 0  # program counter by byte
-        self.flag_z = False  # zero
-        self.flag_n = False  # negative (MSB=1)
-        self.flag_c = False  # carry/borrow
-        self.flag_v = False  # overflow (signed)
         self.bus = bus  # for memory access
         self.halted = False
-
+        # WAIT: halted until an interrupt is requested
+        self.waiting = False
+        # halted by preempt(), not by the program
+        self.preempted = False
+        # interrupt master enable; cleared on entry to a handler, set by RETI
+        self.ime = False
+
+        # Flags are computed lazily from the last flag-setting instruction.
+        # Z/N: from the last result (ALU or LD), C/V: from the operands of
+        # the last ALU operation.
+        self._zn = 1
+        self._cv_kind = FLAGS_FIXED
+        self._cv_a = 0
+        self._cv_b = 0
+
+        # opcode -> (handler, decoder)
         self._handlers = {
-            Op.ADD: self._exec_add,
-            Op.SUB: self._exec_sub,
-            Op.ADDI: self._exec_addi,
-            Op.LD: self._exec_ld,
-            Op.ST: self._exec_st,
-            Op.JMP: self._exec_jmp,
-            Op.JZ: self._exec_jz,
-            Op.CMP: self._exec_cmp,
-            Op.CMPI: self._exec_cmpi,
-            Op.JNZ: self._exec_jnz,
+            Op.ADD: (self._exec_add, self._decode_r),
+            Op.SUB: (self._exec_sub, self._decode_r),
+            Op.ADDI: (self._exec_addi, self._decode_i),
+            Op.LD: (self._exec_ld, self._decode_m),
+            Op.ST: (self._exec_st, self._decode_m),
+            Op.JMP: (self._exec_jmp, self._decode_j),
+            Op.JZ: (self._exec_jz, self._decode_j),
+            Op.CMP: (self._exec_cmp, self._decode_r),
+            Op.CMPI: (self._exec_cmpi, self._decode_i),
+            Op.JNZ: (self._exec_jnz, self._decode_j),
+            Op.RETI: (self._exec_reti, self._decode_none),
+            Op.WAIT: (self._exec_wait, self._decode_none),
+            Op.HALT: (self._exec_halt, self._decode_none),
         }
 
+        # predecoded instructions: pc -> (handler, operands)
+        self._decoded: dict[int, tuple[Callable[..., int], tuple[int, ...]]] = {}
+        bus.add_code_write_hook(self._invalidate_decoded)
+
     @property
     def sp(self) -> int:
         return self.reg[SP]
@@ -54,36 +99,62 @@ class CPU:
         self.pc = (self.pc + 2) & WORD_MASK
         return instr
 
-    def step(self, trace=False) -> int:
-        pc_before = self.pc
-        instr = self.fetch()
+    def step(self) -> int:
+        # tracing is a separate loop (tracing.run_traced)
+        pc = self.pc
+        entry = self._decoded.get(pc)
+        if entry is None:
+            entry = self._predecode(pc)
+
+        handler, operands = entry
+        self.pc = (pc + 2) & WORD_MASK
+        return handler(*operands)  # cycles
+
+    def preempt(self) -> None:
+        # stop the running loop where it next checks halted: after this
+        # instruction, or under the block engine after this block, so that
+        # the machine can deliver an interrupt (see Machine._run_steps)
+        if not self.halted:
+            self.halted = self.preempted = True
+
+    def interrupt(self, vector: int) -> None:
+        # push PC, then flags, and enter the handler at vector
+        bus = self.bus
+        sp = (self.reg[SP] - 2) & WORD_MASK
+        bus.store16(sp, self.pc)
+        sp = (sp - 2) & WORD_MASK
+        bus.store16(sp, self.flags)
+        self.reg[SP] = sp
+        self.pc = vector & WORD_MASK
+        self.ime = False
+        self.halted = self.waiting = False
+
+    def decode(self, instr: int) -> tuple[Op, tuple[int, ...]]:
         opcode_val = (instr >> OPCODE_SHIFT) & OPCODE_MASK
-        opcode = Op(opcode_val)  # mask is temporary
-        if trace:
-            print(f"PC={pc_before:04X}, INSTR={instr:04X}, OPCODE={opcode.name}")
-
-        if trace:
-            print(
-                "REG:",
-                [f"{r:04X}" for r in self.reg],
-                "FLAGS: ZNVC=",
-                int(self.flag_z),
-                int(self.flag_n),
-                int(self.flag_c),
-                int(self.flag_v),
-            )
-
-        if opcode == Op.HALT:
-            self.halted = True
-            return 0
-
         try:
-            handler = self._handlers[opcode]
+            _, decoder = self._handlers[opcode_val]
         except KeyError:
             raise RuntimeError(f"Unknown opcode: {opcode_val}")
-
-        handler(instr)
-        return 1
+        return Op(opcode_val), decoder(instr)
+
+    def _predecode(self, pc: int) -> tuple[Callable[..., int], tuple[int, ...]]:
+        opcode, operands = self.decode(self.bus.load16(pc))
+        entry = (self._handlers[opcode][0], operands)
+        self._decoded[pc] = entry
+        self.bus.watch_code(pc)
+        return entry
+
+    def _invalidate_decoded(self, start: int, end: int) -> None:
+        # an instruction at pc covers pc and pc + 1
+        decoded = self._decoded
+        if end - start <= len(decoded):
+            for addr in range(start - 1, end):
+                decoded.pop(addr & ADDR_MASK, None)
+        else:
+            span = end - start
+            stale = [pc for pc in decoded if ((pc + 1 - start) & ADDR_MASK) <= span]
+            for pc in stale:
+                del decoded[pc]
 
     type Reg = int
     type Imm = int
@@ -125,102 +196,184 @@ class CPU:
         # [15:12] opcode
         return r, base, off
 
-    def _decode_j(self, instr) -> Offset:
+    def _decode_j(self, instr) -> tuple[Offset]:
         # [11:0] offset12 (relative to PC / signed)
         off = instr & OFF12_MASK
         if off & OFF12_SIGNBIT:
             off -= OFF12_MASK + 1
         # [15:12] opcode
-        return off
+        return (off,)
 
-    def _update_flags_add(self, a, b, result) -> None:
-        self.flag_z = True if result == 0 else False
-        self.flag_n = bool(result & NEGATIVE_BIT)
+    def _decode_none(self, instr) -> tuple[()]:
+        # [11:0] unused
+        return ()
 
-        # False if no carry, True otherwise
-        self.flag_c = (a + b) > WORD_MASK
+    # flags
+    @property
+    def flag_z(self) -> bool:
+        # zero
+        return self._zn == 0
+
+    @flag_z.setter
+    def flag_z(self, value: bool) -> None:
+        # Z and N come from the same result, so setting one clears the other
+        if value:
+            self._zn = 0
+        elif self._zn == 0:
+            self._zn = 1
 
-        sa = bool(a & NEGATIVE_BIT)
-        sb = bool(b & NEGATIVE_BIT)
-        sr = bool(result & NEGATIVE_BIT)
-        self.flag_v = True if (sa == sb and sa != sr) else False
+    @property
+    def flag_n(self) -> bool:
+        # negative (MSB=1)
+        return bool(self._zn & NEGATIVE_BIT)
 
-    def _update_flags_sub(self, a, b, result) -> None:
-        # result = a - b
-        self.flag_z = True if result == 0 else False
-        self.flag_n = bool(result & NEGATIVE_BIT)
+    @flag_n.setter
+    def flag_n(self, value: bool) -> None:
+        if value:
+            self._zn = NEGATIVE_BIT
+        elif self._zn & NEGATIVE_BIT:
+            self._zn = 1
 
-        # True if no borrow, False otherwise
-        self.flag_c = a >= b
+    @property
+    def flag_c(self) -> bool:
+        # add: True if carry, sub: True if no borrow
+        kind, a, b = self._cv_kind, self._cv_a, self._cv_b
+        if kind == FLAGS_ADD:
+            return a + b > WORD_MASK
+        if kind == FLAGS_SUB:
+            return a >= b
+        return bool(a)
+
+    @flag_c.setter
+    def flag_c(self, value: bool) -> None:
+        v = self.flag_v
+        self._cv_kind, self._cv_a, self._cv_b = FLAGS_FIXED, bool(value), v
 
-        sa = bool(a & NEGATIVE_BIT)
-        sb = bool(b & NEGATIVE_BIT)
-        sr = bool(result & NEGATIVE_BIT)
-        self.flag_v = True if (sa != sb and sa != sr) else False
+    @property
+    def flag_v(self) -> bool:
+        # overflow (signed)
+        kind, a, b = self._cv_kind, self._cv_a, self._cv_b
+        if kind == FLAGS_ADD:
+            result = (a + b) & WORD_MASK
+            return bool((a ^ result) & (b ^ result) & NEGATIVE_BIT)
+        if kind == FLAGS_SUB:
+            result = (a - b) & WORD_MASK
+            return bool((a ^ b) & (a ^ result) & NEGATIVE_BIT)
+        return bool(b)
+
+    @flag_v.setter
+    def flag_v(self, value: bool) -> None:
+        c = self.flag_c
+        self._cv_kind, self._cv_a, self._cv_b = FLAGS_FIXED, c, bool(value)
 
-    def _exec_add(self, instr) -> None:
-        rd, rs1, rs2 = self._decode_r(instr)
+    @property
+    def flags(self) -> int:
+        # packed FLAG_Z | FLAG_N | FLAG_C | FLAG_V
+        return (
+            (FLAG_Z if self.flag_z else 0)
+            | (FLAG_N if self.flag_n else 0)
+            | (FLAG_C if self.flag_c else 0)
+            | (FLAG_V if self.flag_v else 0)
+        )
+
+    @flags.setter
+    def flags(self, value: int) -> None:
+        if value & FLAG_Z:
+            self._zn = 0
+        elif value & FLAG_N:
+            self._zn = NEGATIVE_BIT
+        else:
+            self._zn = 1
+        self._cv_kind = FLAGS_FIXED
+        self._cv_a = bool(value & FLAG_C)
+        self._cv_b = bool(value & FLAG_V)
+
+    def _exec_add(self, rd, rs1, rs2) -> int:
         a = self.reg[rs1]
         b = self.reg[rs2]
         result = (a + b) & WORD_MASK
         self.reg[rd] = result
-        self._update_flags_add(a, b, result)
+        self._zn = result
+        self._cv_kind, self._cv_a, self._cv_b = FLAGS_ADD, a, b
+        return 1
 
-    def _exec_addi(self, instr) -> None:
-        rd, rs, imm = self._decode_i(instr)
+    def _exec_addi(self, rd, rs, imm) -> int:
         a = self.reg[rs]
         b = imm & WORD_MASK
         result = (a + b) & WORD_MASK
         self.reg[rd] = result
-        self._update_flags_add(a, b, result)
+        self._zn = result
+        self._cv_kind, self._cv_a, self._cv_b = FLAGS_ADD, a, b
+        return 1
 
-    def _exec_sub(self, instr) -> None:
-        rd, rs1, rs2 = self._decode_r(instr)
+    def _exec_sub(self, rd, rs1, rs2) -> int:
         a = self.reg[rs1]
         b = self.reg[rs2]
         result = (a - b) & WORD_MASK
         self.reg[rd] = result
-        self._update_flags_sub(a, b, result)
+        self._zn = result
+        self._cv_kind, self._cv_a, self._cv_b = FLAGS_SUB, a, b
+        return 1
 
-    def _exec_cmp(self, instr) -> None:
-        rd, rs1, rs2 = self._decode_r(instr)
+    def _exec_cmp(self, rd, rs1, rs2) -> int:
         a = self.reg[rs1]
         b = self.reg[rs2]
-        result = (a - b) & WORD_MASK
-        self._update_flags_sub(a, b, result)
+        self._zn = (a - b) & WORD_MASK
+        self._cv_kind, self._cv_a, self._cv_b = FLAGS_SUB, a, b
+        return 1
 
-    def _exec_cmpi(self, instr) -> None:
-        rd, rs, imm = self._decode_i(instr)
+    def _exec_cmpi(self, rd, rs, imm) -> int:
         a = self.reg[rs]
         b = imm & WORD_MASK
-        result = (a - b) & WORD_MASK
-        self._update_flags_sub(a, b, result)
+        self._zn = (a - b) & WORD_MASK
+        self._cv_kind, self._cv_a, self._cv_b = FLAGS_SUB, a, b
+        return 1
 
-    def _exec_ld(self, instr) -> None:
-        rd, base, off = self._decode_m(instr)
+    def _exec_ld(self, rd, base, off) -> int:
         addr = (self.reg[base] + off) & ADDR_MASK
         val = self.bus.load16(addr)
         self.reg[rd] = val
-        self.flag_z = True if val == 0 else False
-        self.flag_n = bool(val & NEGATIVE_BIT)
+        self._zn = val  # C/V are kept
+        return 1
 
-    def _exec_st(self, instr) -> None:
-        rs, base, off = self._decode_m(instr)
+    def _exec_st(self, rs, base, off) -> int:
         addr = (self.reg[base] + off) & ADDR_MASK
         self.bus.store16(addr, self.reg[rs])
+        return 1
 
-    def _exec_jmp(self, instr) -> None:
-        off = self._decode_j(instr)
+    def _exec_jmp(self, off) -> int:
         # print(f"    [DEBUG] JMP: pc(before_exec) = {self.pc:04X}, off={off}")
         self.pc = (self.pc + off * 2) & WORD_MASK
         # print(f"    [DEBUG] JMP: pc(after_exec) = {self.pc:04X}")
+        return 1
 
-    def _exec_jz(self, instr) -> None:
-        off = self._decode_j(instr)
-        if self.flag_z:
+    def _exec_jz(self, off) -> int:
+        if self._zn == 0:
             self.pc = (self.pc + off * 2) & WORD_MASK
+        return 1
 
-    def _exec_jnz(self, instr) -> None:
-        off = self._decode_j(instr)
-        if not self.flag_z:
+    def _exec_jnz(self, off) -> int:
+        if self._zn != 0:
             self.pc = (self.pc + off * 2) & WORD_MASK
+        return 1
+
+    def _exec_reti(self) -> int:
+        # pop flags, then PC (see interrupt)
+        load16 = self.bus.load16
+        sp = self.reg[SP]
+        self.flags = load16(sp)
+        self.pc = load16((sp + 2) & ADDR_MASK)
+        self.reg[SP] = (sp + 4) & WORD_MASK
+        self.ime = True
+        # another interrupt may be pending
+        self.preempt()
+        return 1
+
+    def _exec_wait(self) -> int:
+        self.halted = self.waiting = True
+        return 1
+
+    def _exec_halt(self) -> int:
+        self.halted = True
+        self.preempted = False
+        return 0
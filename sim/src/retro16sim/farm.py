@@ -0,0 +1,128 @@
+from collections.abc import Iterable, Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from itertools import islice
+
+from .assembler import build_test_rom
+from .compile_cache import CompileCache
+from .const import MEM_SIZE
+from .machine import EngineKind, Machine
+
+# a ROM image, or lang source compiled in the worker
+type FarmJob = bytes | str
+
+# (addr, length) of a memory slice to report
+type MemRange = tuple[int, int]
+
+
+@dataclass(frozen=True)
+class FarmResult:
+    index: int  # position of the job in the input
+    regs: tuple[int, ...]  # requested registers, in request order
+    pc: int
+    halted: bool
+    cycles: int
+    mem: tuple[bytes, ...]  # requested memory slices, in request order
+
+
+@dataclass(frozen=True)
+class _Request:
+    steps: int
+    regs: tuple[int, ...]
+    mem: tuple[MemRange, ...]
+
+
+_ZERO_MEM = bytes(MEM_SIZE)
+
+# per-process machine, created once by _init_worker and reused for every job
+_machine: Machine | None = None
+
+# per-process cache for jobs given as source
+_compile_cache = CompileCache()
+
+
+def _init_worker(engine: EngineKind) -> None:
+    global _machine
+    _machine = Machine(engine=engine)
+
+
+def _run_job(m: Machine, job: FarmJob, req: _Request, index: int) -> FarmResult:
+    if isinstance(job, str):
+        job = build_test_rom(_compile_cache.compile(job))
+
+    m.bus.write(0, _ZERO_MEM)
+    m.reset()
+    m.cycles = 0
+    m.load_rom(job)
+    m.run_n_steps(req.steps)
+
+    cpu = m.cpu
+    return FarmResult(
+        index=index,
+        regs=tuple(cpu.reg[r] for r in req.regs),
+        pc=cpu.pc,
+        halted=cpu.halted,
+        cycles=m.cycles,
+        mem=tuple(m.bus.read(addr, length) for addr, length in req.mem),
+    )
+
+
+def _run_chunk(
+    start: int, jobs: list[FarmJob], req: _Request, machine: Machine | None = None
+) -> list[FarmResult]:
+    m = machine or _machine
+    assert m is not None, "worker not initialized"
+    return [_run_job(m, job, req, start + i) for i, job in enumerate(jobs)]
+
+
+def run_farm(
+    jobs: Iterable[FarmJob],
+    steps: int,
+    regs: Sequence[int] = range(8),
+    mem: Sequence[MemRange] = (),
+    *,
+    engine: EngineKind = "block",
+    max_workers: int | None = None,
+    chunk_size: int = 16,
+) -> Iterator[FarmResult]:
+    """
+    Run every job for up to steps instructions on a pool of worker processes.
+
+    Each worker keeps one Machine and reuses it for all of its jobs. Jobs are
+    sent in chunks of chunk_size and results are yielded as chunks finish, so
+    they arrive out of order; FarmResult.index gives the input position.
+    Only the requested registers and memory slices are sent back.
+
+    max_workers=0 runs everything in the calling process.
+    """
+    if chunk_size <= 0:
+        raise ValueError(f"chunk_size must be positive: {chunk_size}")
+    for addr, length in mem:
+        if addr < 0 or length < 0 or addr + length > MEM_SIZE:
+            raise ValueError(f"memory range out of memory: {addr:04X}+{length}")
+
+    req = _Request(steps=steps, regs=tuple(regs), mem=tuple(mem))
+    chunks = _chunks(jobs, chunk_size)
+
+    if max_workers == 0:
+        m = Machine(engine=engine)
+        for start, chunk in chunks:
+            yield from _run_chunk(start, chunk, req, m)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_init_worker, initargs=(engine,)
+    ) as pool:
+        futures = [
+            pool.submit(_run_chunk, start, chunk, req) for start, chunk in chunks
+        ]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def _chunks(jobs: Iterable[FarmJob], size: int) -> Iterator[tuple[int, list[FarmJob]]]:
+    it = iter(jobs)
+    start = 0
+    while chunk := list(islice(it, size)):
+        yield start, chunk
+        start += len(chunk)
@@ -0,0 +1,124 @@
+from .const import IO_REG_BASE, PAGE_SIZE, VECTOR_BASE
+from .cpu import CPU
+from .scheduler import Event, Scheduler
+
+# sources; the handler of source n is the word at VECTOR_BASE + 2 * n
+IRQ_VBLANK = 0  # end of every Machine.run_frame
+IRQ_TIMER = 1  # every TIMER_PERIOD cycles
+IRQ_IO = 2  # requested by the host (input, ...)
+IRQ_COUNT = 3
+
+# registers (words)
+INT_ENABLE = IO_REG_BASE + 0x00  # bit n enables source n
+INT_FLAGS = IO_REG_BASE + 0x02  # bit n: source n pending; writing 1 clears it
+INT_MASTER = IO_REG_BASE + 0x04  # bit 0: CPU.ime
+TIMER_PERIOD = IO_REG_BASE + 0x06  # cycles between timer interrupts, 0 is off
+
+
+class InterruptController:
+    """
+    Interrupt registers mapped at IO_REG_BASE (one page).
+
+    Requests are latched in INT_FLAGS and delivered by service(), which
+    the machine calls between runs of the CPU, i.e. at scheduler deadlines
+    (vblank and the timer are scheduler events) and after the CPU stopped
+    itself: WAIT, RETI, or a store to these registers that lets a pending
+    interrupt through (CPU.preempt). The engines need no per-instruction
+    check. Delivery takes the lowest pending source, clears its flag and
+    calls CPU.interrupt with its vector.
+    """
+
+    def __init__(self, cpu: CPU, scheduler: Scheduler):
+        self.cpu = cpu
+        self.bus = cpu.bus
+        self.scheduler = scheduler
+        self._timer: Event | None = None
+        self.delivered = [0] * IRQ_COUNT  # per source
+        cpu.bus.map_device(IO_REG_BASE, PAGE_SIZE, self)
+
+    def reset(self) -> None:
+        # registers cleared, timer stopped (its event is the caller's to
+        # drop, e.g. with Scheduler.clear)
+        mem = self.bus.mem
+        for addr in (INT_ENABLE, INT_FLAGS, TIMER_PERIOD):
+            mem[addr : addr + 2] = bytes(2)
+        self._timer = None
+
+    def load8(self, addr: int) -> int:
+        if addr == INT_MASTER:
+            return int(self.cpu.ime)
+        return self.bus.mem[addr]
+
+    def store8(self, addr: int, val: int) -> None:
+        mem = self.bus.mem
+        if addr in (INT_FLAGS, INT_FLAGS + 1):
+            mem[addr] &= ~val
+        elif addr == INT_MASTER:
+            self.cpu.ime = bool(val & 1)
+        else:
+            mem[addr] = val
+
+        if addr in (TIMER_PERIOD, TIMER_PERIOD + 1):
+            self.restart_timer()
+            # the running chunk does not know the new deadline
+            self.cpu.preempt()
+        elif self.cpu.ime and self.pending():
+            self.cpu.preempt()
+
+    def request(self, source: int) -> None:
+        # latched until delivered; call at a deadline or between runs
+        self.bus.mem[INT_FLAGS] |= 1 << source
+
+    def pending(self) -> int:
+        # enabled and requested sources
+        mem = self.bus.mem
+        enabled = mem[INT_ENABLE] | mem[INT_ENABLE + 1] << 8
+        flags = mem[INT_FLAGS] | mem[INT_FLAGS + 1] << 8
+        return enabled & flags & ((1 << IRQ_COUNT) - 1)
+
+    def service(self) -> None:
+        cpu = self.cpu
+        if cpu.preempted:
+            cpu.halted = cpu.preempted = False
+        pending = self.pending()
+        if not pending:
+            return
+        if cpu.waiting:
+            # WAIT ends even with interrupts disabled
+            cpu.halted = cpu.waiting = False
+        if cpu.ime and not cpu.halted:
+            source = (pending & -pending).bit_length() - 1
+            self.bus.mem[INT_FLAGS] &= ~(1 << source)
+            self.delivered[source] += 1
+            cpu.interrupt(self.bus.load16(VECTOR_BASE + 2 * source))
+
+    def _period(self) -> int:
+        return self.bus.mem[TIMER_PERIOD] | self.bus.mem[TIMER_PERIOD + 1] << 8
+
+    def timer_deadline(self) -> int | None:
+        timer = self._timer
+        if timer is None or timer.cancelled:
+            return None
+        return timer.cycle
+
+    def restart_timer(self, at: int | None = None) -> None:
+        # from TIMER_PERIOD; the first interrupt at cycle at, or a period
+        # from now
+        if self._timer is not None:
+            self.scheduler.cancel(self._timer)
+            self._timer = None
+        period = self._period()
+        if period:
+            if at is None:
+                self._timer = self.scheduler.after(period, self._tick)
+            else:
+                self._timer = self.scheduler.at(at, self._tick)
+
+    def _tick(self, cycle: int) -> None:
+        self.request(IRQ_TIMER)
+        # the period may have been zeroed behind our back (Bus.write)
+        period = self._period()
+        if period:
+            self._timer = self.scheduler.at(cycle + period, self._tick)
+        else:
+            self._timer = None
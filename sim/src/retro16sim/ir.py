@@ -0,0 +1,717 @@
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from itertools import count
+
+from .constfold import to_word
+from .lang_ast import (
+    Assign,
+    BinOp,
+    Cmp,
+    CmpZero,
+    Const,
+    Expr,
+    If,
+    Program,
+    Stmt,
+    Var,
+    While,
+)
+
+# value operations; all of them are pure, phis only appear in Block.phis
+BINARY_OPS = frozenset({"+", "-", "*", "/", "==", "!="})
+COMMUTATIVE_OPS = frozenset({"+", "*", "==", "!="})
+
+
+@dataclass(eq=False, slots=True)
+class Value:
+    op: str  # "const", "copy", "phi" or one of BINARY_OPS
+    args: list["Value"]
+    const: int = 0  # for "const"
+    var: str | None = None  # source variable the value was assigned to
+    stmt: Stmt | None = None  # source statement, for the line table
+    block: "Block | None" = None
+    id: int = 0
+
+    def __repr__(self) -> str:
+        return _value_name(self)
+
+
+@dataclass(eq=False, slots=True)
+class Jump:
+    target: "Block"
+
+
+@dataclass(eq=False, slots=True)
+class Branch:
+    # to if_true when cond is not 0
+    cond: Value
+    if_true: "Block"
+    if_false: "Block"
+
+
+@dataclass(eq=False, slots=True)
+class Halt:
+    pass
+
+
+type Terminator = Jump | Branch | Halt
+
+
+@dataclass(eq=False)
+class Block:
+    label: str
+    phis: list[Value] = field(default_factory=list)
+    instrs: list[Value] = field(default_factory=list)
+    term: Terminator | None = None
+    # phi arguments are in this order
+    preds: list["Block"] = field(default_factory=list)
+
+    def succs(self) -> list["Block"]:
+        if isinstance(self.term, Jump):
+            return [self.term.target]
+        if isinstance(self.term, Branch):
+            return [self.term.if_true, self.term.if_false]
+        return []
+
+    def __repr__(self) -> str:
+        return f"Block({self.label})"
+
+
+@dataclass(eq=False)
+class IfRegion:
+    # the preceding Block in the layout ends with the Branch
+    stmt: Stmt
+    then_body: list["Node"]
+    else_body: list["Node"]
+    join: Block
+
+
+@dataclass(eq=False)
+class LoopRegion:
+    # the preceding Block in the layout jumps to header (the preheader)
+    stmt: Stmt
+    header: Block
+    body: list["Node"]
+
+
+type Node = Block | IfRegion | LoopRegion
+
+
+@dataclass(eq=False)
+class Function:
+    """
+    Control flow graph of a program in SSA form.
+
+    blocks are in layout order, blocks[0] is the entry. body keeps the
+    structure of the source (If/While regions) so the graph can be turned
+    back into statements. Variables read before being written are 0.
+    """
+
+    blocks: list[Block]
+    body: list[Node]
+    # live-out variable -> its value at HALT
+    exit_values: dict[str, Value]
+    live_out: frozenset[str]
+
+    @property
+    def entry(self) -> Block:
+        return self.blocks[0]
+
+    def values(self) -> Iterator[Value]:
+        for b in self.blocks:
+            yield from b.phis
+            yield from b.instrs
+
+    def loops(self) -> list[LoopRegion]:
+        # innermost first
+        return list(_loops(self.body))
+
+    def replace_uses(self, mapping: dict[Value, Value]) -> None:
+        # every use of a key becomes a use of its (final) replacement
+        def resolve(v: Value) -> Value:
+            while v in mapping:
+                v = mapping[v]
+            return v
+
+        for v in self.values():
+            v.args = [resolve(a) for a in v.args]
+        for b in self.blocks:
+            if isinstance(b.term, Branch):
+                b.term.cond = resolve(b.term.cond)
+        for name, v in self.exit_values.items():
+            self.exit_values[name] = resolve(v)
+
+    def remove(self, dead: set[Value]) -> None:
+        for b in self.blocks:
+            b.phis = [v for v in b.phis if v not in dead]
+            b.instrs = [v for v in b.instrs if v not in dead]
+
+
+def _loops(nodes: list[Node]) -> Iterator[LoopRegion]:
+    for node in nodes:
+        if isinstance(node, IfRegion):
+            yield from _loops(node.then_body)
+            yield from _loops(node.else_body)
+        elif isinstance(node, LoopRegion):
+            yield from _loops(node.body)
+            yield node
+
+
+def region_blocks(nodes: list[Node]) -> Iterator[Block]:
+    for node in nodes:
+        if isinstance(node, Block):
+            yield node
+        elif isinstance(node, IfRegion):
+            yield from region_blocks(node.then_body)
+            yield from region_blocks(node.else_body)
+        else:
+            yield node.header
+            yield from region_blocks(node.body)
+
+
+def loop_blocks(loop: LoopRegion) -> list[Block]:
+    return [loop.header, *region_blocks(loop.body)]
+
+
+# building
+
+
+class _Builder:
+    def __init__(self):
+        self.blocks: list[Block] = []
+        self.vars: dict[str, Value] = {}
+        self.names: dict[str, None] = {}  # in order of first appearance
+        self._ids = count()
+        self.cur = self.new_block("entry")
+
+    def new_block(self, prefix: str) -> Block:
+        b = Block(f"{prefix}{len(self.blocks)}")
+        self.blocks.append(b)
+        return b
+
+    def value(self, op: str, args: list[Value], stmt: Stmt | None, **kw) -> Value:
+        v = Value(op, args, stmt=stmt, block=self.cur, id=next(self._ids), **kw)
+        if op == "phi":
+            self.cur.phis.append(v)
+        else:
+            self.cur.instrs.append(v)
+        return v
+
+    def jump(self, target: Block) -> None:
+        self.cur.term = Jump(target)
+        target.preds.append(self.cur)
+
+    def read(self, name: str, stmt: Stmt | None) -> Value:
+        self.names.setdefault(name)
+        v = self.vars.get(name)
+        if v is None:
+            v = self.value("const", [], stmt, const=0)
+        return v
+
+    def expr(self, e: Expr, stmt: Stmt) -> Value:
+        if isinstance(e, Const):
+            return self.value("const", [], stmt, const=to_word(e.value))
+        if isinstance(e, Var):
+            return self.read(e.name, stmt)
+        if isinstance(e, BinOp):
+            left, right = self.expr(e.left, stmt), self.expr(e.right, stmt)
+            return self.value(e.op, [left, right], stmt)
+        if isinstance(e, CmpZero):
+            left = self.expr(e.expr, stmt)
+            zero = self.value("const", [], stmt, const=0)
+            return self.value(e.op, [left, zero], stmt)
+        if isinstance(e, Cmp):
+            left, right = self.expr(e.left, stmt), self.expr(e.right, stmt)
+            return self.value(e.op, [left, right], stmt)
+        raise NotImplementedError(f"unknown expr: {e!r}")
+
+    def stmts(self, stmts: list[Stmt]) -> list[Node]:
+        nodes: list[Node] = [self.cur]
+        for s in stmts:
+            if isinstance(s, Assign):
+                self.names.setdefault(s.name)
+                v = self.expr(s.expr, s)
+                if v.op == "const" or v.var is not None or v.op == "phi":
+                    # keep one value per assignment so copies are explicit
+                    v = self.value("copy", [v], s)
+                v.var = s.name
+                self.vars[s.name] = v
+
+            elif isinstance(s, If):
+                nodes.append(self.if_region(s))
+                nodes.append(self.cur)
+
+            elif isinstance(s, While):
+                nodes.append(self.loop_region(s))
+                nodes.append(self.cur)
+
+            else:
+                raise NotImplementedError(f"unknown stmt: {s!r}")
+        return nodes
+
+    def if_region(self, s: If) -> IfRegion:
+        cond = self.expr(s.cond, s)
+        branch = self.cur
+        then_b, else_b = self.new_block("then"), self.new_block("else")
+        branch.term = Branch(cond, then_b, else_b)
+        then_b.preds.append(branch)
+        else_b.preds.append(branch)
+        before = dict(self.vars)
+
+        self.cur = then_b
+        then_nodes = self.stmts(s.then_body)
+        then_end, then_vars = self.cur, self.vars
+
+        self.cur, self.vars = else_b, dict(before)
+        else_nodes = self.stmts(s.else_body or [])
+        else_end, else_vars = self.cur, self.vars
+
+        join = self.new_block("join")
+        for end in (then_end, else_end):
+            self.cur = end
+            self.jump(join)
+
+        self.cur = join
+        self.vars = {}
+        for name in then_vars.keys() | else_vars.keys():
+            a, b = then_vars.get(name), else_vars.get(name)
+            if a is b:
+                self.vars[name] = a
+                continue
+            if a is None or b is None:
+                # defined on one path only: 0 on the other
+                self.cur = then_end if a is None else else_end
+                zero = self.value("const", [], s, const=0)
+                a, b = a or zero, b or zero
+                self.cur = join
+            self.vars[name] = self.value("phi", [a, b], s, var=name)
+        return IfRegion(s, then_nodes, else_nodes, join)
+
+    def loop_region(self, s: While) -> LoopRegion:
+        header = self.new_block("loop")
+        entry_vals = {name: self.read(name, s) for name in _assigned(s.body)}
+        self.jump(header)
+
+        self.cur = header
+        phis = {}
+        for name, v in entry_vals.items():
+            phis[name] = self.value("phi", [v], s, var=name)
+        self.vars.update(phis)
+        at_header = dict(self.vars)
+
+        cond = self.expr(s.cond, s)
+        body_b, exit_b = self.new_block("body"), self.new_block("exit")
+        header.term = Branch(cond, body_b, exit_b)
+        body_b.preds.append(header)
+        exit_b.preds.append(header)
+
+        self.cur = body_b
+        body_nodes = self.stmts(s.body)
+        for name, phi in phis.items():
+            phi.args.append(self.vars[name])
+        self.jump(header)
+
+        self.cur, self.vars = exit_b, at_header
+        return LoopRegion(s, header, body_nodes)
+
+
+def _assigned(stmts: list[Stmt]) -> dict[str, None]:
+    names: dict[str, None] = {}
+    for s in stmts:
+        if isinstance(s, Assign):
+            names.setdefault(s.name)
+        elif isinstance(s, If):
+            names.update(_assigned(s.then_body))
+            names.update(_assigned(s.else_body or []))
+        elif isinstance(s, While):
+            names.update(_assigned(s.body))
+    return names
+
+
+def build_ir(prog: Program, live_out: Iterable[str] | None = None) -> Function:
+    b = _Builder()
+    body = b.stmts(prog.stmts)
+    b.cur.term = Halt()
+    names = b.names.keys() if live_out is None else set(live_out) & b.names.keys()
+    exit_values = {name: b.read(name, None) for name in b.names if name in names}
+    return Function(b.blocks, body, exit_values, frozenset(names))
+
+
+# analysis
+
+
+def dominators(fn: Function) -> dict[Block, Block | None]:
+    # immediate dominators (Cooper, Harvey and Kennedy); None for the entry
+    order = _reverse_postorder(fn.entry)
+    index = {b: i for i, b in enumerate(order)}
+    idom: dict[Block, Block | None] = {fn.entry: fn.entry}
+
+    def intersect(a: Block, b: Block) -> Block:
+        while a is not b:
+            while index[a] > index[b]:
+                a = idom[a]
+            while index[b] > index[a]:
+                b = idom[b]
+        return a
+
+    changed = True
+    while changed:
+        changed = False
+        for b in order[1:]:
+            preds = [p for p in b.preds if p in idom]
+            new = preds[0]
+            for p in preds[1:]:
+                new = intersect(p, new)
+            if idom.get(b) is not new:
+                idom[b] = new
+                changed = True
+    idom[fn.entry] = None
+    return idom
+
+
+def _reverse_postorder(entry: Block) -> list[Block]:
+    seen: set[Block] = set()
+    post: list[Block] = []
+    stack = [(entry, iter(entry.succs()))]
+    seen.add(entry)
+    while stack:
+        b, it = stack[-1]
+        for s in it:
+            if s not in seen:
+                seen.add(s)
+                stack.append((s, iter(s.succs())))
+                break
+        else:
+            post.append(b)
+            stack.pop()
+    return post[::-1]
+
+
+def dominates(idom: dict[Block, Block | None], a: Block, b: Block | None) -> bool:
+    while b is not None:
+        if b is a:
+            return True
+        b = idom[b]
+    return False
+
+
+def verify(fn: Function) -> None:
+    # SSA invariants; raises RuntimeError
+    idom = dominators(fn)
+    defined = set(fn.values())
+    for b in fn.blocks:
+        if b.term is None:
+            raise RuntimeError(f"{b.label} has no terminator")
+        for s in b.succs():
+            if b not in s.preds:
+                raise RuntimeError(f"{b.label} missing from {s.label} preds")
+        for phi in b.phis:
+            if len(phi.args) != len(b.preds):
+                raise RuntimeError(f"{phi!r} has {len(phi.args)} args")
+            for arg, pred in zip(phi.args, b.preds):
+                _check_use(idom, defined, arg, pred, phi)
+        position = {v: i for i, v in enumerate(b.instrs)}
+        for v in b.instrs:
+            if v.block is not b:
+                raise RuntimeError(f"{v!r} is not in {b.label}")
+            for arg in v.args:
+                _check_use(idom, defined, arg, b, v)
+                if arg.block is b and position.get(arg, -1) >= position[v]:
+                    raise RuntimeError(f"{v!r} uses {arg!r} before it is defined")
+        if isinstance(b.term, Branch):
+            _check_use(idom, defined, b.term.cond, b, b.term)
+    for name, v in fn.exit_values.items():
+        if v not in defined:
+            raise RuntimeError(f"exit value of {name} is not defined")
+
+
+def _check_use(idom, defined: set[Value], arg: Value, at: Block, user) -> None:
+    if arg not in defined:
+        raise RuntimeError(f"{user!r} uses removed value {arg!r}")
+    if not dominates(idom, arg.block, at):
+        raise RuntimeError(f"{arg!r} does not dominate its use in {at.label}")
+
+
+def liveness(fn: Function) -> dict[Block, set[Value]]:
+    # values live at the end of each block (constants are never live: they
+    # are used in place); a phi argument is live at the end of its
+    # predecessor
+    live_out: dict[Block, set[Value]] = {b: set() for b in fn.blocks}
+    live_in: dict[Block, set[Value]] = {b: set() for b in fn.blocks}
+    changed = True
+    while changed:
+        changed = False
+        for b in reversed(fn.blocks):
+            out = _exit_uses(fn, b)
+            for s in b.succs():
+                out |= live_in[s]
+                k = s.preds.index(b)
+                out |= {phi.args[k] for phi in s.phis if phi.args[k].op != "const"}
+            live = _live_before(b, out)
+            if out != live_out[b] or live != live_in[b]:
+                live_out[b], live_in[b] = out, live
+                changed = True
+    return live_out
+
+
+def _exit_uses(fn: Function, b: Block) -> set[Value]:
+    if not isinstance(b.term, Halt):
+        return set()
+    return {v for v in fn.exit_values.values() if v.op != "const"}
+
+
+def _live_before(b: Block, out: set[Value]) -> set[Value]:
+    live = set(out)
+    if isinstance(b.term, Branch) and b.term.cond.op != "const":
+        live.add(b.term.cond)
+    for v in reversed(b.instrs):
+        live.discard(v)
+        live.update(a for a in v.args if a.op != "const")
+    return live - set(b.phis)
+
+
+def interference(fn: Function) -> dict[Value, set[Value]]:
+    # values live at the same time, from the definitions' point of view
+    graph: dict[Value, set[Value]] = {v: set() for v in fn.values()}
+
+    def define(v: Value, live: set[Value]) -> None:
+        for other in live:
+            if other is not v:
+                graph[v].add(other)
+                graph[other].add(v)
+
+    for b, out in liveness(fn).items():
+        live = set(out)
+        if isinstance(b.term, Branch) and b.term.cond.op != "const":
+            live.add(b.term.cond)
+        for v in reversed(b.instrs):
+            define(v, live)
+            live.discard(v)
+            live.update(a for a in v.args if a.op != "const")
+        for phi in b.phis:
+            define(phi, live | set(b.phis))
+    return graph
+
+
+def _value_name(v: Value) -> str:
+    # "%x.3" for values assigned to variable x, "%t.3" for the rest
+    return f"%{v.var or 't'}.{v.id}"
+
+
+def format_function(fn: Function) -> str:
+    lines = []
+    for b in fn.blocks:
+        preds = ", ".join(p.label for p in b.preds)
+        lines.append(f"{b.label}:" + (f"  ; preds {preds}" if preds else ""))
+        for v in b.phis + b.instrs:
+            lines.append(f"    {_value_name(v)} = {_format_rhs(v)}")
+        t = b.term
+        if isinstance(t, Jump):
+            lines.append(f"    jmp {t.target.label}")
+        elif isinstance(t, Branch):
+            lines.append(f"    br {t.cond!r}, {t.if_true.label}, {t.if_false.label}")
+        else:
+            lines.append("    halt")
+    exits = ", ".join(f"{n}={v!r}" for n, v in fn.exit_values.items())
+    lines.append(f"exit: {exits}")
+    return "\n".join(lines)
+
+
+def _format_rhs(v: Value) -> str:
+    if v.op == "const":
+        return str(v.const)
+    if v.op in BINARY_OPS:
+        return f"{v.args[0]!r} {v.op} {v.args[1]!r}"
+    return f"{v.op} " + ", ".join(repr(a) for a in v.args)
+
+
+# lowering back to statements
+
+
+class _Lowering:
+    def __init__(self, fn: Function, origin: dict[int, Stmt | None] | None):
+        self.fn = fn
+        self.origin = origin if origin is not None else {}
+        self._swaps = count()
+
+        # statements that own the copies on edges into a block
+        self.edge_stmt: dict[Block, Stmt] = {}
+        self.uses: dict[Value, int] = {}
+        for v in fn.values():
+            for a in v.args:
+                self.uses[a] = self.uses.get(a, 0) + 1
+        for b in fn.blocks:
+            if isinstance(b.term, Branch):
+                c = b.term.cond
+                self.uses[c] = self.uses.get(c, 0) + 1
+        for v in fn.exit_values.values():
+            self.uses[v] = self.uses.get(v, 0) + 1
+        self._index_regions(fn.body)
+        self.rep = self._coalesce()
+
+        # the variable holding a live-out value at HALT is the source one
+        self.names: dict[Value, str] = {}
+        for name, v in fn.exit_values.items():
+            if v.op != "const":
+                self.names.setdefault(self.rep[v], name)
+
+    def _index_regions(self, nodes: list[Node]) -> None:
+        for node in nodes:
+            if isinstance(node, IfRegion):
+                self.edge_stmt[node.join] = node.stmt
+                self._index_regions(node.then_body)
+                self._index_regions(node.else_body)
+            elif isinstance(node, LoopRegion):
+                self.edge_stmt[node.header] = node.stmt
+                self._index_regions(node.body)
+
+    def _coalesce(self) -> dict[Value, Value]:
+        # phis and copies share a variable with their arguments when their
+        # live ranges do not overlap, so most copies disappear
+        graph = interference(self.fn)
+        rep: dict[Value, Value] = {}
+        members: dict[Value, set[Value]] = {}
+
+        def find(v: Value) -> Value:
+            while v in rep:
+                v = rep[v]
+            return v
+
+        def union(a: Value, b: Value) -> None:
+            a, b = find(a), find(b)
+            if a is b or b.op == "const":
+                return
+            ma, mb = members.get(a, {a}), members.get(b, {b})
+            if any(graph[x] & mb for x in ma):
+                return
+            rep[b] = a
+            members[a] = ma | mb
+            members.pop(b, None)
+
+        for v in self.fn.values():
+            if v.op == "phi":
+                for arg in v.args:
+                    union(v, arg)
+            elif v.op == "copy":
+                union(v, v.args[0])
+        return {v: find(v) for v in self.fn.values()}
+
+    def name(self, v: Value) -> str:
+        # "." keeps the names apart from source identifiers
+        v = self.rep.get(v, v)
+        return self.names.get(v) or f"{v.var or 't'}.{v.id}"
+
+    def operand(self, v: Value) -> Expr:
+        # constants are used in place and never get a variable
+        if v.op == "const":
+            return Const(v.const)
+        return Var(self.name(v))
+
+    def rhs(self, v: Value) -> Expr:
+        if v.op == "copy":
+            return self.operand(v.args[0])
+        left, right = (self.operand(a) for a in v.args)
+        if v.op in ("==", "!="):
+            if isinstance(right, Const) and right.value == 0:
+                return CmpZero(expr=left, op=v.op)
+            return Cmp(left, op=v.op, right=right)
+        return BinOp(v.op, left, right)
+
+    def assign(self, name: str, expr: Expr, stmt: Stmt | None) -> Assign:
+        a = Assign(name, expr)
+        self.origin[id(a)] = stmt
+        return a
+
+    def inlined_cond(self, b: Block) -> Value | None:
+        # a comparison used only by the branch right after it is evaluated
+        # in the If/While condition itself
+        if not isinstance(b.term, Branch):
+            return None
+        c = b.term.cond
+        last = [v for v in b.instrs if v.op != "const"][-1:]
+        if c.op in ("==", "!=") and last == [c] and self.uses[c] == 1:
+            return c
+        return None
+
+    def cond(self, b: Block) -> Expr:
+        c = b.term.cond
+        return self.rhs(c) if c is self.inlined_cond(b) else self.operand(c)
+
+    def block(self, b: Block) -> list[Stmt]:
+        skip = self.inlined_cond(b)
+        out: list[Stmt] = [
+            self.assign(self.name(v), self.rhs(v), v.stmt)
+            for v in b.instrs
+            if v.op != "const" and v is not skip
+        ]
+        if isinstance(b.term, Jump):
+            target = b.term.target
+            k = target.preds.index(b)
+            pairs = [(self.name(phi), self.operand(phi.args[k])) for phi in target.phis]
+            out += self.parallel_copies(pairs, self.edge_stmt.get(target))
+        elif isinstance(b.term, Halt):
+            pairs = [(name, self.operand(v)) for name, v in self.fn.exit_values.items()]
+            out += self.parallel_copies(pairs, None)
+        return out
+
+    def parallel_copies(
+        self, pairs: list[tuple[str, Expr]], stmt: Stmt | None
+    ) -> list[Stmt]:
+        # sequentialize copies that all read their sources first
+        pending = {dst: src for dst, src in pairs if src != Var(dst)}
+        out: list[Stmt] = []
+        while pending:
+            read = {src.name for src in pending.values() if isinstance(src, Var)}
+            ready = [dst for dst in pending if dst not in read]
+            if not ready:
+                # a cycle: save one destination and read it from there
+                dst = next(iter(pending))
+                tmp = f"swap.{next(self._swaps)}"
+                out.append(self.assign(tmp, Var(dst), stmt))
+                for d, src in pending.items():
+                    if src == Var(dst):
+                        pending[d] = Var(tmp)
+                continue
+            for dst in ready:
+                out.append(self.assign(dst, pending.pop(dst), stmt))
+        return out
+
+    def nodes(self, nodes: list[Node]) -> list[Stmt]:
+        out: list[Stmt] = []
+        prev: Block | None = None
+        for node in nodes:
+            if isinstance(node, Block):
+                out += self.block(node)
+                prev = node
+            elif isinstance(node, IfRegion):
+                assert prev is not None
+                then_body = self.nodes(node.then_body)
+                else_body = self.nodes(node.else_body)
+                s = If(cond=self.cond(prev), then_body=then_body, else_body=else_body)
+                if not else_body:
+                    s.else_body = None
+                self.origin[id(s)] = node.stmt
+                out.append(s)
+            else:
+                # the header is evaluated before the loop and again at the
+                # end of each iteration
+                header = node.header
+                out += self.block(header)
+                body = self.nodes(node.body) + self.block(header)
+                s = While(cond=self.cond(header), body=body)
+                self.origin[id(s)] = node.stmt
+                out.append(s)
+        return out
+
+
+def lower_ir(fn: Function, origin: dict[int, Stmt | None] | None = None) -> Program:
+    """
+    Turn fn back into statements for Compiler.
+
+    Every SSA value that needs a register becomes a variable named
+    "<source variable>.<id>" and phis become copies at the end of their
+    predecessors; at HALT each live-out variable gets its final value.
+    origin (if given) maps id(new statement) to the source statement it
+    was generated for, or None.
+    """
+    return Program(stmts=_Lowering(fn, origin).nodes(fn.body))
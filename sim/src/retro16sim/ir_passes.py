@@ -0,0 +1,217 @@
+from collections import Counter
+from collections.abc import Callable, Iterable
+
+from .constfold import eval_binop, to_word
+from .ir import (
+    BINARY_OPS,
+    COMMUTATIVE_OPS,
+    Block,
+    Branch,
+    Function,
+    Value,
+    dominates,
+    dominators,
+    loop_blocks,
+    verify,
+)
+
+type Pass = Callable[[Function], bool]
+
+
+def constant_folding(fn: Function) -> bool:
+    # operations on constants become constants (in place)
+    changed = False
+    for v in fn.values():
+        if v.op in BINARY_OPS and all(a.op == "const" for a in v.args):
+            a, b = (to_word(arg.const) for arg in v.args)
+            if v.op in ("==", "!="):
+                v.const = int((a == b) == (v.op == "=="))
+            else:
+                v.const = eval_binop(v.op, a, b)
+            v.op, v.args = "const", []
+            changed = True
+    return changed
+
+
+def copy_propagation(fn: Function) -> bool:
+    # uses of copies and of trivial phis (one distinct argument besides the
+    # phi itself) read the source directly
+    mapping: dict[Value, Value] = {}
+    for v in fn.values():
+        if v.op == "copy":
+            mapping[v] = v.args[0]
+        elif v.op == "phi":
+            args = {id(a): a for a in v.args if a is not v}
+            if len(args) == 1:
+                mapping[v] = next(iter(args.values()))
+    if not mapping:
+        return False
+    fn.replace_uses(mapping)
+    fn.remove(set(mapping))
+    return True
+
+
+def dead_code_elimination(fn: Function) -> bool:
+    # everything is pure: keep what branches and live-out variables need
+    live: set[Value] = set()
+    work = list(fn.exit_values.values())
+    work += [b.term.cond for b in fn.blocks if isinstance(b.term, Branch)]
+    while work:
+        v = work.pop()
+        if v not in live:
+            live.add(v)
+            work.extend(v.args)
+
+    dead = {v for v in fn.values() if v not in live}
+    if not dead:
+        return False
+    fn.remove(dead)
+    return True
+
+
+def common_subexpressions(fn: Function) -> bool:
+    # dominator-tree value numbering
+    idom = dominators(fn)
+    children: dict[Block, list[Block]] = {b: [] for b in fn.blocks}
+    for b in fn.blocks:
+        parent = idom.get(b)
+        if parent is not None:
+            children[parent].append(b)
+
+    mapping: dict[Value, Value] = {}
+    scopes: list[dict[tuple, Value]] = []
+
+    def lookup(key: tuple) -> Value | None:
+        for scope in reversed(scopes):
+            if key in scope:
+                return scope[key]
+        return None
+
+    def visit(b: Block) -> None:
+        scope: dict[tuple, Value] = {}
+        scopes.append(scope)
+        for v in b.phis + b.instrs:
+            key = _value_key(v, mapping)
+            if key is None:
+                continue
+            seen = lookup(key)
+            if seen is None:
+                scope[key] = v
+            else:
+                mapping[v] = seen
+        for child in children[b]:
+            visit(child)
+        scopes.pop()
+
+    visit(fn.entry)
+    if not mapping:
+        return False
+    fn.replace_uses(mapping)
+    fn.remove(set(mapping))
+    return True
+
+
+def _value_key(v: Value, mapping: dict[Value, Value]) -> tuple | None:
+    args = [id(mapping.get(a, a)) for a in v.args]
+    if v.op == "const":
+        return ("const", v.const)
+    if v.op == "phi":
+        # same arguments in the same block
+        return ("phi", id(v.block), *args)
+    if v.op in COMMUTATIVE_OPS:
+        args.sort()
+    return (v.op, *args)
+
+
+def loop_invariant_code_motion(fn: Function) -> bool:
+    # values computed in a loop from values defined outside it move to the
+    # end of the preheader (the header's predecessor outside the loop).
+    # Only blocks that run on every iteration (they dominate the latch) are
+    # searched, so nothing under an If moves; "/" and "*" without a constant
+    # lower to counted loops and only move from the header, which runs even
+    # when the body does not
+    idom = dominators(fn)
+    changed = False
+    for loop in fn.loops():
+        blocks = loop_blocks(loop)
+        inside = set(blocks)
+        (pre,) = [p for p in loop.header.preds if p not in inside]
+        (latch,) = [p for p in loop.header.preds if p in inside]
+        every_iteration = [b for b in blocks if dominates(idom, b, latch)]
+        defined = {v for b in blocks for v in b.phis + b.instrs}
+        moved = True
+        while moved:
+            moved = False
+            for b in every_iteration:
+                for v in list(b.instrs):
+                    if any(a in defined for a in v.args):
+                        continue
+                    if b is not loop.header and _lowers_to_loop(v):
+                        continue
+                    b.instrs.remove(v)
+                    pre.instrs.append(v)
+                    v.block = pre
+                    defined.discard(v)
+                    moved = changed = True
+    return changed
+
+
+def _lowers_to_loop(v: Value) -> bool:
+    if v.op == "/":
+        return True
+    return v.op == "*" and all(a.op != "const" for a in v.args)
+
+
+PASSES: dict[str, Pass] = {
+    "constfold": constant_folding,
+    "copyprop": copy_propagation,
+    "cse": common_subexpressions,
+    "licm": loop_invariant_code_motion,
+    "dce": dead_code_elimination,
+}
+
+DEFAULT_PIPELINE = ("constfold", "copyprop", "cse", "licm", "dce")
+
+
+class PassManager:
+    """
+    Run a pipeline of IR passes until none of them changes anything.
+
+    Passes are names from PASSES or functions taking a Function and
+    returning whether they changed it. stats counts the rounds in which
+    each pass made a change; with check=True the SSA invariants are
+    verified after every pass.
+    """
+
+    def __init__(
+        self,
+        pipeline: Iterable[str | Pass] = DEFAULT_PIPELINE,
+        max_rounds: int = 10,
+        check: bool = False,
+    ):
+        self.passes: list[tuple[str, Pass]] = []
+        for p in pipeline:
+            if isinstance(p, str):
+                if p not in PASSES:
+                    raise ValueError(f"unknown pass: {p!r}")
+                self.passes.append((p, PASSES[p]))
+            else:
+                self.passes.append((p.__name__, p))
+        self.max_rounds = max_rounds
+        self.check = check
+        self.stats: Counter[str] = Counter()
+
+    def run(self, fn: Function) -> Function:
+        if self.check:
+            verify(fn)
+        for _ in range(self.max_rounds):
+            changed = False
+            for name, p in self.passes:
+                if p(fn):
+                    self.stats[name] += 1
+                    changed = True
+                    if self.check:
+                        verify(fn)
+            if not changed:
+                break
+        return fn
@@ -12,4 +12,6 @@ class Op(IntEnum):
     CMP = 0x7
     CMPI = 0x8
     JNZ = 0x9
+    RETI = 0xA
+    WAIT = 0xB
     HALT = 0xF
@@ -0,0 +1,497 @@
+from typing import Callable
+
+from .const import ADDR_MASK, WORD_MASK
+from .cpu import FLAGS_ADD, FLAGS_SUB
+from .isa import Op
+
+# longest straight-line run that is translated into one block
+MAX_BLOCK_LEN = 64
+
+# taken backward branches to a loop head before the loop is traced
+HOT_LOOP_THRESHOLD = 50
+
+# longest loop iteration that is compiled into one trace
+MAX_TRACE_BLOCKS = 16
+MAX_TRACE_LEN = 256
+
+# instructions that end a block
+BLOCK_END_OPS = frozenset({Op.JMP, Op.JZ, Op.JNZ, Op.HALT, Op.RETI, Op.WAIT})
+
+# left to CPU.step (blocks end before them)
+STEP_OPS = frozenset({Op.RETI, Op.WAIT})
+
+# instructions that write Z/N, and C/V
+ZN_OPS = frozenset({Op.ADD, Op.SUB, Op.ADDI, Op.CMP, Op.CMPI, Op.LD})
+CV_OPS = frozenset({Op.ADD, Op.SUB, Op.ADDI, Op.CMP, Op.CMPI})
+
+type Instr = tuple[int, Op, tuple[int, ...]]  # (pc, opcode, operands)
+
+
+class Block:
+    __slots__ = (
+        "start",
+        "length",
+        "size",
+        "instrs",
+        "loop_head",
+        "source",
+        "run",
+        "valid",
+    )
+
+    def __init__(self, start: int, instrs: list[Instr]):
+        self.start = start
+        self.length = len(instrs)  # instructions
+        self.size = self.length * 2  # bytes
+        self.instrs = instrs
+        # target of a backward branch at the end of the block
+        self.loop_head = _backward_target(instrs[-1])
+        self.source = ""
+        # run(cpu) -> number of executed instructions
+        self.run: Callable[..., int] | None = None
+        self.valid = True
+
+    def covers(self, start: int, end: int) -> bool:
+        # True if [start, end) overlaps this block
+        return ((self.start - start) & ADDR_MASK) < end - start or (
+            (start - self.start) & ADDR_MASK
+        ) < self.size
+
+
+class Trace:
+    """
+    One iteration of a hot loop, chained from the blocks it ran through.
+
+    The compiled function repeats the iteration until the budget runs out
+    or a conditional branch goes the other way than when it was recorded
+    (a guard exit), so the dispatcher is not involved between iterations.
+    """
+
+    __slots__ = ("head", "blocks", "length", "source", "run", "valid")
+
+    def __init__(self, head: int, blocks: list[Block]):
+        self.head = head
+        self.blocks = blocks
+        self.length = sum(blk.length for blk in blocks)  # per iteration
+        self.source = ""
+        # run(cpu, budget) -> number of executed instructions
+        self.run: Callable[..., int] | None = None
+        self.valid = True
+
+    def covers(self, start: int, end: int) -> bool:
+        return any(blk.covers(start, end) for blk in self.blocks)
+
+
+class BlockEngine:
+    """
+    Runs code as basic blocks translated into Python functions.
+
+    A block is a straight-line run of instructions that ends with
+    JMP/JZ/JNZ/HALT (RETI and WAIT run through CPU.step). Each block is
+    compiled once and cached by its start address; stores into a block's
+    bytes drop it from the cache. The CPU halting or being preempted is
+    only checked between blocks.
+
+    Taken backward branches are counted per target. Once a target gets
+    hot, the next iteration of the loop is recorded block by block and
+    compiled into a Trace that runs whole iterations in one call.
+    """
+
+    def __init__(self, cpu, bus):
+        self.cpu = cpu
+        self.bus = bus
+        self._blocks: dict[int, Block] = {}
+        self._traces: dict[int, Trace] = {}
+
+        # loop head -> taken backward branches (negative while backing off)
+        self._loop_counts: dict[int, int] = {}
+        self._recording: int | None = None  # loop head
+        self._recorded: list[Block] = []
+        # cycles run() has spent so far, up to the block or trace being run
+        # (device timestamps); 0 outside run()
+        self.run_cycles = 0
+
+        bus.add_code_write_hook(self._invalidate)
+
+    def run(self, budget: int) -> int:
+        # executes up to budget instructions (HALT included) like
+        # budget calls of CPU.step, and returns the cycles spent
+        cpu = self.cpu
+        blocks = self._blocks
+        traces = self._traces
+        steps = 0
+        cycles = 0
+        while steps < budget and not cpu.halted:
+            self.run_cycles = cycles
+            pc = cpu.pc
+            trace = traces.get(pc)
+            if trace is not None and trace.length <= budget - steps:
+                if self._recording is not None:
+                    self._abort_recording()
+                n = trace.run(cpu, budget - steps)
+                steps += n
+                cycles += n
+                continue
+
+            blk = blocks.get(pc)
+            if blk is None:
+                blk = self._translate(pc)
+
+            if blk is None or blk.length > budget - steps:
+                # not enough budget for the whole block
+                if self._recording is not None:
+                    self._abort_recording()
+                cycles += cpu.step()
+                steps += 1
+                continue
+
+            n = blk.run(cpu)
+            steps += n
+            cycles += n
+            if cpu.halted and not cpu.preempted:
+                cycles -= 1  # HALT takes no cycle
+
+            if self._recording is not None:
+                self._record(blk, n)
+            elif blk.loop_head is not None and cpu.pc == blk.loop_head:
+                self._count_backward_branch(blk.loop_head)
+        self.run_cycles = 0
+        return cycles
+
+    def _translate(self, pc: int) -> Block | None:
+        instrs: list[Instr] = []
+        addr = pc
+        while len(instrs) < MAX_BLOCK_LEN:
+            try:
+                opcode, operands = self.cpu.decode(self.bus.load16(addr))
+            except RuntimeError:
+                # leave unknown opcodes to CPU.step
+                break
+            if opcode in STEP_OPS:
+                break
+
+            instrs.append((addr, opcode, operands))
+            self.bus.watch_code(addr)
+            addr = (addr + 2) & ADDR_MASK
+            if opcode in BLOCK_END_OPS:
+                break
+
+        if not instrs:
+            return None
+
+        blk = Block(pc, instrs)
+        blk.source = _gen_block_source(instrs)
+        blk.run = self._compile(blk.source, f"<block {pc:04X}>", blk)
+        self._blocks[pc] = blk
+        return blk
+
+    def _compile(self, source: str, filename: str, owner: Block | Trace):
+        namespace = {
+            "owner": owner,
+            "load16": self.bus.load16,
+            "store16": self.bus.store16,
+        }
+        exec(compile(source, filename, "exec"), namespace)
+        return namespace["run"]
+
+    # hot loops
+    def _count_backward_branch(self, head: int) -> None:
+        count = self._loop_counts.get(head, 0) + 1
+        self._loop_counts[head] = count
+        if count >= HOT_LOOP_THRESHOLD and head not in self._traces:
+            # record the next iteration
+            self._recording = head
+            self._recorded = []
+
+    def _record(self, blk: Block, n: int) -> None:
+        cpu = self.cpu
+        recorded = self._recorded
+        if n < blk.length or cpu.halted or not blk.valid:
+            self._abort_recording()
+            return
+
+        if not recorded and blk.start != self._recording:
+            self._abort_recording()
+            return
+
+        recorded.append(blk)
+        if cpu.pc == self._recording:
+            self._finish_recording()
+        elif (
+            len(recorded) >= MAX_TRACE_BLOCKS
+            or sum(b.length for b in recorded) >= MAX_TRACE_LEN
+        ):
+            self._abort_recording()
+
+    def _finish_recording(self) -> None:
+        head = self._recording
+        recorded = self._recorded
+        self._recording = None
+        self._recorded = []
+
+        path: list[Instr] = []
+        guards: dict[int, int] = {}
+        for k, blk in enumerate(recorded):
+            path.extend(blk.instrs)
+            exit_pc = recorded[k + 1].start if k + 1 < len(recorded) else head
+            guards[len(path) - 1] = exit_pc
+
+        trace = Trace(head, recorded)
+        trace.source = _gen_trace_source(path, guards, head)
+        trace.run = self._compile(trace.source, f"<trace {head:04X}>", trace)
+        self._traces[head] = trace
+
+    def _abort_recording(self) -> None:
+        # back off before trying this loop again
+        self._loop_counts[self._recording] = -HOT_LOOP_THRESHOLD
+        self._recording = None
+        self._recorded = []
+
+    def _invalidate(self, start: int, end: int) -> None:
+        stale = [pc for pc, blk in self._blocks.items() if blk.covers(start, end)]
+        for pc in stale:
+            self._blocks.pop(pc).valid = False
+
+        stale = [pc for pc, tr in self._traces.items() if tr.covers(start, end)]
+        for pc in stale:
+            self._traces.pop(pc).valid = False
+            self._loop_counts.pop(pc, None)
+
+
+def _gen_block_source(instrs: list[Instr]) -> str:
+    n = len(instrs)
+    gen = _CodeGen(instrs, guards={})
+
+    lines = ["def run(cpu):", "    reg = cpu.reg"]
+    lines += gen.load_regs("    ")
+    lines += gen.body("    ", done="", carry=False)
+
+    pc, op, operands = instrs[-1]
+    next_pc = (pc + 2) & ADDR_MASK
+    if op == Op.JMP:
+        lines += gen.exit(n, str(_branch_target(instrs[-1])), "    ", str(n), False)
+    elif op in (Op.JZ, Op.JNZ):
+        target = _branch_target(instrs[-1])
+        zero = gen.zero_test(n, carry=False, want_zero=True)
+        taken, not_taken = (target, next_pc)
+        if op == Op.JNZ:
+            taken, not_taken = not_taken, taken
+        lines += gen.exit(
+            n, f"{taken} if {zero} else {not_taken}", "    ", str(n), False
+        )
+    elif op == Op.HALT:
+        lines.append("    cpu.halted = True")
+        lines.append("    cpu.preempted = False")
+        lines += gen.exit(n, str(next_pc), "    ", str(n), False)
+    else:
+        # block was cut (length limit or untranslatable next instruction)
+        lines += gen.exit(n, str(next_pc), "    ", str(n), False)
+
+    return "\n".join(lines) + "\n"
+
+
+def _gen_trace_source(path: list[Instr], guards: dict[int, int], head: int) -> str:
+    # The first iteration is peeled: until an instruction of the current
+    # iteration writes a flag, the flag comes from the CPU in the first
+    # iteration and from the previous iteration afterwards.
+    n = len(path)
+    gen = _CodeGen(path, guards)
+
+    lines = ["def run(cpu, budget):", "    reg = cpu.reg"]
+    lines += gen.load_regs("    ")
+    lines += gen.body("    ", done="", carry=False)
+    lines.append(f"    n = {n}")
+    loop = f"n <= budget - {n}"
+    if any(op == Op.ST for _, op, _ in path):
+        # a store may preempt the CPU (an interrupt register)
+        loop += " and not cpu.halted"
+    lines.append(f"    while {loop}:")
+    lines += gen.body("        ", done="n + ", carry=True)
+    lines.append(f"        n += {n}")
+    lines += gen.exit(n, str(head), "    ", "n", True)
+    return "\n".join(lines) + "\n"
+
+
+class _CodeGen:
+    # Registers live in locals r0..r7 while the code runs. Flags are only
+    # recorded at exits, from the instruction that wrote them last.
+
+    def __init__(self, instrs: list[Instr], guards: dict[int, int]):
+        self.instrs = instrs
+        # index of a branch -> pc execution continues at
+        self.guards = guards
+        self.used, self.written = _block_regs(instrs)
+
+        n = len(instrs)
+        self.zn_last = _last_index(instrs, n, ZN_OPS)
+        self.cv_last = _last_index(instrs, n, CV_OPS)
+
+        exits = [n]
+        for i, (_, op, _) in enumerate(instrs[:-1]):
+            if op == Op.ST or i in guards:
+                exits.append(i + 1)
+
+        self.needs_result: set[int] = set()
+        self.needs_operands: set[int] = set()
+        for e in exits:
+            for carry in (False, True):
+                zn, cv = self.zn_src(e, carry), self.cv_src(e, carry)
+                if zn is not None:
+                    self.needs_result.add(zn)
+                if cv is not None:
+                    self.needs_operands.add(cv)
+
+    def zn_src(self, e: int, carry: bool) -> int | None:
+        i = _last_index(self.instrs, e, ZN_OPS)
+        return self.zn_last if i is None and carry else i
+
+    def cv_src(self, e: int, carry: bool) -> int | None:
+        i = _last_index(self.instrs, e, CV_OPS)
+        return self.cv_last if i is None and carry else i
+
+    def load_regs(self, indent: str) -> list[str]:
+        return [f"{indent}r{r} = reg[{r}]" for r in sorted(self.used)]
+
+    def zero_test(self, e: int, carry: bool, want_zero: bool) -> str:
+        j = self.zn_src(e, carry)
+        if j is None:
+            return f"cpu._zn {'==' if want_zero else '!='} 0"
+        return f"t{j} {'==' if want_zero else '!='} 0"
+
+    def exit(self, e: int, next_pc: str, indent: str, count: str, carry: bool):
+        # e: instructions executed in the current pass
+        # count: expression returned as the number of executed instructions
+        out = [f"{indent}reg[{r}] = r{r}" for r in sorted(self.written)]
+        out += self._flag_code(self.zn_src(e, carry), self.cv_src(e, carry), indent)
+        out.append(f"{indent}cpu.pc = {next_pc}")
+        out.append(f"{indent}return {count}")
+        return out
+
+    def body(self, indent: str, done: str, carry: bool) -> list[str]:
+        # everything but block-ending branches, which are either exits
+        # (blocks) or guards (traces)
+        lines = []
+        n = len(self.instrs)
+        for i, (pc, op, operands) in enumerate(self.instrs):
+            next_pc = (pc + 2) & ADDR_MASK
+
+            if op in (Op.ADD, Op.SUB, Op.ADDI, Op.CMP, Op.CMPI):
+                rd, rs1 = operands[0], operands[1]
+                a = f"r{rs1}"
+                if op in (Op.ADDI, Op.CMPI):
+                    b = str(operands[2] & WORD_MASK)
+                else:
+                    b = f"r{operands[2]}"
+                sym = "+" if op in (Op.ADD, Op.ADDI) else "-"
+                writes = op in (Op.ADD, Op.SUB, Op.ADDI)
+
+                if i in self.needs_operands:
+                    lines.append(f"{indent}a{i} = {a}")
+                    a = f"a{i}"
+                    if not b.isdigit():
+                        lines.append(f"{indent}b{i} = {b}")
+                        b = f"b{i}"
+
+                expr = f"({a} {sym} {b}) & {WORD_MASK}"
+                if i in self.needs_result:
+                    lines.append(f"{indent}t{i} = {expr}")
+                    if writes:
+                        lines.append(f"{indent}r{rd} = t{i}")
+                elif writes:
+                    lines.append(f"{indent}r{rd} = {expr}")
+
+            elif op == Op.LD:
+                rd, base, off = operands
+                expr = f"load16((r{base} + {off}) & {ADDR_MASK})"
+                if i in self.needs_result:
+                    lines.append(f"{indent}t{i} = {expr}")
+                    lines.append(f"{indent}r{rd} = t{i}")
+                else:
+                    lines.append(f"{indent}r{rd} = {expr}")
+
+            elif op == Op.ST:
+                rs, base, off = operands
+                lines.append(f"{indent}store16((r{base} + {off}) & {ADDR_MASK}, r{rs})")
+                if i + 1 < n:
+                    # the store may have overwritten this code
+                    lines.append(f"{indent}if not owner.valid:")
+                    count = f"{done}{i + 1}"
+                    lines += self.exit(
+                        i + 1, str(next_pc), indent + "    ", count, carry
+                    )
+
+            elif op in (Op.JZ, Op.JNZ) and i in self.guards:
+                target = _branch_target(self.instrs[i])
+                if target == next_pc:
+                    continue
+                taken = self.guards[i] == target
+                # leave when the branch goes the other way
+                want_zero = (op == Op.JZ) != taken
+                zero = self.zero_test(i + 1, carry, want_zero)
+                other = next_pc if taken else target
+                count = f"{done}{i + 1}"
+                lines.append(f"{indent}if {zero}:")
+                lines += self.exit(i + 1, str(other), indent + "    ", count, carry)
+
+            elif op in BLOCK_END_OPS:
+                continue
+
+            else:
+                raise RuntimeError(f"cannot translate opcode: {op!r}")
+        return lines
+
+    def _flag_code(self, zn: int | None, cv: int | None, indent: str) -> list[str]:
+        # flags stay lazy in the CPU, see CPU.flag_z etc.
+        out = []
+        if zn is not None:
+            out.append(f"{indent}cpu._zn = t{zn}")
+
+        if cv is not None:
+            op, operands = self.instrs[cv][1], self.instrs[cv][2]
+            kind = FLAGS_ADD if op in (Op.ADD, Op.ADDI) else FLAGS_SUB
+            if op in (Op.ADDI, Op.CMPI):
+                b = str(operands[2] & WORD_MASK)
+            else:
+                b = f"b{cv}"
+            out.append(f"{indent}cpu._cv_kind = {kind}")
+            out.append(f"{indent}cpu._cv_a = a{cv}")
+            out.append(f"{indent}cpu._cv_b = {b}")
+        return out
+
+
+def _branch_target(instr: Instr) -> int:
+    pc, _, (off,) = instr
+    return (pc + 2 + off * 2) & ADDR_MASK
+
+
+def _backward_target(instr: Instr) -> int | None:
+    pc, op, operands = instr
+    if op in (Op.JMP, Op.JZ, Op.JNZ) and operands[0] < 0:
+        return _branch_target(instr)
+    return None
+
+
+def _last_index(instrs: list[Instr], end: int, ops: frozenset[Op]) -> int | None:
+    for i in range(end - 1, -1, -1):
+        if instrs[i][1] in ops:
+            return i
+    return None
+
+
+def _block_regs(instrs: list[Instr]) -> tuple[set[int], set[int]]:
+    used: set[int] = set()
+    written: set[int] = set()
+    for _, op, operands in instrs:
+        if op in (Op.ADD, Op.SUB):
+            used.update(operands)
+            written.add(operands[0])
+        elif op in (Op.ADDI, Op.LD):
+            used.update(operands[:2])
+            written.add(operands[0])
+        elif op == Op.CMP:
+            used.update(operands[1:])
+        elif op in (Op.CMPI, Op.ST):
+            if op == Op.ST:
+                used.add(operands[0])
+            used.add(operands[1])
+    return used, written
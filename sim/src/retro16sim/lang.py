@@ -1,5 +1,6 @@
-from abc import ABC
-from dataclasses import dataclass
+import functools
+from collections import Counter
+from collections.abc import Iterable
 from typing import List, Dict, Tuple, Literal
 
 from .assembler import (
@@ -11,87 +12,73 @@ from .assembler import (
     asm_jmp,
     asm_jz,
     asm_jnz,
+    asm_ld,
+    asm_st,
+    asm_sub,
 )
 
-from .const import R0, R1
-
-# AST definitions
-
-
-@dataclass
-class Expr(ABC):
-    pass
-
-
-@dataclass
-class Const(Expr):
-    value: int
-
-
-@dataclass
-class Var(Expr):
-    name: str
-
-
-@dataclass
-class BinOp(Expr):
-    op: str  # "+" or "-"
-    left: Expr
-    right: Expr
-
-
-@dataclass
-class Cond(Expr):
-    pass
-
-
-@dataclass
-class CmpZero(Cond):
-    expr: Expr
-    op: Literal["==", "!="]  # "==" or "!="
-
-
-@dataclass
-class Cmp(Cond):
-    left: Expr
-    op: Literal["==", "!="]
-    right: Expr
-
-
-@dataclass
-class Stmt(ABC):
-    pass
-
-
-@dataclass
-class Assign(Stmt):
-    name: str
-    expr: Expr
-
-
-@dataclass
-class While(Stmt):
-    cond: Cond
-    body: List[Stmt]
-
-
-@dataclass
-class If(Stmt):
-    cond: Cond
-    then_body: List[Stmt]
-    else_body: List[Stmt] | None = None
-
-
-@dataclass
-class Program:
-    stmts: List[Stmt]
+from .const import IMM6_MAX, IMM6_MIN, OPCODE_MASK, OPCODE_SHIFT, R0, SP
+from .constfold import fold_program, to_word
+from .ir import build_ir, lower_ir
+from .ir_passes import PassManager
+from .isa import Op
+from . import peephole
+from .peephole import Insn
+
+from .lang_ast import (
+    Expr,
+    Const,
+    Var,
+    BinOp,
+    CmpZero,
+    Cmp,
+    Stmt,
+    Assign,
+    While,
+    If,
+    Program,
+)
+from .regalloc import (
+    ALLOC_REGS,
+    FRAME_BIAS,
+    Allocation,
+    addi_form,
+    allocate,
+    cmp_operands,
+    is_imm6,
+    is_shift_mul,
+    mul_form,
+)
 
+# part of compile cache keys; bump when the same input compiles differently
+COMPILER_VERSION = 3
 
 type JumpKind = Literal["jmp", "jz", "jnz"]
 
+_JUMP_KIND_OPS: Dict[JumpKind, Op] = {"jmp": Op.JMP, "jz": Op.JZ, "jnz": Op.JNZ}
+_OP_JUMP_KINDS: Dict[Op, JumpKind] = {op: k for k, op in _JUMP_KIND_OPS.items()}
+
 
 class Compiler:
-    def __init__(self):
+    def __init__(
+        self,
+        live_out: Iterable[str] | None = None,
+        optimize=True,
+        ir_passes: Iterable[str] | None = None,
+    ):
+        # variables whose final values matter (None: all of them)
+        self.live_out = live_out
+
+        # fold constants before register allocation and run the peephole
+        # optimizer before patching jumps
+        self.optimize = optimize
+
+        # run the program through the SSA IR with these passes (names from
+        # ir_passes.PASSES) before register allocation; None: compile the
+        # AST directly
+        self.ir_passes = ir_passes
+        self.pass_stats: Counter[str] = Counter()
+
         # output (instructions)
         self.rom_words: List[int] = []
 
@@ -101,47 +88,117 @@ class Compiler:
         # jump instructions
         self.patches: List[Tuple[JumpKind, int, str]] = []
 
-        # variable -> register number
+        # variable -> register number (spilled variables are not here)
         self.var_regs: Dict[str, int] = {}
 
+        # spilled variable -> byte offset of its slot from frame_reg
+        self.var_slots: Dict[str, int] = {}
+        self.frame_reg = SP
+
         # suffix for labels
         self._label_counter = 0
 
-        # suffix for temporary variables
-        self._temp_counter = 0
+        # registers the current statement must not use for temporaries
+        self._busy: set[int] = set()
+        self._temps: list[int] = []
+        self._alloc: Allocation | None = None
 
-    # utilities
-    def alloc_reg_for_var(self, name: str) -> int:
-        if name in self.var_regs:
-            return self.var_regs[name]
+        # debug line table: instruction index -> enclosing statements,
+        # outermost first (empty for code outside any statement)
+        self.line_table: List[Tuple[Stmt, ...]] = []
+        self._stmt_stack: Tuple[Stmt, ...] = ()
 
-        # R0 is reserved for zero register
-        reg = R1 + len(self.var_regs)
-        self.var_regs[name] = reg
-        return reg
+        # id(generated statement) -> source statement it was folded or
+        # lowered from (None: no source statement)
+        self._origin: Dict[int, Stmt | None] = {}
 
+    # utilities
     def reg_of(self, name: str) -> int:
-        return self.alloc_reg_for_var(name)
-
-    def _alloc_temp_reg(self) -> int:
-        tmp_name = f"__tmp{self._temp_counter}"
-        self._temp_counter += 1
-        return self.alloc_reg_for_var(tmp_name)
-
-    def _eval_expr_to_reg(self, expr: Expr) -> int:
-        if isinstance(expr, Var):
-            return self.reg_of(expr.name)
-
-        else:
-            reg = self._alloc_temp_reg()
-            self.compile_expr(expr=expr, target_reg=reg)
-            return reg
+        try:
+            return self.var_regs[name]
+        except KeyError:
+            raise RuntimeError(f"variable {name!r} has no register") from None
+
+    def _enter_stmt(self, stmt: Stmt) -> None:
+        # registers holding variables that are live across stmt
+        assert self._alloc is not None
+        live = self._alloc.live[id(stmt)]
+        self._busy = {self.var_regs[v] for v in live if v in self.var_regs}
+        if isinstance(stmt, Assign) and stmt.name in self.var_regs:
+            self._busy.add(self.var_regs[stmt.name])
+        self._busy.add(self.frame_reg)
+
+    def _acquire_temp(self) -> int:
+        for reg in ALLOC_REGS:
+            if reg not in self._busy and reg not in self._temps:
+                self._temps.append(reg)
+                return reg
+        raise RuntimeError("out of temporary registers")
+
+    def _release_temp(self, reg: int) -> None:
+        self._temps.remove(reg)
+
+    def _operand(self, expr: Expr, scratch: int | None = None) -> Tuple[int, bool]:
+        # (register holding the value, whether it is a temporary to release);
+        # the value goes to scratch if given and a register is needed
+        if isinstance(expr, Var) and expr.name in self.var_regs:
+            return self.var_regs[expr.name], False
+
+        if isinstance(expr, Const) and to_word(expr.value) == 0:
+            return R0, False
+
+        if scratch is not None:
+            self.compile_expr(expr=expr, target_reg=scratch, scratch=True)
+            return scratch, False
+
+        reg = self._acquire_temp()
+        self.compile_expr(expr=expr, target_reg=reg, scratch=True)
+        return reg, True
+
+    def _slot_steps(self, name: str) -> Tuple[List[int], int]:
+        # ADDI steps from frame_reg to within LD/ST reach of name's slot and
+        # the offset left; none unless a large frame has a reserved frame_reg
+        off = self.var_slots[name]
+        steps = []
+        while off > IMM6_MAX:
+            steps.append(min(off - IMM6_MAX, IMM6_MAX))
+            off -= steps[-1]
+        return steps, off
+
+    def _store_var(self, name: str, reg: int) -> None:
+        # frame_reg moves to the slot and back
+        steps, off = self._slot_steps(name)
+        for step in steps:
+            self.emit(asm_addi(rd=self.frame_reg, rs=self.frame_reg, imm=step))
+        self.emit(asm_st(rs=reg, base=self.frame_reg, off=off))
+        for step in reversed(steps):
+            self.emit(asm_addi(rd=self.frame_reg, rs=self.frame_reg, imm=-step))
+
+    def _load_var(self, name: str, target_reg: int) -> None:
+        if name in self.var_slots:
+            # the address of a far slot is built in target_reg
+            steps, off = self._slot_steps(name)
+            base = self.frame_reg
+            for step in steps:
+                self.emit(asm_addi(rd=target_reg, rs=base, imm=step))
+                base = target_reg
+            self.emit(asm_ld(rd=target_reg, base=base, off=off))
+            return
+
+        src_reg = self.reg_of(name)
+        if src_reg == target_reg:
+            # do nothing
+            return
+
+        # no MOV so far
+        self.emit(asm_add(rd=target_reg, rs1=src_reg, rs2=R0))
 
     def current_index(self) -> int:
         return len(self.rom_words)
 
     def emit(self, word: int) -> None:
         self.rom_words.append(word)
+        self.line_table.append(self._stmt_stack)
 
     def mark_label(self, label: str) -> None:
         self.labels[label] = self.current_index()
@@ -161,42 +218,25 @@ class Compiler:
         self.emit(0)  # placeholder
         self.patches.append(("jnz", pos, label))
 
-    def compile_expr(self, expr: Expr, target_reg: int) -> None:
+    def compile_expr(self, expr: Expr, target_reg: int, scratch=False) -> None:
+        # scratch: target_reg may be overwritten before the result is ready
+        scratch_reg = target_reg if scratch else None
         if isinstance(expr, Const):
-            # target_reg = const
-            # notice R0 is utilized as zero register
-            self.emit(asm_addi(rd=target_reg, rs=R0, imm=expr.value))
+            self._emit_const(target_reg, expr.value)
 
         elif isinstance(expr, Var):
-            src_reg = self.reg_of(expr.name)
-            if src_reg == target_reg:
-                # do nothing
-                return
-
-            # no MOV so far
-            self.emit(asm_add(rd=target_reg, rs1=src_reg, rs2=R0))
+            self._load_var(expr.name, target_reg)
 
         elif isinstance(expr, BinOp):
-            # assume "Var +/- Const" for now
-            if isinstance(expr.left, Var) and isinstance(expr.right, Const):
-                var_reg = self.reg_of(expr.left.name)
-                imm = expr.right.value
-                if expr.op == "+":
-                    self.emit(asm_addi(rd=target_reg, rs=var_reg, imm=imm))
-                elif expr.op == "-":
-                    self.emit(asm_addi(rd=target_reg, rs=var_reg, imm=-imm))
-                else:
-                    raise NotImplementedError(f"unknown op {expr.op}")
-            else:
-                raise NotImplementedError(
-                    "BinOp accepts only Var +/- Const style for now"
-                )
+            self._compile_binop(expr, target_reg, scratch_reg)
 
         elif isinstance(expr, CmpZero):
-            tmp = self._eval_expr_to_reg(expr.expr)
+            tmp, is_temp = self._operand(expr.expr, scratch_reg)
 
             # compare tmp and 0
             self.emit(asm_cmpi(rs=tmp, imm=0))
+            if is_temp:
+                self._release_temp(tmp)
 
             # generates code like this:
             # if eq: jmp true
@@ -222,9 +262,17 @@ class Compiler:
             self.mark_label(end_label)
 
         elif isinstance(expr, Cmp):
-            left_reg = self._eval_expr_to_reg(expr.left)
-            right_reg = self._eval_expr_to_reg(expr.right)
-            self.emit(asm_cmp(rs1=left_reg, rs2=right_reg))
+            left, right = cmp_operands(expr)
+            left_reg, left_temp = self._operand(left, scratch_reg)
+            if is_imm6(right):
+                self.emit(asm_cmpi(rs=left_reg, imm=to_word(right.value)))
+                right_reg, right_temp = R0, False
+            else:
+                right_reg, right_temp = self._operand(right)
+                self.emit(asm_cmp(rs1=left_reg, rs2=right_reg))
+            for reg, is_temp in ((left_reg, left_temp), (right_reg, right_temp)):
+                if is_temp:
+                    self._release_temp(reg)
 
             true_label = self._new_label("cond_true")
             end_label = self._new_label("cond_end")
@@ -245,20 +293,175 @@ class Compiler:
         else:
             raise NotImplementedError(f"unknown expr: {expr!r}")
 
+    def _emit_const(self, target_reg: int, value: int) -> None:
+        # notice R0 is utilized as zero register
+        start, *steps = _const_plan(to_word(value))
+        self.emit(asm_addi(rd=target_reg, rs=R0, imm=start))
+        for step in steps:
+            if step is None:
+                self.emit(asm_add(rd=target_reg, rs1=target_reg, rs2=target_reg))
+            else:
+                self.emit(asm_addi(rd=target_reg, rs=target_reg, imm=step))
+
+    def _compile_binop(
+        self, expr: BinOp, target_reg: int, scratch_reg: int | None
+    ) -> None:
+        # operand evaluation order and temporaries follow regalloc.expr_need
+        if expr.op in ("+", "-"):
+            form = addi_form(expr)
+            if form is not None:
+                operand, imm = form
+                reg, is_temp = self._operand(operand, scratch_reg)
+                self.emit(asm_addi(rd=target_reg, rs=reg, imm=imm))
+                if is_temp:
+                    self._release_temp(reg)
+                return
+
+            left_reg, left_temp = self._operand(expr.left, scratch_reg)
+            right_reg, right_temp = self._operand(expr.right)
+            asm = asm_add if expr.op == "+" else asm_sub
+            self.emit(asm(rd=target_reg, rs1=left_reg, rs2=right_reg))
+            for reg, is_temp in ((left_reg, left_temp), (right_reg, right_temp)):
+                if is_temp:
+                    self._release_temp(reg)
+
+        elif expr.op == "*":
+            form = mul_form(expr)
+            if form is not None:
+                self._compile_mul_const(*form, target_reg, scratch_reg)
+            else:
+                self._compile_mul_loop(expr.left, expr.right, target_reg)
+
+        elif expr.op == "/":
+            self._compile_div_loop(expr.left, expr.right, target_reg)
+
+        else:
+            raise NotImplementedError(f"unknown op {expr.op}")
+
+    def _compile_mul_const(
+        self, x: Expr, value: int, target_reg: int, scratch_reg: int | None
+    ) -> None:
+        # shift-and-add over the bits of |value|, most significant first
+        m = abs(value)
+        if m == 0:
+            self.emit(asm_addi(rd=target_reg, rs=R0, imm=0))
+            return
+
+        if is_shift_mul(value):
+            x_reg, x_temp = self._operand(x, scratch_reg)
+        else:
+            x_reg, x_temp = self._operand(x)
+            if x_reg == target_reg:
+                # x is the variable being assigned; keep a copy
+                copy = self._acquire_temp()
+                self.emit(asm_add(rd=copy, rs1=x_reg, rs2=R0))
+                x_reg, x_temp = copy, True
+
+        bits = bin(m)[3:]
+        if not bits:
+            if x_reg != target_reg:
+                self.emit(asm_add(rd=target_reg, rs1=x_reg, rs2=R0))
+        else:
+            self.emit(asm_add(rd=target_reg, rs1=x_reg, rs2=x_reg))
+            for i, bit in enumerate(bits):
+                if i:
+                    self.emit(asm_add(rd=target_reg, rs1=target_reg, rs2=target_reg))
+                if bit == "1":
+                    self.emit(asm_add(rd=target_reg, rs1=target_reg, rs2=x_reg))
+        if value < 0:
+            self.emit(asm_sub(rd=target_reg, rs1=R0, rs2=target_reg))
+        if x_temp:
+            self._release_temp(x_reg)
+
+    def _compile_mul_loop(self, left: Expr, right: Expr, target_reg: int) -> None:
+        # no shifts right and no carry: add left to itself right times
+        left_reg, left_temp = self._operand(left)
+        counter = self._acquire_temp()
+        self.compile_expr(right, target_reg=counter, scratch=True)
+        acc = self._acquire_temp() if left_reg == target_reg else target_reg
+
+        loop_label = self._new_label("mul_loop")
+        end_label = self._new_label("mul_end")
+
+        self.emit(asm_addi(rd=acc, rs=R0, imm=0))
+        self.emit(asm_cmpi(rs=counter, imm=0))
+        self.emit_jz_label(end_label)
+        self.mark_label(loop_label)
+        self.emit(asm_add(rd=acc, rs1=acc, rs2=left_reg))
+        self.emit(asm_addi(rd=counter, rs=counter, imm=-1))
+        self.emit_jnz_label(loop_label)
+        self.mark_label(end_label)
+
+        if acc != target_reg:
+            self.emit(asm_add(rd=target_reg, rs1=acc, rs2=R0))
+            self._release_temp(acc)
+        self._release_temp(counter)
+        if left_temp:
+            self._release_temp(left_reg)
+
+    def _compile_div_loop(self, left: Expr, right: Expr, target_reg: int) -> None:
+        # unsigned, x / 0 = 0; only Z can be tested, so count left down to 0
+        # and bump the quotient each time a second counter runs through right
+        rest = self._acquire_temp()
+        self.compile_expr(left, target_reg=rest, scratch=True)
+        right_reg, right_temp = self._operand(right)
+        countdown = self._acquire_temp()
+        quot = self._acquire_temp() if right_reg == target_reg else target_reg
+
+        loop_label = self._new_label("div_loop")
+        end_label = self._new_label("div_end")
+
+        self.emit(asm_addi(rd=quot, rs=R0, imm=0))
+        self.emit(asm_cmpi(rs=right_reg, imm=0))
+        self.emit_jz_label(end_label)
+        self.emit(asm_add(rd=countdown, rs1=right_reg, rs2=R0))
+        self.mark_label(loop_label)
+        self.emit(asm_cmpi(rs=rest, imm=0))
+        self.emit_jz_label(end_label)
+        self.emit(asm_addi(rd=rest, rs=rest, imm=-1))
+        self.emit(asm_addi(rd=countdown, rs=countdown, imm=-1))
+        self.emit_jnz_label(loop_label)
+        self.emit(asm_addi(rd=quot, rs=quot, imm=1))
+        self.emit(asm_add(rd=countdown, rs1=right_reg, rs2=R0))
+        self.emit_jmp_label(loop_label)
+        self.mark_label(end_label)
+
+        if quot != target_reg:
+            self.emit(asm_add(rd=target_reg, rs1=quot, rs2=R0))
+            self._release_temp(quot)
+        self._release_temp(countdown)
+        if right_temp:
+            self._release_temp(right_reg)
+        self._release_temp(rest)
+
     def compile_stmt(self, stmt: Stmt) -> None:
+        outer = self._stmt_stack
+        source = self._origin.get(id(stmt), stmt)
+        if source is not None:
+            self._stmt_stack = outer + (source,)
+        try:
+            self._compile_stmt(stmt)
+        finally:
+            self._stmt_stack = outer
+
+    def _compile_stmt(self, stmt: Stmt) -> None:
+        self._enter_stmt(stmt)
         if isinstance(stmt, Assign):
-            reg = self.reg_of(stmt.name)
-            self.compile_expr(stmt.expr, target_reg=reg)
+            if stmt.name in self.var_regs:
+                reg = self.reg_of(stmt.name)
+                self.compile_expr(stmt.expr, target_reg=reg)
+            else:
+                reg = self._acquire_temp()
+                self.compile_expr(stmt.expr, target_reg=reg, scratch=True)
+                self._store_var(stmt.name, reg)
+                self._release_temp(reg)
 
         elif isinstance(stmt, While):
             loop_label = self._new_label("loop")
             end_label = self._new_label("while_end")
 
             self.mark_label(loop_label)
-
-            cond_reg = self._eval_expr_to_reg(stmt.cond)
-            self.emit(asm_cmpi(rs=cond_reg, imm=0))
-            self.emit_jz_label(end_label)
+            self._emit_cond_jz(stmt.cond, end_label)
 
             for s in stmt.body:
                 self.compile_stmt(s)
@@ -270,9 +473,7 @@ class Compiler:
             else_label = self._new_label("if_else")
             end_label = self._new_label("if_end")
 
-            cond_reg = self._eval_expr_to_reg(stmt.cond)
-            self.emit(asm_cmpi(rs=cond_reg, imm=0))
-            self.emit_jz_label(else_label)
+            self._emit_cond_jz(stmt.cond, else_label)
 
             for s in stmt.then_body:
                 self.compile_stmt(s)
@@ -292,18 +493,112 @@ class Compiler:
         else:
             raise NotImplementedError(f"unknown stmt: {stmt!r}")
 
+    def _emit_cond_jz(self, cond: Expr, label: str) -> None:
+        # jump to label if cond is 0
+        cond_reg, is_temp = self._operand(cond)
+        self.emit(asm_cmpi(rs=cond_reg, imm=0))
+        if is_temp:
+            self._release_temp(cond_reg)
+        self.emit_jz_label(label)
+
     def compile_program(self, prog: Program) -> list[int]:
+        if self.optimize:
+            prog = fold_program(prog, self._origin)
+        if self.ir_passes is not None:
+            prog = self._through_ir(prog)
+        self._alloc = allocate(prog, self.live_out)
+        self.var_regs = dict(self._alloc.regs)
+        self.var_slots = dict(self._alloc.slots)
+        self.frame_reg = self._alloc.frame_reg
+        self._emit_frame()
+
         for s in prog.stmts:
             self.compile_stmt(s)
 
         # put HALT in the last
         self.emit(asm_halt())
 
+        if self.optimize:
+            self._peephole()
+
         # solve all the labels
         self._patch_jumps()
 
         return self.rom_words
 
+    def _through_ir(self, prog: Program) -> Program:
+        fn = build_ir(prog, self.live_out)
+        manager = PassManager(self.ir_passes)
+        manager.run(fn)
+        self.pass_stats = manager.stats
+
+        # lowered statements point at source statements, not folded ones
+        lowered: Dict[int, Stmt | None] = {}
+        prog = lower_ir(fn, lowered)
+        folded = self._origin
+        self._origin = {
+            key: folded.get(id(stmt), stmt) if stmt is not None else None
+            for key, stmt in lowered.items()
+        }
+        # SSA values are variables now; only the source ones are results
+        self.live_out = fn.live_out
+        return prog
+
+    def _emit_frame(self) -> None:
+        # stack frame for spilled variables; slots read before being
+        # written start as 0 like registers do
+        if not self.var_slots:
+            return
+        # the highest slot ends where SP pointed before
+        frame = max(self.var_slots.values()) + 2
+        if self.frame_reg != SP:
+            frame += FRAME_BIAS
+        while frame > 0:
+            step = min(frame, -IMM6_MIN)
+            self.emit(asm_addi(rd=SP, rs=SP, imm=-step))
+            frame -= step
+        if self.frame_reg != SP:
+            self.emit(asm_addi(rd=self.frame_reg, rs=SP, imm=FRAME_BIAS))
+        for name in self.var_slots:
+            if name in self._alloc.entry_live:
+                self._store_var(name, R0)
+
+    def _peephole(self) -> None:
+        jumps = {pos: (kind, label) for kind, pos, label in self.patches}
+        labels_at: Dict[int, List[str]] = {}
+        for label, index in self.labels.items():
+            labels_at.setdefault(index, []).append(label)
+
+        insns = []
+        for i, word in enumerate(self.rom_words):
+            if i in jumps:
+                kind, label = jumps[i]
+                op, target = _JUMP_KIND_OPS[kind], label
+            else:
+                op, target = Op((word >> OPCODE_SHIFT) & OPCODE_MASK), None
+            insns.append(
+                Insn(op, word, target, labels_at.get(i, []), self.line_table[i])
+            )
+
+        # registers holding results at HALT
+        names = self.var_regs if self.live_out is None else self.live_out
+        exit_live = 1 << SP | 1 << self.frame_reg
+        for name in names:
+            if name in self.var_regs:
+                exit_live |= 1 << self.var_regs[name]
+
+        insns = peephole.optimize(insns, exit_live)
+
+        self.rom_words = [insn.word for insn in insns]
+        self.line_table = [insn.stmts for insn in insns]
+        self.labels = {}
+        self.patches = []
+        for i, insn in enumerate(insns):
+            for label in insn.labels:
+                self.labels[label] = i
+            if insn.target is not None:
+                self.patches.append((_OP_JUMP_KINDS[insn.op], i, insn.target))
+
     def _new_label(self, prefix: str) -> str:
         name = f"{prefix}_{self._label_counter}"
         self._label_counter += 1
@@ -329,6 +624,19 @@ class Compiler:
                 raise RuntimeError(f"unknown jump kind: {kind}")
 
 
+@functools.cache
+def _const_plan(value: int) -> Tuple[int | None, ...]:
+    # shortest way to build a signed 16-bit value: the first item is the
+    # ADDI from R0, then None doubles (ADD r, r, r) and an int is an ADDI
+    if IMM6_MIN <= value <= IMM6_MAX:
+        return (value,)
+    if value % 2 == 0:
+        return _const_plan(value // 2) + (None,)
+    low = ((value & 0x3F) ^ 0x20) - 0x20  # clears the low 6 bits
+    plans = [_const_plan(to_word(value - a)) + (a,) for a in (low, 1, -1)]
+    return min(plans, key=len)
+
+
 # entry point
 def compile_program_to_rom(prog: Program) -> list[int]:
     c = Compiler()
@@ -0,0 +1,79 @@
+from abc import ABC
+from dataclasses import dataclass, field
+from typing import List, Literal
+
+# AST definitions
+
+
+@dataclass(slots=True)
+class Expr(ABC):
+    pass
+
+
+@dataclass(slots=True)
+class Const(Expr):
+    value: int
+
+
+@dataclass(slots=True)
+class Var(Expr):
+    name: str
+
+
+@dataclass(slots=True)
+class BinOp(Expr):
+    op: str  # "+", "-", "*" or "/" (unsigned)
+    left: Expr
+    right: Expr
+
+
+@dataclass(slots=True)
+class Cond(Expr):
+    pass
+
+
+@dataclass(slots=True)
+class CmpZero(Cond):
+    expr: Expr
+    op: Literal["==", "!="]  # "==" or "!="
+
+
+@dataclass(slots=True)
+class Cmp(Cond):
+    left: Expr
+    op: Literal["==", "!="]
+    right: Expr
+
+
+# [start, end) character offsets into the source (Token.pos)
+type Span = tuple[int, int]
+
+
+@dataclass(slots=True)
+class Stmt(ABC):
+    # set by the parser; not part of equality
+    span: Span | None = field(default=None, kw_only=True, compare=False)
+
+
+@dataclass(slots=True)
+class Assign(Stmt):
+    name: str
+    expr: Expr
+
+
+@dataclass(slots=True)
+class While(Stmt):
+    cond: Cond
+    body: List[Stmt]
+
+
+@dataclass(slots=True)
+class If(Stmt):
+    cond: Cond
+    then_body: List[Stmt]
+    else_body: List[Stmt] | None = None
+
+
+@dataclass(slots=True)
+class Program:
+    stmts: List[Stmt]
@@ -1,40 +1,227 @@
+import mmap
+import os
+from dataclasses import dataclass
+from typing import Literal
+
 from .cpu import CPU
-from .bus import Bus
+from .bus import Bus, PageCopies
+from .jit import BlockEngine
+from .lang import Compiler
+from .parser import parse_program
+from .profiler import (
+    Profiler,
+    StmtProfile,
+    format_hot_list,
+    run_profiled,
+    statement_profile,
+)
+from .interrupts import IRQ_VBLANK, InterruptController
+from .scheduler import Scheduler
+from .tracing import TraceBuffer, run_traced
 from .assembler import build_test_rom
+from .const import FRAME_CYCLES
+
+try:
+    from .apu import APU
+    from .ppu import PPU
+except ImportError:  # numpy is optional
+    APU = PPU = None
+
+# "interp": CPU.step per instruction, "block": translated basic blocks
+type EngineKind = Literal["interp", "block"]
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    regs: tuple[int, ...]
+    pc: int
+    flags: int  # CPU.flags
+    halted: bool  # by the program (HALT, WAIT), not by CPU.preempt
+    waiting: bool
+    ime: bool
+    timer: int | None  # cycle of the next timer interrupt
+    cycles: int
+    pages: PageCopies  # Bus.mem; pages are shared with other snapshots
 
 
 class Machine:
-    def __init__(self):
+    def __init__(self, engine: EngineKind = "interp"):
         self.bus = Bus()
         self.cpu = CPU(self.bus)
-        # TODO: self.ppu = PPU(self.bus)
-        # TODO: self.apu = APU(self.bus)
+        # renders at the end of every run_frame; None without numpy
+        self.ppu = PPU(self.bus) if PPU is not None else None
+        # synthesizes at the end of every run_frame; None without numpy
+        self.apu = APU(self.bus, self._device_clock) if APU is not None else None
         self.cycles = 0
+        # device deadlines; the CPU runs uninterrupted between them
+        self.scheduler = Scheduler(self._device_clock)
+        # delivered between runs of the CPU, never inside one
+        self.interrupts = InterruptController(self.cpu, self.scheduler)
+        self._rom_image: mmap.mmap | None = None
+        # filled by run_step/run_n_steps with trace=True
+        self.trace_buffer: TraceBuffer | None = None
+        # opt-in; while set, runs go through the profiling loop
+        self.profiler: Profiler | None = None
+
+        if engine == "interp":
+            self.jit = None
+        elif engine == "block":
+            self.jit = BlockEngine(self.cpu, self.bus)
+        else:
+            raise ValueError(f"unknown engine: {engine!r}")
 
     def reset(self) -> None:
         self.cpu.pc = 0x0000
         self.cpu.reg = [0] * 8
         self.cpu.flag_z = self.cpu.flag_n = self.cpu.flag_c = self.cpu.flag_v = False
-        self.cpu.halted = False
+        self.cpu.halted = self.cpu.waiting = self.cpu.preempted = False
+        self.cpu.ime = False
+        # device events and state left by the previous run
+        self.scheduler.clear()
+        self.interrupts.reset()
+        if self.apu is not None:
+            self.apu.reset()
 
     def load_rom(self, data: bytes, addr=0x0000) -> None:
-        for i, b in enumerate(data):
-            self.bus.mem[addr + i] = b
+        self.bus.write(addr, data)
+
+    def load_rom_file(self, path: str | os.PathLike) -> None:
+        # maps the file instead of copying it into memory
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError(f"empty ROM file: {path}")
+            image = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.bus.map_rom_image(image)
+        if self._rom_image is not None:
+            self._rom_image.close()
+        self._rom_image = image
+
+    def snapshot(self) -> Snapshot:
+        # copies only the pages written since the previous snapshot
+        cpu = self.cpu
+        return Snapshot(
+            regs=tuple(cpu.reg),
+            pc=cpu.pc,
+            flags=cpu.flags,
+            halted=cpu.halted and not cpu.preempted,
+            waiting=cpu.waiting,
+            ime=cpu.ime,
+            timer=self.interrupts.timer_deadline(),
+            cycles=self.cycles,
+            pages=self.bus.snapshot_pages(),
+        )
+
+    def restore(self, snap: Snapshot) -> None:
+        cpu = self.cpu
+        cpu.reg = list(snap.regs)
+        cpu.pc = snap.pc
+        cpu.flags = snap.flags
+        cpu.halted = snap.halted
+        cpu.waiting = snap.waiting
+        cpu.preempted = False
+        cpu.ime = snap.ime
+        self.cycles = snap.cycles
+        self.bus.restore_pages(snap.pages)
+        self.interrupts.restart_timer(snap.timer)
+        if self.apu is not None:
+            self.apu.reset()  # its log belongs to the abandoned timeline
+
+    def run_source_profile(
+        self, src: str, n: int = 10000, limit: int | None = 10
+    ) -> list[StmtProfile]:
+        # compile and load src, run up to n steps with a profiler attached and
+        # print the hottest statements
+        c = Compiler()
+        self.load_rom(build_test_rom(c.compile_program(parse_program(src))))
+        # start from the program's entry, not where a previous run stopped
+        self.reset()
+        self.cycles = 0
+
+        prev, self.profiler = self.profiler, Profiler()
+        try:
+            self.run_n_steps(n)
+            rows = statement_profile(self.profiler, c.line_table)
+        finally:
+            self.profiler = prev
+
+        print(format_hot_list(rows, src, limit))
+        return rows
 
     def run_frame(self) -> None:
-        # cycles in a frame
-        for _ in range(10000):
-            if self.cpu.halted:
-                break
-            self.cycles += self.cpu.step()
-            # TODO: handle PPU/APU
+        start = self.cycles
+        end = start + FRAME_CYCLES
+        self.scheduler.at(end, lambda _: self._end_frame(start))
+        self._run_steps(FRAME_CYCLES)
+        # halted early: the rest of the frame's events still happen
+        self.scheduler.run_due(end)
+
+    def _end_frame(self, start: int) -> None:
+        # vblank
+        if self.ppu is not None:
+            self.ppu.render()
+        if self.apu is not None:
+            self.apu.end_frame(start)
+        self.interrupts.request(IRQ_VBLANK)
+
+    def _device_clock(self) -> int:
+        # cycle of the running instruction; under the block engine, of the
+        # start of the running block or trace, under the profiler, of the
+        # start of the run
+        if self.jit is not None:
+            return self.cycles + self.jit.run_cycles
+        return self.cycles
 
     def run_step(self, trace=False) -> None:
-        if not self.cpu.halted:
-            self.cycles += self.cpu.step(trace=trace)
+        self.run_n_steps(1, trace=trace)
 
     def run_n_steps(self, n: int, trace=False) -> None:
-        for _ in range(n):
-            if self.cpu.halted:
+        self._run_steps(n, trace)
+
+    def _run_steps(self, n: int, trace=False) -> None:
+        # up to n cycles, stopping at each scheduler deadline to run the
+        # events due; interrupts are delivered between the runs
+        cpu = self.cpu
+        scheduler = self.scheduler
+        service = self.interrupts.service
+        while n > 0:
+            service()
+            if cpu.halted and not cpu.waiting:
                 break
-            self.run_step(trace=trace)
+            deadline = scheduler.next_deadline()
+            if deadline is None:
+                if cpu.halted:
+                    break  # waiting for nothing
+                chunk = n
+            else:
+                chunk = min(n, deadline - self.cycles)
+                if chunk <= 0:
+                    scheduler.run_due(self.cycles)
+                    continue
+
+            if cpu.halted:
+                # WAIT: nothing happens before the next event
+                self.cycles += chunk
+            else:
+                start = self.cycles
+                self._run_cpu(chunk, trace)
+                chunk = self.cycles - start  # less if the CPU stopped
+            n -= chunk
+            scheduler.run_due(self.cycles)
+
+    def _run_cpu(self, n: int, trace=False) -> None:
+        # up to n instructions without interruption
+        if trace:
+            if self.trace_buffer is None:
+                self.trace_buffer = TraceBuffer()
+            self.cycles += run_traced(self.cpu, self.trace_buffer, n)
+        elif self.profiler is not None:
+            self.cycles += run_profiled(self.cpu, self.profiler, n)
+        elif self.jit is not None:
+            self.cycles += self.jit.run(n)
+        else:
+            cpu = self.cpu
+            for _ in range(n):
+                if cpu.halted:
+                    break
+                self.cycles += cpu.step()
@@ -1,7 +1,9 @@
 import re
-from typing import NamedTuple, Literal, List
+from array import array
+from collections.abc import Iterable, Iterator
+from typing import NamedTuple, Literal, List, get_args
 
-from .lang import (
+from .lang_ast import (
     Program,
     Stmt,
     Assign,
@@ -45,15 +47,23 @@ class Token(NamedTuple):
     pos: int
 
 
+class LexError(SyntaxError):
+    # input that matches no token rule
+    def __init__(self, msg: str, pos: int):
+        super().__init__(msg)
+        self.pos = pos
+
+
 KEYWORDS = {
     "while": "WHILE",
     "if": "IF",
     "else": "ELSE",
 }
 
+WS_PATTERN = r"[ \t\n\r]*"
+
 TOKEN_SPEC = [
-    ("WS", r"[ \t\n\r]+"),
-    ("INT", r"-?\d+"),
+    ("INT", r"\d+"),  # "-" is always MINUS, so "x-1" is x - 1
     ("IDENT", r"[A-Za-z_][A-Za-z0-9_]*"),
     ("EQEQ", r"=="),
     ("NEQ", r"!="),
@@ -69,43 +79,146 @@ TOKEN_SPEC = [
     ("SLASH", r"/"),
 ]
 
-MASTER_RE = re.compile(
-    "|".join(f"(?P<{name}>{pattern})" for name, pattern in TOKEN_SPEC)
+# whitespace, then one token (or nothing at the end of the input and at
+# characters no rule matches)
+TOKEN_RE = re.compile(
+    WS_PATTERN
+    + "(?:"
+    + "|".join(f"(?P<{name}>{pattern})" for name, pattern in TOKEN_SPEC)
+    + ")?"
 )
 
+# kind codes for TokenArrays, in TokenKind order
+KIND_NAMES: tuple[TokenKind, ...] = get_args(TokenKind)
+KIND_CODES: dict[str, int] = {name: i for i, name in enumerate(KIND_NAMES)}
+_GROUP_CODES = {i: KIND_CODES[name] for name, i in TOKEN_RE.groupindex.items()}
+_KEYWORD_CODES = {text: KIND_CODES[kind] for text, kind in KEYWORDS.items()}
+_IDENT = KIND_CODES["IDENT"]
+_EOF = KIND_CODES["EOF"]
 
-def tokenize(src: str) -> List[Token]:
-    tokens: List[Token] = []
+
+def _lex_error(src: str, pos: int) -> LexError:
+    line = src.count("\n", 0, pos) + 1
+    col = pos - (src.rfind("\n", 0, pos) + 1) + 1
+    return LexError(
+        f"unexpected character {src[pos]!r} at {pos} (line {line}, column {col})",
+        pos,
+    )
+
+
+def iter_tokens(src: str) -> Iterator[Token]:
+    # tokens one at a time, ending with EOF; raises LexError
+    match = TOKEN_RE.match
+    end = len(src)
     pos = 0
-    for m in MASTER_RE.finditer(src):
+    while True:
+        m = match(src, pos)
         kind = m.lastgroup
-        text = m.group()
-        pos = m.start()
+        if kind is None:
+            if m.end() == end:
+                yield Token("EOF", "", end)
+                return
+            raise _lex_error(src, m.end())
+        start = m.start(kind)
+        pos = m.end()
+        text = src[start:pos]
+        if kind == "IDENT":
+            kind = KEYWORDS.get(text, kind)
+        yield Token(kind, text, start)
 
-        if kind == "WS":
-            continue
-        elif kind == "IDENT" and text in KEYWORDS:
-            tokens.append(Token(KEYWORDS[text], text, pos))
-        else:
-            tokens.append(Token(kind, text, pos))
 
-    tokens.append(Token("EOF", "", len(src)))
-    return tokens
+def tokenize(src: str) -> List[Token]:
+    return list(iter_tokens(src))
+
+
+class TokenArrays:
+    """
+    Tokens of src as parallel arrays: kind code (KIND_CODES), start and end
+    offset. No per-token objects are kept; Token tuples are made only when
+    iterated. The last token is EOF.
+    """
+
+    def __init__(self, src: str):
+        self.src = src
+        self.kinds = array("B")
+        self.starts = array("I")
+        self.ends = array("I")
+
+        match = TOKEN_RE.match
+        kinds_append = self.kinds.append
+        starts_append = self.starts.append
+        ends_append = self.ends.append
+        end = len(src)
+        pos = 0
+        while True:
+            m = match(src, pos)
+            group = m.lastindex
+            if group is None:
+                if m.end() != end:
+                    raise _lex_error(src, m.end())
+                break
+            start, pos = m.span(group)
+            code = _GROUP_CODES[group]
+            if code == _IDENT:
+                code = _KEYWORD_CODES.get(src[start:pos], code)
+            kinds_append(code)
+            starts_append(start)
+            ends_append(pos)
+        kinds_append(_EOF)
+        starts_append(end)
+        ends_append(end)
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def kind(self, i: int) -> TokenKind:
+        return KIND_NAMES[self.kinds[i]]
+
+    def token(self, i: int) -> Token:
+        start = self.starts[i]
+        return Token(KIND_NAMES[self.kinds[i]], self.src[start : self.ends[i]], start)
+
+    def __iter__(self) -> Iterator[Token]:
+        return self.tokens()
+
+    def tokens(self, first: int = 0, last: int | None = None) -> Iterator[Token]:
+        # tokens first..last (inclusive; default: up to EOF), then EOF
+        stop = len(self.kinds) - 1 if last is None else last + 1
+        for i in range(first, stop):
+            yield self.token(i)
+        yield self.token(len(self.kinds) - 1)
+
+
+# binding power and operator of the binary operator tokens; comparisons bind
+# loosest and only appear in conditions
+CMP_PREC = 1
+ARITH_PREC = 2
+BINARY_PREC: dict[str, tuple[int, str]] = {
+    "EQEQ": (CMP_PREC, "=="),
+    "NEQ": (CMP_PREC, "!="),
+    "PLUS": (ARITH_PREC, "+"),
+    "MINUS": (ARITH_PREC, "-"),
+    "STAR": (ARITH_PREC + 1, "*"),
+    "SLASH": (ARITH_PREC + 1, "/"),
+}
 
 
 class Parser:
-    def __init__(self, tokens: List[Token]):
-        self.tokens = tokens
-        self.pos = 0
+    # tokens: any iterable ending with EOF (a list, iter_tokens, TokenArrays)
+    def __init__(self, tokens: Iterable[Token]):
+        self._next = iter(tokens).__next__
+        self._cur = self._next()
+        self._prev: Token | None = None
 
     def cur(self) -> Token:
-        return self.tokens[self.pos]
+        return self._cur
 
     def eat(self, kind: TokenKind) -> Token:
-        tok = self.cur()
+        tok = self._cur
         if tok.kind != kind:
             raise SyntaxError(f"expeced {kind}, got {tok.kind} at {tok.pos}")
-        self.pos += 1
+        if kind != "EOF":
+            self._prev, self._cur = tok, self._next()
         return tok
 
     def parse_program(self) -> Program:
@@ -115,12 +228,25 @@ class Parser:
         return Program(stmts=stmts)
 
     def parse_stmt(self) -> Stmt:
+        start = self.cur().pos
+        stmt = self._parse_stmt()
+        stmt.span = (start, self._end_pos())
+        return stmt
+
+    def _end_pos(self) -> int:
+        # end of the last consumed token
+        tok = self._prev
+        return tok.pos + len(tok.value)
+
+    def _parse_stmt(self) -> Stmt:
         tok = self.cur()
         if tok.kind == "IDENT":
             # IDENT '=' expr ';'
             name = self.eat("IDENT").value
             self.eat("EQ")
+            start = self.cur()
             expr = self.parse_expr()
+            _check_value(expr, start)
             self.eat("SEMICOLON")
             return Assign(name=name, expr=expr)
 
@@ -163,67 +289,83 @@ class Parser:
         return stmts
 
     def parse_cond(self) -> Cond:
-        # cond: expr ("==" | "!=") expr
-        left = self.parse_expr()
+        # cond: expr ("==" | "!=") expr, possibly in parentheses
         tok = self.cur()
-        if tok.kind == "EQEQ":
-            self.eat("EQEQ")
-            right = self.parse_expr()
-
-            # expr == 0 ?
-            if isinstance(right, Const) and right.value == 0:
-                return CmpZero(expr=left, op="==")
+        cond = self.parse_expr(CMP_PREC)
+        if not isinstance(cond, Cond):
+            raise SyntaxError(f"expected == or != in condition at {tok.pos}")
+        return cond
+
+    def parse_expr(self, min_prec: int = ARITH_PREC) -> Expr:
+        return self._climb(self.parse_primary(), min_prec)
+
+    def _climb(self, left: Expr, min_prec: int) -> Expr:
+        # precedence climbing: fold operators binding at least min_prec into
+        # left, left to right; recurse only for a tighter operator
+        while True:
+            tok = self._cur
+            entry = BINARY_PREC.get(tok.kind)
+            if entry is None or entry[0] < min_prec:
+                return left
+            prec, op = entry
+            self._prev, self._cur = tok, self._next()
+            right = self.parse_primary()
+            nxt = BINARY_PREC.get(self._cur.kind)
+            if nxt is not None and nxt[0] > prec:
+                right = self._climb(right, prec + 1)
+            if isinstance(left, Cond) or isinstance(right, Cond):
+                raise SyntaxError(f"comparison used as a value at {tok.pos}")
+            if prec == CMP_PREC:
+                if nxt is not None and nxt[0] == CMP_PREC:
+                    raise SyntaxError(f"comparisons do not chain at {self._cur.pos}")
+                left = _compare(left, op, right)
             else:
-                return Cmp(left=left, op="==", right=right)
-
-        elif tok.kind == "NEQ":
-            self.eat("NEQ")
-            right = self.parse_expr()
-
-            # expr == 0 ?
-            if isinstance(right, Const) and right.value == 0:
-                return CmpZero(expr=left, op="!=")
-            else:
-                return Cmp(left=left, op="!=", right=right)
-
-        else:
-            raise SyntaxError(f"unexpected == or != in condition at {tok.pos}")
-
-    def parse_expr(self) -> Expr:
-        expr = self.parse_primary()
-        while self.cur().kind in ("PLUS", "MINUS"):
-            op_tok = self.cur()
-            if op_tok.kind == "PLUS":
-                self.eat("PLUS")
-                right = self.parse_primary()
-                expr = BinOp(op="+", left=expr, right=right)
-            else:
-                self.eat("MINUS")
-                right = self.parse_primary()
-                expr = BinOp(op="-", left=expr, right=right)
-        return expr
+                left = BinOp(op, left, right)
 
     def parse_primary(self) -> Expr:
-        tok = self.cur()
-        if tok.kind == "INT":
-            value = int(self.eat("INT").value)
-            return Const(value=value)
-
-        if tok.kind == "IDENT":
-            name = self.eat("IDENT").value
-            return Var(name=name)
-
-        if tok.kind == "LPAREN":
+        tok = self._cur
+        kind = tok.kind
+        if kind == "IDENT":
+            self._prev, self._cur = tok, self._next()
+            return Var(tok.value)
+
+        if kind == "INT":
+            self._prev, self._cur = tok, self._next()
+            return Const(int(tok.value))
+
+        if kind == "MINUS":
+            # negation; "-5" is still a single constant
+            self.eat("MINUS")
+            operand = self.parse_primary()
+            _check_value(operand, tok)
+            if isinstance(operand, Const):
+                return Const(value=-operand.value)
+            return BinOp(op="-", left=Const(value=0), right=operand)
+
+        if kind == "LPAREN":
+            # a comparison here is rejected by the caller unless it is a
+            # whole condition
             self.eat("LPAREN")
-            expr = self.parse_expr()
+            expr = self.parse_expr(CMP_PREC)
             self.eat("RPAREN")
             return expr
 
-        raise SyntaxError(f"unexpected token {tok.kind} in expr at {tok.pos}")
+        raise SyntaxError(f"unexpected token {kind} in expr at {tok.pos}")
+
+
+def _check_value(expr: Expr, tok: Token) -> None:
+    if isinstance(expr, Cond):
+        raise SyntaxError(f"comparison used as a value at {tok.pos}")
+
+
+def _compare(left: Expr, op: str, right: Expr) -> Cond:
+    # expr == 0 ?
+    if isinstance(right, Const) and right.value == 0:
+        return CmpZero(expr=left, op=op)
+    return Cmp(left=left, op=op, right=right)
 
 
 # entry point
 def parse_program(src: str) -> Program:
-    tokens = tokenize(src)
-    p = Parser(tokens)
+    p = Parser(iter_tokens(src))
     return p.parse_program()
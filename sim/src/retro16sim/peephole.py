@@ -0,0 +1,296 @@
+from dataclasses import dataclass, field
+
+from .assembler import asm_addi
+from .const import (
+    IMM6_MASK,
+    IMM6_MAX,
+    IMM6_MIN,
+    IMM6_SIGNBIT,
+    R0,
+    REG_MASK,
+    REG_SHIFT_RD,
+    REG_SHIFT_RS1,
+    REG_SHIFT_RS2,
+)
+from .isa import Op
+
+# liveness masks: bit n is register Rn, FLAG_Z_BIT is the Z flag (the only
+# flag any instruction reads)
+FLAG_Z_BIT = 1 << 8
+
+_ALU_OPS = frozenset({Op.ADD, Op.SUB, Op.ADDI, Op.LD})  # write rd and Z
+_JUMP_OPS = frozenset({Op.JMP, Op.JZ, Op.JNZ})
+_INVERSE = {Op.JZ: Op.JNZ, Op.JNZ: Op.JZ}
+
+
+@dataclass(slots=True)
+class Insn:
+    op: Op
+    word: int  # 0 for jumps until they are patched
+    target: str | None = None  # label a jump goes to
+    labels: list[str] = field(default_factory=list)  # placed before this insn
+    stmts: tuple = ()  # Compiler.line_table entry
+
+
+def optimize(insns: list[Insn], exit_live: int) -> list[Insn]:
+    """
+    Rewrite the compiler output until no pattern applies.
+
+    exit_live is the mask of registers whose values matter at HALT. The
+    last instruction must be HALT; labels must point at instructions.
+    """
+    insns = list(insns)
+    while True:
+        _drop_unused_labels(insns)
+        if _thread_jumps(insns) | _local_patterns(insns):
+            insns = _compact(insns)
+            continue
+        # liveness only once the cheap patterns are exhausted
+        if not _liveness_patterns(insns, exit_live):
+            return insns
+        insns = _compact(insns)
+
+
+def _rd(word: int) -> int:
+    return (word >> REG_SHIFT_RD) & REG_MASK
+
+
+def _rs1(word: int) -> int:
+    return (word >> REG_SHIFT_RS1) & REG_MASK
+
+
+def _rs2(word: int) -> int:
+    return (word >> REG_SHIFT_RS2) & REG_MASK
+
+
+def _imm6(word: int) -> int:
+    imm = word & IMM6_MASK
+    return imm - (IMM6_MASK + 1) if imm & IMM6_SIGNBIT else imm
+
+
+def _uses_defs(insn: Insn) -> tuple[int, int]:
+    op, w = insn.op, insn.word
+    if op in (Op.ADD, Op.SUB):
+        uses, defs = (1 << _rs1(w)) | (1 << _rs2(w)), (1 << _rd(w)) | FLAG_Z_BIT
+    elif op in (Op.ADDI, Op.LD):
+        uses, defs = 1 << _rs1(w), (1 << _rd(w)) | FLAG_Z_BIT
+    elif op == Op.ST:
+        uses, defs = (1 << _rd(w)) | (1 << _rs1(w)), 0
+    elif op == Op.CMP:
+        uses, defs = (1 << _rs1(w)) | (1 << _rs2(w)), FLAG_Z_BIT
+    elif op == Op.CMPI:
+        uses, defs = 1 << _rs1(w), FLAG_Z_BIT
+    elif op in (Op.JZ, Op.JNZ):
+        uses, defs = FLAG_Z_BIT, 0
+    else:
+        uses, defs = 0, 0
+    # R0 is never written by compiled code
+    return uses & ~1, defs & ~1
+
+
+def _label_index(insns: list[Insn]) -> dict[str, int]:
+    return {label: i for i, insn in enumerate(insns) for label in insn.labels}
+
+
+def _live_out(insns: list[Insn], exit_live: int) -> list[int]:
+    index = _label_index(insns)
+    n = len(insns)
+    succs: list[tuple[int, ...]] = []
+    for i, insn in enumerate(insns):
+        if insn.op == Op.HALT:
+            succs.append(())
+        elif insn.op == Op.JMP:
+            succs.append((index[insn.target],))
+        elif insn.op in (Op.JZ, Op.JNZ):
+            succs.append((i + 1, index[insn.target]))
+        else:
+            succs.append((i + 1,))
+    uses_defs = [_uses_defs(insn) for insn in insns]
+
+    live_in = [0] * n
+    live_out = [0] * n
+    changed = True
+    while changed:
+        changed = False
+        for i in range(n - 1, -1, -1):
+            if insns[i].op == Op.HALT:
+                out = exit_live
+            else:
+                out = 0
+                for s in succs[i]:
+                    out |= live_in[s]
+            uses, defs = uses_defs[i]
+            live = uses | (out & ~defs)
+            if live != live_in[i] or out != live_out[i]:
+                live_in[i], live_out[i] = live, out
+                changed = True
+    return live_out
+
+
+def _drop_unused_labels(insns: list[Insn]) -> None:
+    used = {insn.target for insn in insns if insn.target is not None}
+    for insn in insns:
+        insn.labels = [label for label in insn.labels if label in used]
+
+
+def _thread_jumps(insns: list[Insn]) -> bool:
+    # jumps to unconditional jumps go to the final target
+    index = _label_index(insns)
+    changed = False
+    for insn in insns:
+        if insn.op not in _JUMP_OPS:
+            continue
+        target = insn.target
+        seen = {target}
+        while True:
+            nxt = insns[index[target]]
+            if nxt.op != Op.JMP or nxt.target in seen:
+                break
+            target = nxt.target
+            seen.add(target)
+        if target != insn.target:
+            insn.target = target
+            changed = True
+    return changed
+
+
+def _local_patterns(insns: list[Insn]) -> bool:
+    # applies one rewrite; optimize() repeats until nothing changes
+    index = _label_index(insns)
+    n = len(insns)
+    for i, insn in enumerate(insns[:-1]):
+        nxt = insns[i + 1]
+
+        if insn.op in _JUMP_OPS and index[insn.target] == i + 1:
+            # jump to the next instruction
+            _delete(insns, i)
+            return True
+
+        if (
+            insn.op in (Op.JZ, Op.JNZ)
+            and nxt.op == Op.JMP
+            and not nxt.labels
+            and index[insn.target] == i + 2
+        ):
+            # Jc L; JMP M; L:  ->  J!c M; L:
+            insn.op = _INVERSE[insn.op]
+            insn.target = nxt.target
+            _delete(insns, i + 1)
+            return True
+
+        if insn.op in (Op.JMP, Op.HALT) and not nxt.labels and i + 1 < n - 1:
+            # unreachable until the next label (the final HALT stays)
+            _delete(insns, i + 1)
+            return True
+
+        if (
+            insn.op == Op.ADDI
+            and nxt.op == Op.ADDI
+            and not nxt.labels
+            and _rd(nxt.word) == _rs1(nxt.word) == _rd(insn.word)
+        ):
+            # ADDI rd, rs, a; ADDI rd, rd, b  ->  ADDI rd, rs, a + b
+            imm = _imm6(insn.word) + _imm6(nxt.word)
+            if IMM6_MIN <= imm <= IMM6_MAX:
+                nxt.word = asm_addi(rd=_rd(insn.word), rs=_rs1(insn.word), imm=imm)
+                nxt.stmts = insn.stmts
+                _delete(insns, i)
+                return True
+
+        if (
+            insn.op in _ALU_OPS
+            and nxt.op == Op.CMPI
+            and not nxt.labels
+            and _imm6(nxt.word) == 0
+            and _rs1(nxt.word) == _rd(insn.word)
+        ):
+            # Z already reflects rd
+            _delete(insns, i + 1)
+            return True
+
+    return False
+
+
+def _liveness_patterns(insns: list[Insn], exit_live: int) -> bool:
+    live_out = _live_out(insns, exit_live)
+    index = _label_index(insns)
+    refs: dict[str, int] = {}
+    for insn in insns:
+        if insn.target is not None:
+            refs[insn.target] = refs.get(insn.target, 0) + 1
+
+    changed = False
+    for i, insn in enumerate(insns):
+        if insn is None:
+            continue
+
+        if insn.op in _ALU_OPS or insn.op in (Op.CMP, Op.CMPI):
+            # result and flags unused, or a move to itself with Z unused
+            _, defs = _uses_defs(insn)
+            if _is_self_move(insn):
+                defs &= FLAG_Z_BIT
+            if not defs & live_out[i]:
+                _delete(insns, i)
+                changed = True
+
+        elif insn.op in (Op.JZ, Op.JNZ) and _is_materialize(insns, i, index, refs):
+            # Jc T; ADDI t, R0, 0; JMP E; T: ADDI t, R0, 1; E: CMPI t, 0; JZ F
+            # -> J!c F, when t and Z are dead after the final JZ
+            t = _rd(insns[i + 1].word)
+            if not live_out[i + 5] & ((1 << t) | FLAG_Z_BIT):
+                insn.op = _INVERSE[insn.op]
+                insn.target = insns[i + 5].target
+                for j in range(i + 1, i + 6):
+                    _delete(insns, j)
+                changed = True
+
+    return changed
+
+
+def _is_self_move(insn: Insn) -> bool:
+    # ADD rd, rd, R0 or ADDI rd, rd, 0
+    w = insn.word
+    if insn.op == Op.ADD:
+        return _rd(w) == _rs1(w) and _rs2(w) == R0
+    if insn.op == Op.ADDI:
+        return _rd(w) == _rs1(w) and _imm6(w) == 0
+    return False
+
+
+def _is_materialize(
+    insns: list[Insn], i: int, index: dict[str, int], refs: dict[str, int]
+) -> bool:
+    if i + 5 >= len(insns) or any(x is None for x in insns[i : i + 6]):
+        return False
+    jc, zero, jmp, one, test, jz = insns[i : i + 6]
+    if zero.labels or jmp.labels or jz.labels:
+        return False
+    if one.labels != [jc.target] or test.labels != [jmp.target]:
+        return False
+    if refs[jc.target] != 1 or refs[jmp.target] != 1:
+        return False
+    t = _rd(zero.word)
+    return (
+        zero.word == asm_addi(rd=t, rs=R0, imm=0)
+        and jmp.op == Op.JMP
+        and one.word == asm_addi(rd=t, rs=R0, imm=1)
+        and test.op == Op.CMPI
+        and _rs1(test.word) == t
+        and _imm6(test.word) == 0
+        and jz.op == Op.JZ
+        and t != R0
+    )
+
+
+def _delete(insns: list[Insn | None], i: int) -> None:
+    # labels move to the next instruction (the final HALT is never deleted)
+    insn = insns[i]
+    j = i + 1
+    while insns[j] is None:
+        j += 1
+    insns[j].labels[:0] = insn.labels
+    insns[i] = None
+
+
+def _compact(insns: list[Insn | None]) -> list[Insn]:
+    return [insn for insn in insns if insn is not None]
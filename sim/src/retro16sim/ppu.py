@@ -0,0 +1,274 @@
+import os
+
+import numpy as np
+
+from .bus import Bus
+from .const import PPU_REG_BASE, VRAM_BLOCK_SHIFT, VRAM_START
+
+SCREEN_W = 160
+SCREEN_H = 144
+
+TILE_SIZE = 8  # pixels per side
+TILE_BYTES = TILE_SIZE * TILE_SIZE // 2  # 4 bits per pixel, left pixel high
+TILE_COUNT = 256
+
+MAP_TILES = 32  # tiles per side of the background map
+MAP_PIXELS = MAP_TILES * TILE_SIZE
+
+SPRITE_COUNT = 64
+SPRITE_BYTES = 4  # y, x, tile, attr; drawn at (x - 8, y - 8)
+SPRITE_OFFSET = 8
+
+PALETTE_COUNT = 8  # 0-3 background, 4-7 sprites
+PALETTE_COLORS = 16  # RGB555 words; color 0 of a sprite palette is clear
+
+# VRAM layout
+TILE_DATA = VRAM_START  # TILE_COUNT tiles
+TILE_MAP = 0xA000  # MAP_TILES x MAP_TILES tile numbers
+TILE_ATTR = 0xA400  # one ATTR_* byte per map entry
+OAM = 0xA800  # SPRITE_COUNT entries
+PALETTES = 0xAA00  # PALETTE_COUNT x PALETTE_COLORS words
+
+# map and sprite attribute bits
+ATTR_PALETTE = 0x03
+ATTR_HFLIP = 0x04
+ATTR_VFLIP = 0x08
+
+# registers (words, plain memory sampled at the end of the frame)
+PPU_SCX = PPU_REG_BASE
+PPU_SCY = PPU_REG_BASE + 2
+PPU_CTRL = PPU_REG_BASE + 4
+
+CTRL_BG = 0x01
+CTRL_SPRITES = 0x02
+
+_ROW = np.arange(TILE_SIZE)
+
+# screen rectangle: top, bottom, left, right (exclusive)
+type Box = tuple[int, int, int, int]
+SCREEN_BOX: Box = (0, SCREEN_H, 0, SCREEN_W)
+
+
+def _blocks(addr: int, size: int) -> slice:
+    # Bus.vram_dirty entries covering [addr, addr + size)
+    first = (addr - VRAM_START) >> VRAM_BLOCK_SHIFT
+    return slice(first, first + (size >> VRAM_BLOCK_SHIFT))
+
+
+# one dirty block per tile, per map row and per palette
+_TILE_BLOCKS = _blocks(TILE_DATA, TILE_COUNT * TILE_BYTES)
+_MAP_BLOCKS = _blocks(TILE_MAP, MAP_TILES * MAP_TILES)
+_ATTR_BLOCKS = _blocks(TILE_ATTR, MAP_TILES * MAP_TILES)
+_OAM_BLOCKS = _blocks(OAM, SPRITE_COUNT * SPRITE_BYTES)
+_PALETTE_BLOCKS = _blocks(PALETTES, PALETTE_COUNT * PALETTE_COLORS * 2)
+
+
+def _sprite_pixels(oam: np.ndarray, box: Box) -> tuple[np.ndarray, np.ndarray]:
+    # flat screen positions of the pixels of the entries in oam inside box
+    # (sprite-major), and the [sprite, y, x] mask of those pixels
+    top, bottom, left, right = box
+    y, x = oam[:, 0], oam[:, 1]
+    sy = (y - SPRITE_OFFSET)[:, None, None] + _ROW[None, :, None]
+    sx = (x - SPRITE_OFFSET)[:, None, None] + _ROW[None, None, :]
+    shown = (sy >= top) & (sy < bottom) & (sx >= left) & (sx < right)
+    return (sy * SCREEN_W + sx)[shown], shown
+
+
+def _span(mask: np.ndarray) -> tuple[int, int] | None:
+    # [first, last + 1) of the set entries
+    hits = np.flatnonzero(mask)
+    return (int(hits[0]), int(hits[-1]) + 1) if len(hits) else None
+
+
+class PPU:
+    """
+    Renders the screen from VRAM with whole-array NumPy operations.
+
+    render() draws one frame into framebuffer, a preallocated
+    SCREEN_H x SCREEN_W x 3 uint8 RGB array that is reused between frames,
+    with the palette index of every pixel in index. The background is a
+    scrolled, wrapping MAP_TILES x MAP_TILES map; sprites cover it where
+    their color is not 0, the lower OAM entry on top. With CTRL_BG clear
+    the background is palette 0 color 0.
+
+    Rendering is incremental: the bus marks changed VRAM blocks
+    (Bus.vram_dirty), decoded tiles and the background plane are cached,
+    and only screen tiles showing changed map entries, tiles or sprites
+    are composed again. A change of a register redraws the whole screen,
+    a change of a palette converts the whole screen to RGB again.
+    """
+
+    def __init__(self, bus: Bus):
+        self.bus = bus
+        # views of bus memory (no copies)
+        mem = np.frombuffer(bus.mem, dtype=np.uint8)
+        self._tiles = mem[TILE_DATA : TILE_DATA + TILE_COUNT * TILE_BYTES].reshape(
+            TILE_COUNT, TILE_SIZE, TILE_BYTES // TILE_SIZE
+        )
+        self._map = mem[TILE_MAP : TILE_MAP + MAP_TILES * MAP_TILES].reshape(
+            MAP_TILES, MAP_TILES
+        )
+        self._attr = mem[TILE_ATTR : TILE_ATTR + MAP_TILES * MAP_TILES].reshape(
+            MAP_TILES, MAP_TILES
+        )
+        self._oam = mem[OAM : OAM + SPRITE_COUNT * SPRITE_BYTES].reshape(
+            SPRITE_COUNT, SPRITE_BYTES
+        )
+        self._palettes = np.frombuffer(
+            bus.mem, dtype="<u2", count=PALETTE_COUNT * PALETTE_COLORS, offset=PALETTES
+        )
+        bus.track_vram()
+        self._dirty = np.frombuffer(bus.vram_dirty, dtype=np.uint8)
+
+        # caches: decoded tiles [flip, tile, y, x], background palette
+        # indices, RGB palette, and what the previous frame used
+        self._pixels = np.zeros((4, TILE_COUNT, TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+        self._plane = np.zeros((MAP_PIXELS, MAP_PIXELS), dtype=np.uint8)
+        self._rgb = np.zeros((PALETTE_COUNT * PALETTE_COLORS, 3), dtype=np.uint8)
+        self._regs: tuple[int, int, int] | None = None
+        self._prev_oam = np.zeros((SPRITE_COUNT, SPRITE_BYTES), dtype=np.intp)
+
+        self.framebuffer = np.zeros((SCREEN_H, SCREEN_W, 3), dtype=np.uint8)
+        self.index = np.zeros((SCREEN_H, SCREEN_W), dtype=np.uint8)
+        self.frame = 0  # frames rendered
+        self.redrawn = 0  # pixels composed by the last render
+
+    def render(self) -> np.ndarray:
+        bus = self.bus
+        regs = (bus.load16(PPU_SCX), bus.load16(PPU_SCY), bus.load16(PPU_CTRL))
+        dirty = self._dirty
+        self.frame += 1
+        if regs == self._regs and not dirty.any():
+            self.redrawn = 0
+            return self.framebuffer
+
+        tiles = np.flatnonzero(dirty[_TILE_BLOCKS])
+        rows = dirty[_MAP_BLOCKS] | dirty[_ATTR_BLOCKS]
+        palette_changed = dirty[_PALETTE_BLOCKS].any()
+        dirty.fill(0)
+
+        changed_tiles = np.zeros(TILE_COUNT, dtype=bool)
+        if len(tiles):
+            changed_tiles[tiles] = True
+            self._decode(tiles)
+        cells = rows.astype(bool)[:, None] | changed_tiles[self._map]
+        if cells.any():
+            self._compose_plane(cells)
+        if palette_changed:
+            self._rgb[:] = self.rgb_palette()
+
+        scx, scy, ctrl = regs
+        screen_rows = (scy + np.arange(SCREEN_H)) % MAP_PIXELS
+        screen_cols = (scx + np.arange(SCREEN_W)) % MAP_PIXELS
+        oam = self._oam.astype(np.intp)
+        if regs != self._regs:
+            box = SCREEN_BOX
+        else:
+            box = self._changed_box(
+                cells, screen_rows, screen_cols, oam, changed_tiles, ctrl
+            )
+        self._regs = regs
+        self._prev_oam = oam
+
+        if box is None:
+            self.redrawn = 0
+        else:
+            top, bottom, left, right = box
+            self.redrawn = (bottom - top) * (right - left)
+            index = self.index[top:bottom, left:right]
+            if ctrl & CTRL_BG:
+                rows = screen_rows[top:bottom, None]
+                index[:] = self._plane[rows, screen_cols[None, left:right]]
+            else:
+                index.fill(0)
+            if ctrl & CTRL_SPRITES:
+                self._sprites(oam, box)
+            if not palette_changed:
+                self.framebuffer[top:bottom, left:right] = self._rgb[index]
+        if palette_changed:
+            np.take(self._rgb, self.index, axis=0, out=self.framebuffer)
+        return self.framebuffer
+
+    def _changed_box(
+        self,
+        cells: np.ndarray,
+        screen_rows: np.ndarray,
+        screen_cols: np.ndarray,
+        oam: np.ndarray,
+        changed_tiles: np.ndarray,
+        ctrl: int,
+    ) -> Box | None:
+        # smallest screen rectangle covering the changed cells and the old
+        # and new places of the changed sprites; None if nothing shows
+        ys = _span(cells.any(axis=1)[screen_rows >> 3])
+        xs = _span(cells.any(axis=0)[screen_cols >> 3])
+        top, bottom, left, right = (
+            (ys[0], ys[1], xs[0], xs[1]) if ys and xs else (SCREEN_H, 0, SCREEN_W, 0)
+        )
+
+        if ctrl & CTRL_SPRITES:
+            changed = (oam != self._prev_oam).any(axis=1) | changed_tiles[oam[:, 2]]
+            for entries in (oam[changed], self._prev_oam[changed]):
+                y = entries[:, 0] - SPRITE_OFFSET
+                x = entries[:, 1] - SPRITE_OFFSET
+                on = (
+                    (y < SCREEN_H)
+                    & (y > -TILE_SIZE)
+                    & (x < SCREEN_W)
+                    & (x > -TILE_SIZE)
+                )
+                if on.any():
+                    top = min(top, max(int(y[on].min()), 0))
+                    bottom = max(bottom, min(int(y[on].max()) + TILE_SIZE, SCREEN_H))
+                    left = min(left, max(int(x[on].min()), 0))
+                    right = max(right, min(int(x[on].max()) + TILE_SIZE, SCREEN_W))
+
+        if top >= bottom or left >= right:
+            return None
+        return top, bottom, left, right
+
+    def _decode(self, tiles: np.ndarray) -> None:
+        # color numbers of tiles in all four flips into _pixels[flip, tile],
+        # flip = (ATTR_HFLIP | ATTR_VFLIP bits) >> 2
+        data = self._tiles[tiles]
+        pixels = np.empty((len(tiles), TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+        np.right_shift(data, 4, out=pixels[:, :, 0::2])
+        np.bitwise_and(data, 0x0F, out=pixels[:, :, 1::2])
+        self._pixels[0, tiles] = pixels
+        self._pixels[1, tiles] = pixels[:, :, ::-1]
+        self._pixels[2, tiles] = pixels[:, ::-1, :]
+        self._pixels[3, tiles] = pixels[:, ::-1, ::-1]
+
+    def rgb_palette(self) -> np.ndarray:
+        # RGB555 -> 8 bits per channel, one row per palette entry
+        c = self._palettes
+        rgb = np.stack([c & 0x1F, (c >> 5) & 0x1F, (c >> 10) & 0x1F], axis=1)
+        return ((rgb << 3) | (rgb >> 2)).astype(np.uint8)
+
+    def _compose_plane(self, cells: np.ndarray) -> None:
+        ys, xs = np.nonzero(cells)
+        attr = self._attr[ys, xs]
+        flip = (attr & (ATTR_HFLIP | ATTR_VFLIP)) >> 2
+        values = self._pixels[flip, self._map[ys, xs]]
+        values |= ((attr & ATTR_PALETTE) << 4)[:, None, None]
+        # [map y, y, map x, x]
+        plane = self._plane.reshape(MAP_TILES, TILE_SIZE, MAP_TILES, TILE_SIZE)
+        plane[ys, :, xs, :] = values
+
+    def _sprites(self, oam: np.ndarray, box: Box) -> None:
+        tile, attr = oam[:, 2], oam[:, 3]
+        flip = (attr & (ATTR_HFLIP | ATTR_VFLIP)) >> 2
+        color = self._pixels[flip, tile]  # [sprite, y, x]
+        value = color | (((attr & ATTR_PALETTE) + 4) << 4)[:, None, None]
+
+        pos, shown = _sprite_pixels(oam, box)
+        opaque = color[shown] != 0
+        # sprite-major order: the first hit of each pixel is the lowest entry
+        pos, first = np.unique(pos[opaque], return_index=True)
+        self.index.reshape(-1)[pos] = value[shown][opaque][first]
+
+    def write_ppm(self, path: str | os.PathLike) -> None:
+        # binary PPM of the last frame, e.g. for screenshot tests
+        with open(path, "wb") as f:
+            f.write(b"P6 %d %d 255\n" % (SCREEN_W, SCREEN_H))
+            f.write(self.framebuffer.tobytes())
@@ -0,0 +1,193 @@
+import os
+from collections import Counter
+from typing import NamedTuple
+
+from .const import ADDR_MASK, MEM_SIZE, OPCODE_MASK, OPCODE_SHIFT, ROM_START
+from .cpu import CPU
+from .isa import Op
+from .jit import BLOCK_END_OPS
+from .lang import Assign, If, Stmt, While
+
+_COND_BRANCH = frozenset({Op.JZ, Op.JNZ})
+
+
+class ProfileRow(NamedTuple):
+    pc: int
+    op: str
+    count: int
+    cycles: int
+
+
+class StmtProfile(NamedTuple):
+    stmt: Stmt
+    depth: int  # nesting level, 0 for top-level statements
+    count: int  # executions of the statement's first instruction
+    self_cycles: int  # cycles in code belonging to no nested statement
+    total_cycles: int  # including nested statements
+
+
+class Profiler:
+    """
+    Execution counts per PC, per opcode and per conditional branch outcome,
+    plus cycles per basic block (keyed by the block's first PC).
+
+    Attach with machine.profiler = Profiler(); while attached the machine
+    runs through run_profiled instead of the interpreter/block engine.
+    """
+
+    def __init__(self):
+        self.pc_counts = [0] * MEM_SIZE
+        self.pc_cycles = [0] * MEM_SIZE
+        self.op_counts: Counter[Op] = Counter()
+        self.branches: dict[int, list[int]] = {}  # pc -> [taken, not taken]
+        self.block_cycles: Counter[int] = Counter()
+        self.block_counts: Counter[int] = Counter()
+        self.pc_ops: dict[int, Op] = {}  # last opcode seen at each PC
+        # (block start, pc) -> cycles; a PC can run as part of several blocks
+        self.stack_cycles: Counter[tuple[int, int]] = Counter()
+        self._block_start: int | None = None
+        self._block_acc = 0
+
+    @property
+    def total_cycles(self) -> int:
+        return sum(self.pc_cycles)
+
+    def flat_profile(self) -> list[ProfileRow]:
+        # hottest first
+        rows = [
+            ProfileRow(pc, op.name, self.pc_counts[pc], self.pc_cycles[pc])
+            for pc, op in self.pc_ops.items()
+        ]
+        rows.sort(key=lambda r: (-r.cycles, -r.count, r.pc))
+        return rows
+
+    def format_flat(self, limit: int | None = None) -> str:
+        total = self.total_cycles or 1
+        lines = [f"{'PC':>4}  {'OP':<4} {'COUNT':>10} {'CYCLES':>10} {'%':>6}"]
+        for r in self.flat_profile()[:limit]:
+            share = 100 * r.cycles / total
+            lines.append(
+                f"{r.pc:04X}  {r.op:<4} {r.count:>10} {r.cycles:>10} {share:>6.2f}"
+            )
+        return "\n".join(lines)
+
+    def collapsed_stacks(self) -> list[str]:
+        # flamegraph.pl / speedscope "collapsed" lines: block;instr cycles
+        lines = []
+        for (block, pc), cycles in sorted(self.stack_cycles.items()):
+            if cycles:
+                op = self.pc_ops[pc]
+                lines.append(f"block_{block:04X};{op.name}@{pc:04X} {cycles}")
+        return lines
+
+    def write_collapsed(self, path: str | os.PathLike) -> None:
+        with open(path, "w") as f:
+            for line in self.collapsed_stacks():
+                f.write(line + "\n")
+
+    def flush(self) -> None:
+        # attribute the block in progress (e.g. at the end of a run)
+        if self._block_start is not None and self._block_acc:
+            self.block_cycles[self._block_start] += self._block_acc
+        self._block_start = None
+        self._block_acc = 0
+
+
+def run_profiled(cpu: CPU, prof: Profiler, n: int) -> int:
+    # like n calls to cpu.step(), counting every instruction
+    load16 = cpu.bus.load16
+    pc_counts = prof.pc_counts
+    pc_cycles = prof.pc_cycles
+    op_counts = prof.op_counts
+    pc_ops = prof.pc_ops
+    stack_cycles = prof.stack_cycles
+
+    cycles = 0
+    block_acc = prof._block_acc
+    for _ in range(n):
+        if cpu.halted:
+            break
+
+        pc = cpu.pc
+        if prof._block_start is None:
+            prof._block_start = pc
+            prof.block_counts[pc] += 1
+
+        instr = load16(pc)
+        c = cpu.step()
+        op = Op((instr >> OPCODE_SHIFT) & OPCODE_MASK)
+        cycles += c
+        block_acc += c
+        pc_counts[pc] += 1
+        pc_cycles[pc] += c
+        op_counts[op] += 1
+        pc_ops[pc] = op
+        stack_cycles[prof._block_start, pc] += c
+
+        if op in BLOCK_END_OPS:
+            if op in _COND_BRANCH:
+                taken = cpu.pc != (pc + 2) & ADDR_MASK
+                prof.branches.setdefault(pc, [0, 0])[0 if taken else 1] += 1
+            prof.block_cycles[prof._block_start] += block_acc
+            block_acc = 0
+            prof._block_start = None
+
+    prof._block_acc = block_acc
+    return cycles
+
+
+def statement_profile(
+    prof: Profiler, line_table: list[tuple[Stmt, ...]], base: int = ROM_START
+) -> list[StmtProfile]:
+    # line_table is Compiler.line_table for the ROM loaded at base; hottest
+    # (by self cycles) first
+    stats: dict[int, list] = {}  # id(stmt) -> [stmt, depth, count, self, total]
+    for index, stack in enumerate(line_table):
+        pc = (base + 2 * index) & ADDR_MASK
+        cycles = prof.pc_cycles[pc]
+        for depth, stmt in enumerate(stack):
+            entry = stats.get(id(stmt))
+            if entry is None:
+                # first instruction of the statement
+                entry = stats[id(stmt)] = [stmt, depth, prof.pc_counts[pc], 0, 0]
+            entry[4] += cycles
+        if stack:
+            stats[id(stack[-1])][3] += cycles
+
+    rows = [StmtProfile(*entry) for entry in stats.values()]
+    rows.sort(key=lambda r: (-r.self_cycles, -r.total_cycles))
+    return rows
+
+
+def format_hot_list(rows: list[StmtProfile], src: str, limit: int | None = 10) -> str:
+    total = sum(r.self_cycles for r in rows) or 1
+    lines = [f"{'LINE':>8} {'COUNT':>8} {'SELF':>10} {'TOTAL':>10} {'%':>6}  STMT"]
+    for r in rows[:limit]:
+        share = 100 * r.self_cycles / total
+        lines.append(
+            f"{_location(r.stmt, src):>8} {r.count:>8} {r.self_cycles:>10}"
+            f" {r.total_cycles:>10} {share:>6.2f}  {_summary(r.stmt, src)}"
+        )
+    return "\n".join(lines)
+
+
+def _location(stmt: Stmt, src: str) -> str:
+    if stmt.span is None:
+        return "?"
+    pos = stmt.span[0]
+    line = src.count("\n", 0, pos) + 1
+    col = pos - (src.rfind("\n", 0, pos) + 1) + 1
+    return f"{line}:{col}"
+
+
+def _summary(stmt: Stmt, src: str) -> str:
+    # source text, up to the body for while/if
+    if stmt.span is None:
+        return type(stmt).__name__
+    start, end = stmt.span
+    text = src[start:end]
+    if isinstance(stmt, (While, If)):
+        text = text.split("{", 1)[0]
+    elif not isinstance(stmt, Assign):
+        text = text[:40]
+    return " ".join(text.split())
@@ -0,0 +1,387 @@
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+
+from .const import IMM6_MAX, IMM6_MIN, R1, SP
+from .constfold import to_word
+from .lang_ast import (
+    Assign,
+    BinOp,
+    Cmp,
+    CmpZero,
+    Const,
+    Expr,
+    If,
+    Program,
+    Stmt,
+    Var,
+    While,
+)
+
+# registers handed out to variables and temporaries (R0 reads as zero by
+# convention, R7 is SP)
+ALLOC_REGS = tuple(range(R1, SP))
+
+# Spill slots live at SP + 0, 2, ...; none may sit below SP, where an
+# interrupt pushes PC and flags. LD/ST offsets are imm6 bytes, so frames
+# with more than SP_FRAME_SLOTS slots are addressed from a register holding
+# SP + FRAME_BIAS instead (offsets -31, -29, ...); the compiler moves that
+# register towards slots past offset 31 and back. The heaviest variables
+# get the nearest slots.
+SP_FRAME_SLOTS = IMM6_MAX // 2 + 1
+FRAME_BIAS = IMM6_MAX
+
+# spill weight multiplier per loop nesting level
+LOOP_WEIGHT = 10
+
+
+@dataclass
+class Allocation:
+    regs: dict[str, int]  # variable -> register
+    slots: dict[str, int]  # spilled variable -> byte offset from frame_reg
+    frame_reg: int  # SP, or for large frames a register reserved for it
+    # id(stmt) -> variables whose values must survive the statement (for
+    # While/If: its condition)
+    live: dict[int, frozenset[str]]
+    # read before written, i.e. expected to start as 0
+    entry_live: frozenset[str]
+
+
+def expr_vars(expr: Expr) -> set[str]:
+    if isinstance(expr, Var):
+        return {expr.name}
+    if isinstance(expr, BinOp):
+        return expr_vars(expr.left) | expr_vars(expr.right)
+    if isinstance(expr, CmpZero):
+        return expr_vars(expr.expr)
+    if isinstance(expr, Cmp):
+        return expr_vars(expr.left) | expr_vars(expr.right)
+    return set()
+
+
+def is_imm6(expr: Expr) -> bool:
+    return isinstance(expr, Const) and IMM6_MIN <= to_word(expr.value) <= IMM6_MAX
+
+
+def cmp_operands(expr: Cmp) -> tuple[Expr, Expr]:
+    # == and != are symmetric; put a small constant on the right (CMPI)
+    if is_imm6(expr.left) and not is_imm6(expr.right):
+        return expr.right, expr.left
+    return expr.left, expr.right
+
+
+def addi_form(expr: BinOp) -> tuple[Expr, int] | None:
+    # (operand, imm) when expr is a single ADDI away from operand
+    if expr.op == "+":
+        if is_imm6(expr.right):
+            return expr.left, to_word(expr.right.value)
+        if is_imm6(expr.left):
+            return expr.right, to_word(expr.left.value)
+    elif expr.op == "-" and isinstance(expr.right, Const):
+        imm = to_word(-expr.right.value)
+        if IMM6_MIN <= imm <= IMM6_MAX:
+            return expr.left, imm
+    return None
+
+
+def mul_form(expr: BinOp) -> tuple[Expr, int] | None:
+    # (operand, constant) for a multiplication by a constant
+    if isinstance(expr.right, Const):
+        return expr.left, to_word(expr.right.value)
+    if isinstance(expr.left, Const):
+        return expr.right, to_word(expr.left.value)
+    return None
+
+
+def is_shift_mul(value: int) -> bool:
+    # x * value is x doubled in place (|value| is 0 or a power of two)
+    m = abs(value)
+    return m & (m - 1) == 0
+
+
+def expr_need(expr: Expr, in_reg: Callable[[str], bool], scratch=False) -> int:
+    # temporaries Compiler.compile_expr needs besides its target register
+    if isinstance(expr, CmpZero):
+        return operand_need(expr.expr, in_reg, scratch)
+    if isinstance(expr, Cmp):
+        left, right = cmp_operands(expr)
+        if is_imm6(right):
+            return operand_need(left, in_reg, scratch)
+        return _pair_need(left, right, in_reg, scratch)
+    if isinstance(expr, BinOp):
+        return _binop_need(expr, in_reg, scratch)
+    return 0
+
+
+def _pair_need(
+    left: Expr, right: Expr, in_reg: Callable[[str], bool], scratch: bool
+) -> int:
+    # the left operand is held while the right one is evaluated
+    need = operand_need(left, in_reg, scratch)
+    held = 0 if scratch or _in_reg_var(left, in_reg) else 1
+    return max(need, held + operand_need(right, in_reg))
+
+
+def _binop_need(expr: BinOp, in_reg: Callable[[str], bool], scratch: bool) -> int:
+    if expr.op in ("+", "-"):
+        form = addi_form(expr)
+        if form is not None:
+            return operand_need(form[0], in_reg, scratch)
+        return _pair_need(expr.left, expr.right, in_reg, scratch)
+
+    if expr.op == "*":
+        form = mul_form(expr)
+        if form is not None:
+            x, value = form
+            if is_shift_mul(value):
+                return operand_need(x, in_reg, scratch)
+            # x is kept apart from the target (a copy if they share a register)
+            return 1 + expr_need(x, in_reg, scratch=True)
+        # left operand, counter and possibly a separate accumulator
+        held = 0 if _in_reg_var(expr.left, in_reg) else 1
+        counter = max(expr_need(expr.right, in_reg, scratch=True), 1)
+        return max(operand_need(expr.left, in_reg), held + 1 + counter)
+
+    if expr.op == "/":
+        # remainder counter, divisor, divisor countdown and possibly a
+        # separate quotient
+        return max(
+            1 + expr_need(expr.left, in_reg, scratch=True),
+            1 + operand_need(expr.right, in_reg),
+            3,
+        )
+
+    raise NotImplementedError(f"unknown op {expr.op}")
+
+
+def operand_need(expr: Expr, in_reg: Callable[[str], bool], scratch=False) -> int:
+    # Compiler._operand: variables in registers and 0 are used in place,
+    # anything else goes to the scratch target if there is one, else to a
+    # temporary
+    if _in_reg_var(expr, in_reg) or _is_zero(expr):
+        return 0
+    if scratch:
+        return expr_need(expr, in_reg, scratch=True)
+    return 1 + expr_need(expr, in_reg, scratch=True)
+
+
+def _in_reg_var(expr: Expr, in_reg: Callable[[str], bool]) -> bool:
+    return isinstance(expr, Var) and in_reg(expr.name)
+
+
+def _is_zero(expr: Expr) -> bool:
+    # read from R0
+    return isinstance(expr, Const) and to_word(expr.value) == 0
+
+
+def stmt_need(stmt: Stmt, in_reg: Callable[[str], bool]) -> int:
+    if isinstance(stmt, Assign):
+        if in_reg(stmt.name):
+            return expr_need(stmt.expr, in_reg)
+        return 1 + expr_need(stmt.expr, in_reg, scratch=True)
+    if isinstance(stmt, (While, If)):
+        return operand_need(stmt.cond, in_reg)
+    raise NotImplementedError(f"unknown stmt: {stmt!r}")
+
+
+class _Liveness:
+    # backward dataflow over the AST
+
+    def __init__(self):
+        self.live: dict[int, frozenset[str]] = {}
+        self.assign_out: dict[int, frozenset[str]] = {}
+        self.stmts: dict[int, Stmt] = {}
+
+    def block(self, stmts: list[Stmt], out: frozenset[str]) -> frozenset[str]:
+        live = out
+        for s in reversed(stmts):
+            live = self.stmt(s, live)
+        return live
+
+    def stmt(self, s: Stmt, out: frozenset[str]) -> frozenset[str]:
+        self.stmts[id(s)] = s
+        if isinstance(s, Assign):
+            live_in = (out - {s.name}) | expr_vars(s.expr)
+            self.assign_out[id(s)] = out
+            self.live[id(s)] = live_in | out
+            return live_in
+
+        if isinstance(s, If):
+            then_in = self.block(s.then_body, out)
+            else_in = self.block(s.else_body or [], out)
+            live_in = expr_vars(s.cond) | then_in | else_in
+            self.live[id(s)] = live_in
+            return live_in
+
+        if isinstance(s, While):
+            # live at the loop head, iterated to a fixed point
+            head = out | expr_vars(s.cond)
+            while True:
+                body_in = self.block(s.body, head)
+                new = head | body_in
+                if new == head:
+                    break
+                head = new
+            self.live[id(s)] = head
+            return head
+
+        raise NotImplementedError(f"unknown stmt: {s!r}")
+
+
+def _walk(stmts: list[Stmt], depth: int = 0) -> Iterable[tuple[Stmt, int]]:
+    # statements in code order with their loop depth
+    for s in stmts:
+        yield s, depth
+        if isinstance(s, If):
+            yield from _walk(s.then_body, depth)
+            yield from _walk(s.else_body or [], depth)
+        elif isinstance(s, While):
+            yield from _walk(s.body, depth + 1)
+
+
+def _stmt_vars(s: Stmt) -> list[str]:
+    # in the order the compiler meets them
+    if isinstance(s, Assign):
+        names = [s.name] + _ordered_vars(s.expr)
+    else:
+        names = _ordered_vars(s.cond)
+    return names
+
+
+def _ordered_vars(expr: Expr) -> list[str]:
+    if isinstance(expr, Var):
+        return [expr.name]
+    if isinstance(expr, BinOp):
+        return _ordered_vars(expr.left) + _ordered_vars(expr.right)
+    if isinstance(expr, CmpZero):
+        return _ordered_vars(expr.expr)
+    if isinstance(expr, Cmp):
+        return _ordered_vars(expr.left) + _ordered_vars(expr.right)
+    return []
+
+
+def allocate(prog: Program, live_out: Iterable[str] | None = None) -> Allocation:
+    """
+    Assign each variable a register or a spill slot.
+
+    Variables interfere when one is assigned while the other is live; they
+    are colored greedily in order of first appearance, so without spills
+    the first variable gets R1, the next R2 and so on, except that a
+    variable copied to or from one already colored takes its register when
+    it can. live_out lists the
+    variables whose final values matter (default: all of them, so each
+    ends up in its own register). Temporaries are not allocated here: at
+    each statement the compiler takes them from registers holding no live
+    variable, and allocate() spills until every statement has enough.
+    """
+    order: dict[str, None] = {}
+    weight: dict[str, int] = {}
+    copies: dict[str, set[str]] = {}  # variables related by "x = y"
+    for s, depth in _walk(prog.stmts):
+        for name in _stmt_vars(s):
+            order.setdefault(name)
+            weight[name] = weight.get(name, 0) + LOOP_WEIGHT**depth
+        if isinstance(s, Assign) and isinstance(s.expr, Var):
+            copies.setdefault(s.name, set()).add(s.expr.name)
+            copies.setdefault(s.expr.name, set()).add(s.name)
+
+    names = list(order)
+    out = frozenset(names if live_out is None else set(live_out) & order.keys())
+    lv = _Liveness()
+    entry_live = lv.block(prog.stmts, out)
+
+    interfere: dict[str, set[str]] = {name: set() for name in names}
+    for key, after in lv.assign_out.items():
+        target = lv.stmts[key].name
+        for other in after - {target}:
+            interfere[target].add(other)
+            interfere[other].add(target)
+    for name in entry_live:
+        for other in entry_live - {name}:
+            interfere[name].add(other)
+
+    regs, slots = _spill(names, interfere, copies, weight, lv, ALLOC_REGS)
+    frame_reg = SP
+    if len(set(slots.values())) > SP_FRAME_SLOTS:
+        frame_reg = ALLOC_REGS[-1]
+        regs, slots = _spill(names, interfere, copies, weight, lv, ALLOC_REGS[:-1])
+        slots = {name: off - FRAME_BIAS for name, off in slots.items()}
+    return Allocation(
+        regs=regs,
+        slots=slots,
+        frame_reg=frame_reg,
+        live=lv.live,
+        entry_live=entry_live,
+    )
+
+
+def _spill(
+    names: list[str],
+    interfere: dict[str, set[str]],
+    copies: dict[str, set[str]],
+    weight: dict[str, int],
+    lv: _Liveness,
+    avail: tuple[int, ...],
+) -> tuple[dict[str, int], dict[str, int]]:
+    # (registers, slot offsets from SP) spilling until every statement has
+    # room for its temporaries in avail
+    spilled: set[str] = set()
+    while True:
+        regs = _color(names, interfere, spilled, copies, avail)
+        in_reg = regs.__contains__
+
+        # every statement needs room for its temporaries
+        crowded = None
+        for key, live in lv.live.items():
+            s = lv.stmts[key]
+            used = {regs[v] for v in live if v in regs}
+            if isinstance(s, Assign) and s.name in regs:
+                used.add(regs[s.name])
+            if len(used) + stmt_need(s, in_reg) > len(avail):
+                crowded = live | {s.name} if isinstance(s, Assign) else live
+                break
+
+        if crowded is None:
+            break
+        candidates = [v for v in crowded if v in regs]
+        if not candidates:
+            raise RuntimeError("expression needs more registers than available")
+        # cheapest first, later variables before earlier ones
+        spilled.add(min(candidates, key=lambda v: (weight[v], -names.index(v))))
+
+    # heaviest first, so they get the slots nearest the frame base
+    spilled_names = sorted((n for n in names if n in spilled), key=lambda v: -weight[v])
+    return regs, _assign_slots(spilled_names, interfere)
+
+
+def _assign_slots(spilled: list[str], interfere: dict[str, set[str]]) -> dict[str, int]:
+    # spilled variables that never interfere share a slot
+    slots: dict[str, int] = {}
+    for name in spilled:
+        taken = {slots[o] for o in interfere[name] if o in slots}
+        slots[name] = next(
+            off for off in range(0, 2 * len(spilled) + 2, 2) if off not in taken
+        )
+    return slots
+
+
+def _color(
+    names: list[str],
+    interfere: dict[str, set[str]],
+    spilled: set[str],
+    copies: dict[str, set[str]],
+    avail: tuple[int, ...],
+) -> dict[str, int]:
+    regs: dict[str, int] = {}
+    for name in names:
+        if name in spilled:
+            continue
+        taken = {regs[o] for o in interfere[name] if o in regs}
+        free = [r for r in avail if r not in taken]
+        if not free:
+            spilled.add(name)
+            continue
+        # share a register with a copy source or destination so the copy
+        # becomes a move to itself
+        hints = [regs[o] for o in copies.get(name, ()) if regs.get(o) in free]
+        regs[name] = min(hints) if hints else free[0]
+    return regs
@@ -0,0 +1,196 @@
+from collections import deque
+from dataclasses import dataclass
+
+from .const import MEM_SIZE, PAGE_SHIFT
+from .machine import Machine, Snapshot
+
+# rough per-entry overhead used for the memory budget
+_ENTRY_COST = 64
+
+
+@dataclass(frozen=True, slots=True)
+class _Delta:
+    # changes against the previous frame
+    regs: tuple[tuple[int, int], ...]  # (index, value) of changed registers
+    pc: int
+    flags: int
+    halted: bool
+    waiting: bool
+    ime: bool
+    timer: int | None
+    cycles: int
+    mem: tuple[tuple[int, bytes], ...]  # (addr, bytes) of changed runs
+    cost: int
+
+
+@dataclass(slots=True)
+class _Group:
+    # a keyframe and the frames recorded after it
+    keyframe: Snapshot
+    deltas: list[_Delta]
+    cost: int
+
+
+class RewindBuffer:
+    """
+    Frame history for stepping a machine backward.
+
+    Every keyframe_interval frames a full snapshot is kept (its pages are
+    shared with the machine's other snapshots); the frames in between are
+    stored as register and changed-byte deltas against the previous frame.
+    When the history grows past max_bytes the oldest keyframe and its
+    deltas are dropped.
+    """
+
+    def __init__(
+        self,
+        machine: Machine,
+        keyframe_interval: int = 300,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        if keyframe_interval <= 0:
+            raise ValueError(f"keyframe_interval must be positive: {keyframe_interval}")
+        self.machine = machine
+        self.keyframe_interval = keyframe_interval
+        self.max_bytes = max_bytes
+
+        self._groups: deque[_Group] = deque()
+        self._frames = 0
+        self._bytes = 0
+        self._prev = machine.snapshot()
+        self._add_keyframe(self._prev)
+
+    def __len__(self) -> int:
+        # recorded frames, including the starting state
+        return self._frames
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def run_frame(self) -> None:
+        self.machine.run_frame()
+        self.record()
+
+    def record(self) -> None:
+        snap = self.machine.snapshot()
+        group = self._groups[-1]
+        if len(group.deltas) + 1 >= self.keyframe_interval:
+            self._add_keyframe(snap)
+        else:
+            delta = _diff(self._prev, snap)
+            group.deltas.append(delta)
+            group.cost += delta.cost
+            self._bytes += delta.cost
+            self._frames += 1
+        self._prev = snap
+        self._evict()
+
+    def rewind(self, n_frames: int) -> None:
+        # go back n_frames from the latest frame; later frames are discarded
+        if not 0 <= n_frames < self._frames:
+            raise ValueError(f"can rewind 0..{self._frames - 1} frames, not {n_frames}")
+
+        for _ in range(n_frames):
+            group = self._groups[-1]
+            if group.deltas:
+                delta = group.deltas.pop()
+                group.cost -= delta.cost
+                self._bytes -= delta.cost
+            else:
+                self._groups.pop()
+                self._bytes -= group.cost
+            self._frames -= 1
+
+        snap = _replay(self._groups[-1])
+        self.machine.restore(snap)
+        self._prev = snap
+
+    def _add_keyframe(self, snap: Snapshot) -> None:
+        cost = MEM_SIZE + _ENTRY_COST
+        self._groups.append(_Group(keyframe=snap, deltas=[], cost=cost))
+        self._bytes += cost
+        self._frames += 1
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and len(self._groups) > 1:
+            group = self._groups.popleft()
+            self._bytes -= group.cost
+            self._frames -= 1 + len(group.deltas)
+
+
+def _diff(prev: Snapshot, snap: Snapshot) -> _Delta:
+    regs = tuple(
+        (i, v) for i, (old, v) in enumerate(zip(prev.regs, snap.regs)) if old != v
+    )
+
+    mem = []
+    for page, (old, new) in enumerate(zip(prev.pages, snap.pages)):
+        if old is new:
+            continue
+        run = _changed_run(old, new)
+        if run is not None:
+            start, end = run
+            mem.append(((page << PAGE_SHIFT) + start, new[start:end]))
+
+    cost = _ENTRY_COST + 2 * len(regs) + sum(8 + len(data) for _, data in mem)
+    return _Delta(
+        regs=regs,
+        pc=snap.pc,
+        flags=snap.flags,
+        halted=snap.halted,
+        waiting=snap.waiting,
+        ime=snap.ime,
+        timer=snap.timer,
+        cycles=snap.cycles,
+        mem=tuple(mem),
+        cost=cost,
+    )
+
+
+def _changed_run(old: bytes, new: bytes) -> tuple[int, int] | None:
+    # [start, end) spanning every differing byte
+    if old == new:
+        return None
+    start = 0
+    while old[start] == new[start]:
+        start += 1
+    end = len(new)
+    while old[end - 1] == new[end - 1]:
+        end -= 1
+    return start, end
+
+
+def _replay(group: _Group) -> Snapshot:
+    key = group.keyframe
+    if not group.deltas:
+        return key
+
+    regs = list(key.regs)
+    pages = list(key.pages)
+    edited: dict[int, bytearray] = {}
+    for delta in group.deltas:
+        for i, v in delta.regs:
+            regs[i] = v
+        for addr, data in delta.mem:
+            page = addr >> PAGE_SHIFT
+            if page not in edited:
+                edited[page] = bytearray(pages[page])
+            offset = addr - (page << PAGE_SHIFT)
+            edited[page][offset : offset + len(data)] = data
+
+    for page, data in edited.items():
+        pages[page] = bytes(data)
+
+    last = group.deltas[-1]
+    return Snapshot(
+        regs=tuple(regs),
+        pc=last.pc,
+        flags=last.flags,
+        halted=last.halted,
+        waiting=last.waiting,
+        ime=last.ime,
+        timer=last.timer,
+        cycles=last.cycles,
+        pages=tuple(pages),
+    )
@@ -0,0 +1,67 @@
+import heapq
+import itertools
+from collections.abc import Callable
+from dataclasses import dataclass
+
+# called with the cycle the event was scheduled for
+type EventCallback = Callable[[int], None]
+
+
+@dataclass(slots=True, eq=False)
+class Event:
+    cycle: int
+    callback: EventCallback
+    cancelled: bool = False
+
+
+class Scheduler:
+    """
+    Device deadlines ordered by cycle (a heap).
+
+    The machine runs the CPU uninterrupted up to next_deadline() and then
+    calls run_due, so devices cost nothing between their deadlines.
+    Events due at the same cycle run in the order they were scheduled; a
+    callback may schedule further events (e.g. a periodic timer
+    rescheduling itself at cycle + period).
+    """
+
+    def __init__(self, clock: Callable[[], int]):
+        self.clock = clock
+        # (cycle, sequence number, event)
+        self._heap: list[tuple[int, int, Event]] = []
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return sum(not e.cancelled for _, _, e in self._heap)
+
+    def at(self, cycle: int, callback: EventCallback) -> Event:
+        event = Event(cycle, callback)
+        heapq.heappush(self._heap, (cycle, next(self._seq), event))
+        return event
+
+    def after(self, delay: int, callback: EventCallback) -> Event:
+        return self.at(self.clock() + delay, callback)
+
+    def clear(self) -> None:
+        for _, _, event in self._heap:
+            event.cancelled = True
+        self._heap.clear()
+
+    def cancel(self, event: Event) -> None:
+        # dropped lazily when it reaches the top of the heap
+        event.cancelled = True
+
+    def next_deadline(self) -> int | None:
+        heap = self._heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def run_due(self, now: int) -> None:
+        # runs every event scheduled at or before now
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            cycle, _, event = heapq.heappop(heap)
+            if not event.cancelled:
+                event.cancelled = True  # done; cancel() is now a no-op
+                event.callback(cycle)
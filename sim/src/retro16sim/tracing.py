@@ -0,0 +1,89 @@
+import struct
+from array import array
+from collections.abc import Iterator
+from typing import NamedTuple
+
+from .const import FLAG_C, FLAG_N, FLAG_V, FLAG_Z, OPCODE_MASK, OPCODE_SHIFT
+from .cpu import CPU
+from .isa import Op
+
+# one record: pc, instr, r0..r7, packed flags (CPU.flags), native 16-bit words
+RECORD_WORDS = 11
+_RECORD = struct.Struct(f"={RECORD_WORDS}H")
+
+
+class TraceRecord(NamedTuple):
+    # machine state before the instruction at pc ran
+    pc: int
+    instr: int
+    regs: tuple[int, ...]
+    flags: int
+
+
+class TraceBuffer:
+    """
+    Ring buffer of fixed-size binary trace records.
+
+    Storage is a preallocated array('H') of capacity records; once full,
+    the oldest records are overwritten. Records are decoded only when read.
+    """
+
+    def __init__(self, capacity: int = 65536):
+        if capacity <= 0:
+            raise ValueError(f"capacity must be positive: {capacity}")
+        self.capacity = capacity
+        self.data = array("H", bytes(capacity * _RECORD.size))
+        self._next = 0  # record index written next
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def clear(self) -> None:
+        self._next = 0
+        self._count = 0
+
+    def append(self, pc: int, instr: int, regs: list[int], flags: int) -> None:
+        _RECORD.pack_into(self.data, self._next * _RECORD.size, pc, instr, *regs, flags)
+        self._next = (self._next + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def records(self) -> Iterator[TraceRecord]:
+        # oldest first
+        start = (self._next - self._count) % self.capacity
+        for i in range(self._count):
+            offset = (start + i) % self.capacity * _RECORD.size
+            pc, instr, *regs, flags = _RECORD.unpack_from(self.data, offset)
+            yield TraceRecord(pc, instr, tuple(regs), flags)
+
+    def lines(self) -> Iterator[str]:
+        for rec in self.records():
+            yield format_record(rec)
+
+
+def run_traced(cpu: CPU, buf: TraceBuffer, n: int) -> int:
+    # like n calls to cpu.step(), recording each instruction first
+    cycles = 0
+    load16 = cpu.bus.load16
+    append = buf.append
+    for _ in range(n):
+        if cpu.halted:
+            break
+        pc = cpu.pc
+        append(pc, load16(pc), cpu.reg, cpu.flags)
+        cycles += cpu.step()
+    return cycles
+
+
+def format_record(rec: TraceRecord) -> str:
+    opcode = (rec.instr >> OPCODE_SHIFT) & OPCODE_MASK
+    try:
+        name = Op(opcode).name
+    except ValueError:
+        name = f"?{opcode:X}"
+    regs = " ".join(f"{r:04X}" for r in rec.regs)
+    flags = "".join(
+        "1" if rec.flags & bit else "0" for bit in (FLAG_Z, FLAG_N, FLAG_C, FLAG_V)
+    )
+    return f"PC={rec.pc:04X} INSTR={rec.instr:04X} {name:<4} REG={regs} ZNCV={flags}"
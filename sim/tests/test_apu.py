@@ -0,0 +1,205 @@
+import wave
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from retro16sim import Machine, build_test_rom
+from retro16sim.apu import (
+    APU,
+    APU_CTRL,
+    APU_WAVE,
+    LOG_LIMIT,
+    CH_NOISE,
+    CH_SQUARE1,
+    CH_SQUARE2,
+    CH_WAVE,
+    CHANNEL_COUNT,
+    CHANNEL_STRIDE,
+    FRAME_SAMPLES,
+    REG_DUTY,
+    REG_FREQ,
+    REG_VOLUME,
+    SAMPLE_RATE,
+    SampleRing,
+)
+from retro16sim.assembler import asm_addi, asm_halt, asm_jmp, asm_st
+from retro16sim.bus import Bus
+from retro16sim.const import APU_REG_BASE, FRAME_CYCLES
+
+FULL = 32767 // CHANNEL_COUNT
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self) -> int:
+        return self.now
+
+
+def channel(bus: Bus, ch: int, freq: int, volume: int = 15, duty: int = 2) -> None:
+    base = APU_REG_BASE + CHANNEL_STRIDE * ch
+    bus.store16(base + REG_FREQ, freq)
+    bus.store16(base + REG_VOLUME, volume)
+    bus.store16(base + REG_DUTY, duty)
+
+
+def sign_changes(samples) -> int:
+    s = np.sign(samples)
+    return int((s[1:] != s[:-1]).sum())
+
+
+def test_square_wave() -> None:
+    bus = Bus()
+    apu = APU(bus, FakeClock())
+    channel(bus, CH_SQUARE1, 1200, duty=2)
+    bus.store16(APU_CTRL, 1 << CH_SQUARE1)
+
+    samples = apu.end_frame(0)
+    assert samples.dtype == np.int16 and len(samples) == FRAME_SAMPLES
+    assert set(np.unique(samples)) == {-FULL, FULL}
+    # 1200 Hz over 1/60 s: 20 periods, 40 edges
+    assert sign_changes(samples) in (39, 40)
+    assert abs(int((samples > 0).sum()) - FRAME_SAMPLES // 2) <= 2
+
+    # 25% duty, and the phase carries over into the next frame
+    bus.store16(APU_REG_BASE + REG_DUTY, 1)
+    samples = apu.end_frame(FRAME_CYCLES)
+    assert abs(int((samples > 0).sum()) - FRAME_SAMPLES // 4) <= 2
+
+
+def test_writes_take_effect_at_their_cycle() -> None:
+    bus = Bus()
+    clock = FakeClock()
+    apu = APU(bus, clock)
+    channel(bus, CH_SQUARE2, 600, volume=15)
+    apu.end_frame(0)  # nothing enabled
+
+    start = FRAME_CYCLES
+    clock.now = start + FRAME_CYCLES // 4
+    bus.store16(APU_CTRL, 1 << CH_SQUARE2)
+    clock.now = start + FRAME_CYCLES * 3 // 4
+    bus.store16(APU_REG_BASE + CHANNEL_STRIDE * CH_SQUARE2 + REG_VOLUME, 0)
+
+    samples = apu.end_frame(start)
+    quarter = FRAME_SAMPLES // 4
+    assert not samples[:quarter].any()
+    assert (np.abs(samples[quarter : 3 * quarter]) == FULL).all()
+    assert not samples[3 * quarter :].any()
+
+    # the last values stay in effect
+    assert not apu.end_frame(start + FRAME_CYCLES).any()
+
+
+def test_wave_and_noise_channels() -> None:
+    bus = Bus()
+    apu = APU(bus, FakeClock())
+    # ramp 0..15, 0..15
+    bus.write(APU_WAVE, bytes((2 * i) << 4 | (2 * i + 1) for i in range(8)) * 2)
+    channel(bus, CH_WAVE, SAMPLE_RATE // 32)  # one table entry per sample
+    bus.store16(APU_CTRL, 1 << CH_WAVE)
+    samples = apu.end_frame(0)
+    expected = ((np.arange(32) % 16) / 7.5 - 1) * FULL
+    assert np.allclose(samples[:32], expected, atol=1)
+
+    channel(bus, CH_NOISE, 20000, volume=8)
+    bus.store16(APU_CTRL, 1 << CH_NOISE)
+    noise = apu.end_frame(FRAME_CYCLES)
+    level = int(FULL * 8 / 15)
+    assert set(np.unique(noise)) == {-level, level}
+    assert 0.3 < (noise > 0).mean() < 0.7
+
+    # deterministic
+    other = APU(Bus(), FakeClock())
+    channel(other.bus, CH_NOISE, 20000, volume=8)
+    other.bus.store16(APU_CTRL, 1 << CH_NOISE)
+    assert (other.end_frame(0) == noise).all()
+
+
+def test_sample_ring_drops_oldest() -> None:
+    ring = SampleRing(10)
+    ring.write(np.arange(6, dtype=np.int16))
+    assert list(ring.read(4)) == [0, 1, 2, 3]
+    ring.write(np.arange(6, 14, dtype=np.int16))  # wraps around
+    assert len(ring) == 10 and ring.dropped == 0
+    ring.write(np.array([14, 15], dtype=np.int16))
+    assert ring.dropped == 2
+    assert list(ring.read()) == list(range(6, 16))
+    ring.write(np.arange(25, dtype=np.int16))
+    assert list(ring.read()) == list(range(15, 25))
+    assert ring.dropped == 17
+
+
+def test_machine_streams_frames(tmp_path) -> None:
+    m = Machine()
+    # 100 cycles in, enable square 1 (R1 = value, R2 = APU_CTRL)
+    words = [asm_addi(rd=3, rs=3, imm=1)] * 100
+    words += [asm_st(rs=1, base=2, off=0), asm_halt()]
+    m.load_rom(build_test_rom(words))
+    m.cpu.reg[1] = 1 << CH_SQUARE1
+    m.cpu.reg[2] = APU_CTRL
+    channel(m.bus, CH_SQUARE1, 1000)
+
+    path = tmp_path / "out.wav"
+    m.apu.start_wav(path)
+    m.run_frame()
+    m.run_frame()
+    m.apu.stop_wav()
+
+    first = m.apu.ring.read(FRAME_SAMPLES)
+    at = 100 * FRAME_SAMPLES // FRAME_CYCLES
+    assert not first[:at].any()
+    assert (np.abs(first[at:]) == FULL).all()
+    assert len(m.apu.ring) == FRAME_SAMPLES
+
+    with wave.open(str(path), "rb") as w:
+        assert w.getframerate() == SAMPLE_RATE
+        assert w.getnchannels() == 1 and w.getsampwidth() == 2
+        data = np.frombuffer(w.readframes(w.getnframes()), dtype="<i2")
+    assert len(data) == 2 * FRAME_SAMPLES
+    assert (data[:FRAME_SAMPLES] == first).all()
+
+
+def test_block_engine_stamps_writes_per_block() -> None:
+    m = Machine(engine="block")
+    words = [asm_addi(rd=3, rs=3, imm=1)] * 100
+    words += [asm_st(rs=1, base=2, off=0), asm_halt()]
+    m.load_rom(build_test_rom(words))
+    m.cpu.reg[1] = 1 << CH_SQUARE1
+    m.cpu.reg[2] = APU_CTRL
+    channel(m.bus, CH_SQUARE1, 1000)
+    m.run_frame()
+    # stamped with the start of the block holding the store: no later than
+    # the interpreter's stamp
+    at = 100 * FRAME_SAMPLES // FRAME_CYCLES
+    sound = np.flatnonzero(m.apu.samples)
+    assert sound[0] <= at
+    assert len(sound) == FRAME_SAMPLES - sound[0]
+
+
+def test_write_log_stays_bounded_without_frames() -> None:
+    m = Machine()
+    # stores to APU_CTRL (R2) in a loop, never ending a frame
+    m.load_rom(build_test_rom([asm_st(rs=1, base=2, off=0), asm_jmp(off_words=-2)]))
+    m.cpu.reg[2] = APU_CTRL
+    m.run_n_steps(5 * FRAME_CYCLES)
+    # two byte writes per store, one store per two cycles
+    assert len(m.apu._log) <= max(2 * LOG_LIMIT, 2 * FRAME_CYCLES)
+
+
+def test_restore_drops_writes_of_the_abandoned_frame() -> None:
+    m = Machine()
+    words = [asm_addi(rd=3, rs=3, imm=1)] * 100
+    words += [asm_st(rs=1, base=2, off=0), asm_halt()]
+    m.load_rom(build_test_rom(words))
+    m.cpu.reg[1] = 1 << CH_SQUARE1
+    m.cpu.reg[2] = APU_CTRL
+    channel(m.bus, CH_SQUARE1, 1000)
+    snap = m.snapshot()
+
+    m.run_n_steps(200)  # enables the channel
+    m.restore(snap)
+    m.cpu.reg[1] = 0  # this time the store keeps it off
+    m.run_frame()
+    assert not m.apu.samples.any()
@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from retro16sim import Machine, build_test_rom
+from retro16sim.batch import MachineBatch
+from retro16sim.lang import compile_program_to_rom
+from retro16sim.parser import parse_program
+from .test_helpers import prog_countdown, random_program
+
+
+def assert_lane_matches(batch: MachineBatch, lane: int, m: Machine) -> None:
+    cpu = m.cpu
+    assert batch.reg[lane].tolist() == cpu.reg
+    assert int(batch.pc[lane]) == cpu.pc
+    assert bool(batch.halted[lane]) == cpu.halted
+    assert int(batch.cycles[lane]) == m.cycles
+    flags = (batch.flag_z, batch.flag_n, batch.flag_c, batch.flag_v)
+    assert tuple(bool(f[lane]) for f in flags) == (
+        cpu.flag_z,
+        cpu.flag_n,
+        cpu.flag_c,
+        cpu.flag_v,
+    )
+    assert batch.mem[lane].tobytes() == bytes(m.bus.mem)
+
+
+def test_batch_matches_machines_on_random_programs() -> None:
+    rng = random.Random(1234)
+    images = [build_test_rom(random_program(rng, 30)) for _ in range(32)]
+
+    batch = MachineBatch(len(images))
+    batch.reset()
+    batch.load_roms(images)
+    machines = []
+    for data in images:
+        m = Machine()
+        m.reset()
+        m.load_rom(data)
+        machines.append(m)
+
+    for n in (1, 5, 40, 300):
+        batch.run_n_steps(n)
+        for lane, m in enumerate(machines):
+            m.run_n_steps(n)
+            assert_lane_matches(batch, lane, m)
+
+
+def test_batch_runs_lang_program_in_every_lane() -> None:
+    src = "x = 5; y = 0; while (x != 0) { x = x - 1; y = y + 2; }"
+    batch = MachineBatch(4)
+    batch.reset()
+    batch.load_rom(build_test_rom(compile_program_to_rom(parse_program(src))))
+    batch.run_frame()
+
+    assert batch.halted.all()
+    assert batch.reg[:, 1].tolist() == [0] * 4
+    assert batch.reg[:, 2].tolist() == [10] * 4
+
+
+def test_batch_unknown_opcode_faults_lane() -> None:
+    batch = MachineBatch(2)
+    batch.reset()
+    batch.load_roms([build_test_rom(prog_countdown()), build_test_rom([0xA000])])
+    batch.run_n_steps(100)
+
+    assert batch.halted.tolist() == [True, True]
+    assert batch.faulted.tolist() == [False, True]
+    assert int(batch.pc[1]) == 0
+    assert int(batch.reg[0, 1]) == 0
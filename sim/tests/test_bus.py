@@ -0,0 +1,144 @@
+import pytest
+
+from retro16sim.bus import Bus
+from retro16sim.const import (
+    IO_REG_BASE,
+    PAGE_SIZE,
+    ROM_END,
+    VRAM_BLOCK_SHIFT,
+    VRAM_END,
+    VRAM_START,
+)
+
+
+class RecordingDevice:
+    def __init__(self):
+        self.regs = bytearray(PAGE_SIZE)
+        self.stores: list[tuple[int, int]] = []
+
+    def load8(self, addr: int) -> int:
+        return self.regs[addr - IO_REG_BASE]
+
+    def store8(self, addr: int, val: int) -> None:
+        self.stores.append((addr, val))
+        self.regs[addr - IO_REG_BASE] = val
+
+
+def test_load16_store16_little_endian() -> None:
+    bus = Bus()
+    bus.store16(0x4000, 0x1234)
+    assert bus.mem[0x4000:0x4002] == b"\x34\x12"
+    assert bus.load16(0x4000) == 0x1234
+
+
+def test_unaligned_word_access() -> None:
+    bus = Bus()
+    bus.store16(0x40FF, 0xABCD)  # crosses a page boundary
+    assert bus.load8(0x40FF) == 0xCD
+    assert bus.load8(0x4100) == 0xAB
+    assert bus.load16(0x40FF) == 0xABCD
+
+
+def test_word_access_wraps_around_memory() -> None:
+    bus = Bus()
+    bus.store16(0xFFFF, 0x1234)
+    assert bus.load8(0xFFFF) == 0x34
+    assert bus.mem[0x0000] == 0  # ROM is not written
+    assert bus.load16(0xFFFE + 0x10000) == bus.load16(0xFFFE)
+
+
+def test_rom_is_read_only() -> None:
+    bus = Bus()
+    bus.mem[ROM_END - 1] = 0x55
+    bus.store16(ROM_END - 1, 0xFFFF)
+    bus.store8(ROM_END, 0xFF)
+    assert bus.load16(ROM_END - 1) == 0x0055
+
+
+def test_mmio_device() -> None:
+    bus = Bus()
+    dev = RecordingDevice()
+    bus.map_device(IO_REG_BASE, PAGE_SIZE, dev)
+
+    bus.store16(IO_REG_BASE + 2, 0xBEEF)
+    assert dev.stores == [(IO_REG_BASE + 2, 0xEF), (IO_REG_BASE + 3, 0xBE)]
+    assert bus.load16(IO_REG_BASE + 2) == 0xBEEF
+    assert bus.mem[IO_REG_BASE + 2] == 0  # not backed by RAM
+
+
+def test_map_device_needs_whole_pages() -> None:
+    bus = Bus()
+    with pytest.raises(ValueError):
+        bus.map_device(IO_REG_BASE + 1, PAGE_SIZE, RecordingDevice())
+    with pytest.raises(ValueError):
+        bus.map_device(IO_REG_BASE, 16, RecordingDevice())
+
+
+def test_store_to_watched_code_page_calls_hooks() -> None:
+    bus = Bus()
+    writes = []
+    bus.add_code_write_hook(lambda start, end: writes.append((start, end)))
+    bus.watch_code(0x4010)
+
+    bus.store16(0x4010, 0x1234)
+    bus.store16(0x5000, 0x1234)  # not watched
+    assert writes == [(0x4010, 0x4011), (0x4011, 0x4012)]
+    assert bus.load16(0x4010) == 0x1234
+
+
+def test_bulk_write_and_read() -> None:
+    bus = Bus()
+    bus.write(0x0000, b"\x01\x02\x03")  # ROM can be loaded
+    bus.write(0x40FE, bytes(range(4)))
+    assert bus.read(0x0000, 3) == b"\x01\x02\x03"
+    assert bus.read(0x40FE, 4) == bytes(range(4))
+
+    with pytest.raises(ValueError):
+        bus.write(0xFFFF, b"\x00\x00")
+
+
+def test_bulk_write_invalidates_code() -> None:
+    bus = Bus()
+    writes = []
+    bus.add_code_write_hook(lambda start, end: writes.append((start, end)))
+    bus.write(0x4000, bytes(8))
+    assert writes == [(0x4000, 0x4008)]
+
+
+def test_read_through_device() -> None:
+    bus = Bus()
+    dev = RecordingDevice()
+    bus.map_device(IO_REG_BASE, PAGE_SIZE, dev)
+    dev.regs[0:2] = b"\xaa\xbb"
+    assert bus.read(IO_REG_BASE, 2) == b"\xaa\xbb"
+
+
+def test_vram_dirty_blocks() -> None:
+    bus = Bus()
+    bus.store16(VRAM_START, 1)
+    assert not any(bus.vram_dirty)  # not tracked yet
+
+    bus.track_vram()
+    assert all(bus.vram_dirty)
+    bus.vram_dirty[:] = bytes(len(bus.vram_dirty))
+
+    block = 1 << VRAM_BLOCK_SHIFT
+    bus.store16(VRAM_START + 3 * block + 4, 0x1234)
+    bus.store8(VRAM_END, 1)
+    bus.store16(VRAM_START - 2, 1)  # outside the window
+    assert [i for i, d in enumerate(bus.vram_dirty) if d] == [
+        3,
+        len(bus.vram_dirty) - 1,
+    ]
+
+    bus.vram_dirty[:] = bytes(len(bus.vram_dirty))
+    bus.write(VRAM_START + block - 1, b"\1\2")  # straddles two blocks
+    assert [i for i, d in enumerate(bus.vram_dirty) if d] == [0, 1]
+
+    bus.vram_dirty[:] = bytes(len(bus.vram_dirty))
+    pages = bus.snapshot_pages()
+    bus.store8(VRAM_START, 9)
+    bus.vram_dirty[:] = bytes(len(bus.vram_dirty))
+    bus.restore_pages(pages)
+    assert bus.vram_dirty[0]
+    assert bus.mem[VRAM_START] == 1
@@ -0,0 +1,116 @@
+import pytest
+
+from retro16sim import lang
+from retro16sim.compile_cache import CompileCache
+from retro16sim.lang import Compiler, If, Stmt, While
+from retro16sim.parser import parse_program
+
+SRC = """
+x = 3; y = 0;
+while (x != 0) {
+    y = y + x;
+    x = x - 1;
+}
+if (y == 6) { z = 1; } else { z = 2; }
+"""
+
+
+def compile_direct(src: str, **kwargs) -> list[int]:
+    return Compiler(**kwargs).compile_program(parse_program(src))
+
+
+def spans(stmts: list[Stmt]) -> list:
+    out = []
+    for s in stmts:
+        out.append(s.span)
+        if isinstance(s, While):
+            out.append(spans(s.body))
+        elif isinstance(s, If):
+            out.append(spans(s.then_body))
+            out.append(spans(s.else_body or []))
+    return out
+
+
+def test_memory_hits() -> None:
+    cache = CompileCache()
+    words = cache.compile(SRC)
+
+    assert words == compile_direct(SRC)
+    assert cache.compile(SRC) == words
+    assert cache.stats["misses"] == 1 and cache.stats["hits"] == 1
+
+    words.append(0)  # callers get their own list
+    assert cache.compile(SRC) == compile_direct(SRC)
+
+
+def test_options_are_part_of_the_key() -> None:
+    cache = CompileCache()
+    plain = cache.compile(SRC)
+    only_y = cache.compile(SRC, live_out=["y"])
+    with_ir = cache.compile(SRC, ir_passes=["copyprop", "dce"])
+
+    assert cache.stats["misses"] == 3
+    assert only_y == compile_direct(SRC, live_out=["y"])
+    assert with_ir == compile_direct(SRC, ir_passes=["copyprop", "dce"])
+    assert cache.key(SRC) != cache.key(SRC, optimize=False)
+    assert cache.key(SRC, live_out=["a", "b"]) == cache.key(SRC, live_out=["b", "a"])
+    assert plain == compile_direct(SRC)
+
+
+def test_compiler_version_is_part_of_the_key(monkeypatch) -> None:
+    cache = CompileCache()
+    key = cache.key(SRC)
+    monkeypatch.setattr(lang, "COMPILER_VERSION", lang.COMPILER_VERSION + 1)
+    assert cache.key(SRC) != key
+
+
+def test_disk_store(tmp_path) -> None:
+    words = CompileCache(tmp_path).compile(SRC)
+
+    cache = CompileCache(tmp_path)
+    assert cache.compile(SRC) == words
+    assert cache.stats["disk_hits"] == 1 and not cache.stats["misses"]
+    assert len(list(tmp_path.glob("*.rom"))) == 1
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_corrupt_disk_entry_is_recompiled(tmp_path) -> None:
+    cache = CompileCache(tmp_path)
+    words = cache.compile(SRC)
+    (path,) = tmp_path.glob("*.rom")
+    path.write_bytes(b"\x01")
+
+    cache = CompileCache(tmp_path)
+    assert cache.compile(SRC) == words
+    assert cache.stats["misses"] == 1
+
+
+def test_lru_eviction() -> None:
+    cache = CompileCache(max_entries=2)
+    for src in ("a = 1;", "a = 2;", "a = 1;", "a = 3;", "a = 1;", "a = 2;"):
+        cache.compile(src)
+    # "a = 2;" was evicted by "a = 3;"
+    assert cache.stats["hits"] == 2
+    assert cache.stats["misses"] == 4
+
+
+def test_unchanged_statements_are_not_reparsed() -> None:
+    cache = CompileCache()
+    cache.compile(SRC)
+    assert cache.stats["stmt_misses"] == 4
+
+    edited = SRC.replace("z = 2;", "z = 5;") + "w = z;"
+    prog = cache.parse("\n\n" + edited)
+    assert cache.stats["stmt_hits"] == 3
+    assert cache.stats["stmt_misses"] == 6
+
+    expected = parse_program("\n\n" + edited)
+    assert prog == expected
+    assert spans(prog.stmts) == spans(expected.stmts)
+    assert cache.compile(edited) == compile_direct(edited)
+
+
+@pytest.mark.parametrize("src", ["x = ;", "while (x != 0) { x = 1;", "x = 1; }"])
+def test_syntax_errors_are_reported(src: str) -> None:
+    with pytest.raises(SyntaxError):
+        CompileCache().compile(src)
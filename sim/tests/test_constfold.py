@@ -0,0 +1,150 @@
+import pytest
+
+from retro16sim.constfold import fold_expr, fold_program
+from retro16sim.lang import (
+    Assign,
+    BinOp,
+    Cmp,
+    CmpZero,
+    Const,
+    If,
+    Program,
+    Var,
+    While,
+)
+from retro16sim.parser import parse_program
+
+from .test_helpers import run_compiled, var_value
+
+
+def test_fold_constant_subtrees() -> None:
+    expr = BinOp("+", Var("x"), BinOp("*", Const(3), BinOp("-", Const(10), Const(4))))
+    assert fold_expr(expr) == BinOp("+", Var("x"), Const(18))
+
+
+def test_fold_wraps_to_16_bits() -> None:
+    assert fold_expr(BinOp("*", Const(300), Const(300))) == Const(24464)
+    assert fold_expr(BinOp("-", Const(0), Const(32768))) == Const(-32768)
+    assert fold_expr(Const(65535)) == Const(-1)
+    assert fold_expr(BinOp("/", Const(-1), Const(2))) == Const(32767)  # unsigned
+    assert fold_expr(BinOp("/", Const(7), Const(0))) == Const(0)
+
+
+@pytest.mark.parametrize(
+    "expr, folded",
+    [
+        (BinOp("+", Const(0), Var("x")), Var("x")),
+        (BinOp("-", Var("x"), Const(0)), Var("x")),
+        (BinOp("-", Var("x"), Var("x")), Const(0)),
+        (BinOp("*", Var("x"), Const(0)), Const(0)),
+        (BinOp("*", Const(1), Var("x")), Var("x")),
+        (BinOp("/", Var("x"), Const(1)), Var("x")),
+        (BinOp("/", Const(0), Var("x")), Const(0)),
+        (BinOp("*", Const(5), Var("x")), BinOp("*", Var("x"), Const(5))),
+    ],
+)
+def test_fold_identities(expr, folded) -> None:
+    assert fold_expr(expr) == folded
+
+
+def test_fold_reassociates_constant_offsets() -> None:
+    expr = BinOp("-", BinOp("+", BinOp("-", Var("x"), Const(1)), Const(40)), Const(2))
+    assert fold_expr(expr) == BinOp("+", Var("x"), Const(37))
+
+
+def test_fold_conditions() -> None:
+    assert fold_expr(Cmp(Const(3), op="==", right=BinOp("+", Const(1), Const(2)))) == (
+        Const(1)
+    )
+    assert fold_expr(CmpZero(expr=Const(0), op="!=")) == Const(0)
+    assert fold_expr(Cmp(Var("x"), op="!=", right=BinOp("-", Const(2), Const(2)))) == (
+        CmpZero(expr=Var("x"), op="!=")
+    )
+
+
+def test_fold_program_keeps_unchanged_statements() -> None:
+    keep = Assign("y", Var("x"), span=(0, 6))
+    fold = Assign("x", BinOp("+", Const(1), Const(2)), span=(7, 16))
+    loop = While(cond=CmpZero(expr=Var("x"), op="!="), body=[keep])
+    origin: dict = {}
+    prog = fold_program(Program(stmts=[fold, loop, If(Var("x"), [keep])]), origin)
+
+    assert prog.stmts[0] == Assign("x", Const(3))
+    assert prog.stmts[0].span == (7, 16)
+    assert origin == {id(prog.stmts[0]): fold}
+    assert prog.stmts[1] is loop
+    assert prog.stmts[2].then_body[0] is keep
+
+    same = Program(stmts=[keep])
+    assert fold_program(same) is same
+
+
+def compile_src(src: str, **kwargs):
+    return run_compiled(parse_program(src), **kwargs)
+
+
+@pytest.mark.parametrize("value", [32, -33, 100, 1000, 12345, 32767, -32768, 65535])
+def test_large_constants(value: int) -> None:
+    c, m = compile_src(f"x = {value};")
+    assert var_value(c, m, "x") == value & 0xFFFF
+
+
+@pytest.mark.parametrize("optimize", [True, False])
+def test_arithmetic_lowering(optimize: bool) -> None:
+    src = """
+    a = 7;
+    b = 5;
+    s = a + b;
+    d = b - a;
+    n = (a + b) - (a - b) + 1000;
+    p = a * b;
+    q = 100 / a;
+    r = a * -3 + b * 12;
+    t = (a * b + 3) / (b - 1);
+    z = b / 0;
+    a = a * b;
+    b = a / b;
+    """
+    c, m = compile_src(src, optimize=optimize)
+    expected = {
+        "s": 12,
+        "d": -2 & 0xFFFF,
+        "n": 1010,
+        "p": 35,
+        "q": 14,
+        "r": 39,
+        "t": 9,
+        "z": 0,
+        "a": 35,
+        "b": 7,
+    }
+    assert {name: var_value(c, m, name) for name in expected} == expected
+
+
+def test_multiply_and_divide_bind_tighter() -> None:
+    c, m = compile_src("x = 2 + 3 * 4 - 10 / 5; y = (2 + 3) * 4;")
+    assert var_value(c, m, "x") == 12
+    assert var_value(c, m, "y") == 20
+
+
+def test_folded_program_is_smaller() -> None:
+    src = "x = 3 * (4 + 5) - 20; y = x * 1 + 0;"
+    c, m = compile_src(src)
+    unfolded, _ = compile_src(src, optimize=False)
+
+    assert var_value(c, m, "x") == 7
+    assert var_value(c, m, "y") == 7
+    assert len(c.rom_words) < len(unfolded.rom_words)
+
+
+def test_loops_spill_when_registers_run_out() -> None:
+    names = [f"v{i}" for i in range(6)]
+    src = "".join(f"{n} = {i + 2};" for i, n in enumerate(names))
+    src += "p = v0 * v1; q = v5 / v0; v2 = v2 * v3;"
+    src += "".join(f"{n} = {n} + 1;" for n in names)
+    c, m = compile_src(src)
+
+    assert c.var_slots
+    assert var_value(c, m, "p") == 6
+    assert var_value(c, m, "q") == 3
+    assert [var_value(c, m, n) for n in names] == [3, 4, 21, 6, 7, 8]
@@ -1,6 +1,84 @@
+from retro16sim import build_test_rom
+from retro16sim.assembler import asm_addi, asm_halt
+from retro16sim.const import FLAG_Z, FLAG_N, FLAG_C, FLAG_V
+from .test_helpers import prog_infinite_loop_r1_add, prog_add_two_then_halt
+
+
 def test_machine_initial_state(machine):
     assert len(machine.cpu.reg) > 0
 
 
 def test_cpu_reset(machine):
     assert machine.cpu.pc == 0
+
+
+def test_step_reuses_predecoded_instruction(machine):
+    machine.load_rom(build_test_rom(prog_infinite_loop_r1_add()), 0x0000)
+    machine.run_n_steps(10)
+
+    assert set(machine.cpu._decoded) == {0x0000, 0x0002}
+    assert machine.cpu.reg[1] == 5
+
+
+def test_store_invalidates_predecoded_instruction(machine):
+    # code in RAM, so that ST can overwrite it
+    machine.load_rom(build_test_rom(prog_add_two_then_halt()), 0x4000)
+    machine.cpu.pc = 0x4000
+    machine.run_step()
+    assert machine.cpu.reg[1] == 1
+
+    machine.bus.store16(0x4000, asm_addi(rd=2, rs=2, imm=5))
+    assert 0x4000 not in machine.cpu._decoded
+
+    machine.cpu.pc = 0x4000
+    machine.run_step()
+    assert machine.cpu.reg[2] == 5
+
+
+def test_load_rom_invalidates_predecoded_instruction(machine):
+    machine.load_rom(build_test_rom(prog_add_two_then_halt()), 0x0000)
+    machine.run_n_steps(5)
+    assert machine.cpu.reg[1] == 2
+
+    machine.load_rom(build_test_rom([asm_addi(rd=2, rs=2, imm=1), asm_halt()]))
+    machine.reset()
+    machine.run_n_steps(5)
+    assert machine.cpu.reg[1] == 0
+    assert machine.cpu.reg[2] == 1
+
+
+def test_flags_are_materialized_from_last_alu_op(machine):
+    rom_words = [
+        asm_addi(rd=1, rs=0, imm=-1),  # R1 = 0xFFFF
+        asm_addi(rd=2, rs=1, imm=1),  # 0xFFFF + 1: Z, C
+        asm_halt(),
+    ]
+    machine.load_rom(build_test_rom(rom_words), 0x0000)
+    machine.run_n_steps(2)
+
+    cpu = machine.cpu
+    assert (cpu.flag_z, cpu.flag_n, cpu.flag_c, cpu.flag_v) == (
+        True,
+        False,
+        True,
+        False,
+    )
+    assert cpu.flags == FLAG_Z | FLAG_C
+
+
+def test_flags_setters_and_packed_flags(machine):
+    cpu = machine.cpu
+    cpu.flags = FLAG_N | FLAG_V
+    assert (cpu.flag_z, cpu.flag_n, cpu.flag_c, cpu.flag_v) == (
+        False,
+        True,
+        False,
+        True,
+    )
+
+    cpu.flag_c = True
+    assert cpu.flags == FLAG_N | FLAG_C | FLAG_V
+
+    # Z and N come from the same result
+    cpu.flag_z = True
+    assert cpu.flags == FLAG_Z | FLAG_C | FLAG_V
@@ -0,0 +1,97 @@
+import random
+
+import pytest
+
+from retro16sim import Machine, build_test_rom
+from retro16sim.assembler import asm_add, asm_addi, asm_halt, asm_jmp, asm_st
+from retro16sim.farm import run_farm
+from retro16sim.interrupts import TIMER_PERIOD
+from .test_helpers import prog_add_two_then_halt, random_program
+
+LANG_SRC = "x = 5; y = 0; while (x != 0) { x = x - 1; y = y + 2; }"
+
+
+def run_scalar(rom: bytes, steps: int) -> Machine:
+    m = Machine()
+    m.reset()
+    m.load_rom(rom)
+    m.run_n_steps(steps)
+    return m
+
+
+@pytest.mark.parametrize("max_workers", [0, 2])
+def test_farm_matches_machine(max_workers: int) -> None:
+    rng = random.Random(99)
+    roms = [build_test_rom(random_program(rng, 30)) for _ in range(20)]
+
+    results = list(
+        run_farm(roms, 200, mem=[(0xFFC0, 64)], max_workers=max_workers, chunk_size=3)
+    )
+
+    assert sorted(r.index for r in results) == list(range(len(roms)))
+    for r in results:
+        m = run_scalar(roms[r.index], 200)
+        assert r.regs == tuple(m.cpu.reg)
+        assert r.pc == m.cpu.pc
+        assert r.halted == m.cpu.halted
+        assert r.cycles == m.cycles
+        assert r.mem == (m.bus.read(0xFFC0, 64),)
+
+
+def test_farm_compiles_lang_source_and_reports_requested_regs() -> None:
+    jobs = [LANG_SRC, build_test_rom(prog_add_two_then_halt())]
+    results = sorted(
+        run_farm(jobs, 1000, regs=[2, 1], max_workers=0), key=lambda r: r.index
+    )
+
+    assert results[0].regs == (10, 0)
+    assert results[0].halted
+    assert results[1].regs == (0, 2)
+    assert results[1].mem == ()
+
+
+def test_farm_worker_state_does_not_leak_between_jobs() -> None:
+    # the first job leaves R1 and RAM dirty, the second only halts
+    store = build_test_rom([asm_addi(1, 0, 5), asm_st(1, 0, -2), asm_halt()])
+    halt = build_test_rom([asm_halt()])
+    results = sorted(
+        run_farm([store, halt], 100, mem=[(0xFF00, 256)], max_workers=0),
+        key=lambda r: r.index,
+    )
+
+    assert results[0].regs[1] == 5
+    assert results[0].mem[0][-2:] == b"\x05\x00"
+    assert results[1].regs == (0,) * 8
+    assert results[1].mem == (bytes(256),)
+    assert results[1].cycles == 0
+
+
+def set_reg(rd: int, value: int) -> list[int]:
+    # shift value into rd bit by bit
+    words = [asm_addi(rd, 0, 0)]
+    for bit in reversed(range(16)):
+        words.append(asm_add(rd, rd, rd))
+        if value >> bit & 1:
+            words.append(asm_addi(rd, rd, 1))
+    return words
+
+
+def test_farm_timer_does_not_leak_between_jobs() -> None:
+    # the first job starts the timer and halts, the second loops
+    timer = build_test_rom(
+        set_reg(1, TIMER_PERIOD) + set_reg(2, 100) + [asm_st(2, 1, 0), asm_halt()]
+    )
+    loop = build_test_rom([asm_addi(1, 1, 1), asm_jmp(-2)])
+    results = sorted(
+        run_farm([timer, loop, loop], 1000, max_workers=0), key=lambda r: r.index
+    )
+
+    assert results[0].halted
+    for r in results[1:]:
+        assert r.cycles == 1000
+        assert r.regs[1] == 500
+
+
+def test_farm_rejects_bad_memory_range() -> None:
+    with pytest.raises(ValueError):
+        list(run_farm([], 10, mem=[(0xFFF0, 32)]))
@@ -1,4 +1,37 @@
-from retro16sim.assembler import asm_addi, asm_cmpi, asm_jmp, asm_jz, asm_jnz, asm_halt
+import random
+
+from retro16sim import Machine, build_test_rom
+from retro16sim.assembler import (
+    asm_add,
+    asm_addi,
+    asm_cmp,
+    asm_cmpi,
+    asm_halt,
+    asm_jmp,
+    asm_jnz,
+    asm_jz,
+    asm_ld,
+    asm_st,
+    asm_sub,
+)
+from retro16sim.const import WORD_MASK
+from retro16sim.lang import (
+    Assign,
+    BinOp,
+    Cmp,
+    CmpZero,
+    Compiler,
+    Const,
+    Expr,
+    If,
+    Program,
+    Stmt,
+    Var,
+    While,
+)
+
+# variables random_stmts only assigns small constants (loop counts)
+SMALL_NAMES = ("s0", "s1")
 
 
 def prog_infinite_loop_r1_add():
@@ -25,3 +58,158 @@ def prog_countdown():
         asm_jnz(off_words=-4),  # 0008  JNZ -4
         asm_halt(),  # 000A  HALT
     ]
+
+
+def random_program(rng: random.Random, length: int) -> list[int]:
+    words = []
+    for i in range(length):
+        kind = rng.randrange(10)
+        rd, rs1, rs2 = (rng.randrange(1, 7) for _ in range(3))
+        imm = rng.randrange(-32, 32)
+        if kind == 0:
+            words.append(asm_add(rd, rs1, rs2))
+        elif kind == 1:
+            words.append(asm_sub(rd, rs1, rs2))
+        elif kind == 2:
+            words.append(asm_addi(rd, rs1, imm))
+        elif kind == 3:
+            words.append(asm_cmp(rs1, rs2))
+        elif kind == 4:
+            words.append(asm_cmpi(rs1, imm))
+        elif kind == 5:
+            # RAM at the top of memory (R0 + negative offset)
+            words.append(asm_st(rs1, 0, rng.randrange(-32, 0, 2)))
+        elif kind == 6:
+            words.append(asm_ld(rd, 0, rng.randrange(-32, 0, 2)))
+        else:
+            off = rng.randrange(-i - 1, length - i)
+            jump = (asm_jmp, asm_jz, asm_jnz)[kind - 7]
+            words.append(jump(off))
+    words.append(asm_halt())
+    return words
+
+
+def eval_expr(expr: Expr, env: dict[str, int]) -> int:
+    if isinstance(expr, Const):
+        return expr.value & WORD_MASK
+    if isinstance(expr, Var):
+        return env.get(expr.name, 0)
+    if isinstance(expr, BinOp):
+        a, b = eval_expr(expr.left, env), eval_expr(expr.right, env)
+        if expr.op == "+":
+            return (a + b) & WORD_MASK
+        if expr.op == "-":
+            return (a - b) & WORD_MASK
+        if expr.op == "*":
+            return (a * b) & WORD_MASK
+        return a // b if b else 0
+    if isinstance(expr, CmpZero):
+        eq = eval_expr(expr.expr, env) == 0
+        return int(eq if expr.op == "==" else not eq)
+    if isinstance(expr, Cmp):
+        eq = eval_expr(expr.left, env) == eval_expr(expr.right, env)
+        return int(eq if expr.op == "==" else not eq)
+    raise NotImplementedError(expr)
+
+
+def exec_stmts(stmts: list[Stmt], env: dict[str, int]) -> None:
+    for s in stmts:
+        if isinstance(s, Assign):
+            env[s.name] = eval_expr(s.expr, env)
+        elif isinstance(s, If):
+            if eval_expr(s.cond, env):
+                exec_stmts(s.then_body, env)
+            else:
+                exec_stmts(s.else_body or [], env)
+        elif isinstance(s, While):
+            while eval_expr(s.cond, env):
+                exec_stmts(s.body, env)
+
+
+def run_compiled(prog: Program, **kwargs) -> tuple[Compiler, Machine]:
+    c = Compiler(**kwargs)
+    words = c.compile_program(prog)
+    m = Machine()
+    m.reset()
+    m.load_rom(build_test_rom(words))
+    m.run_n_steps(100_000)
+    assert m.cpu.halted
+    return c, m
+
+
+def var_value(c: Compiler, m: Machine, name: str) -> int:
+    if name in c.var_regs:
+        return m.cpu.reg[c.var_regs[name]]
+    return m.bus.load16(m.cpu.reg[c.frame_reg] + c.var_slots[name])
+
+
+def random_stmts(rng: random.Random, names: list[str], depth: int) -> list[Stmt]:
+    def operand() -> Expr:
+        if rng.random() < 0.6:
+            return Var(rng.choice(names))
+        return Const(rng.randrange(-8, 8))
+
+    def arith(depth: int) -> Expr:
+        # "*" only by constants here (shift-and-add, no loop)
+        if depth == 0 or rng.random() < 0.3:
+            return operand()
+        op = rng.choice("+-*")
+        left, right = arith(depth - 1), arith(depth - 1)
+        if op == "*":
+            right = Const(rng.choice([-3, 2, 5, 10, 100]))
+        return BinOp(op, left, right)
+
+    def loop_op() -> Expr:
+        # the multiply and divide loops run as many times as the right
+        # operand of "*" and the left one of "/", so those stay small
+        small = Var(rng.choice(SMALL_NAMES))
+        if rng.random() < 0.5:
+            return BinOp("*", operand(), small)
+        return BinOp("/", rng.choice([small, Const(rng.randrange(40))]), operand())
+
+    def expr() -> Expr:
+        kind = rng.randrange(8)
+        if kind == 7:
+            return loop_op()
+        if kind == 0:
+            return Const(rng.randrange(-16, 16))
+        if kind == 1:
+            return Var(rng.choice(names))
+        if kind == 2:
+            return BinOp(rng.choice("+-"), Var(rng.choice(names)), Const(3))
+        if kind == 5:
+            return arith(3)
+        if kind == 6:
+            return Const(rng.randrange(-40000, 70000))
+        if kind == 3:
+            return CmpZero(expr=operand(), op=rng.choice(["==", "!="]))
+        return Cmp(operand(), op=rng.choice(["==", "!="]), right=operand())
+
+    stmts: list[Stmt] = []
+    for _ in range(rng.randrange(2, 6)):
+        kind = rng.randrange(6 if depth < 2 else 4)
+        if kind < 4:
+            if rng.random() < 0.15:
+                small = Const(rng.randrange(16))
+                stmts.append(Assign(rng.choice(SMALL_NAMES), small))
+            else:
+                stmts.append(Assign(rng.choice(names), expr()))
+        elif kind == 4:
+            else_body = (
+                random_stmts(rng, names, depth + 1) if rng.random() < 0.5 else None
+            )
+            stmts.append(
+                If(
+                    cond=rng.choice([expr(), Var(rng.choice(names))]),
+                    then_body=random_stmts(rng, names, depth + 1),
+                    else_body=else_body,
+                )
+            )
+        else:
+            # counted loop; the counter is not touched by the body
+            counter = f"n{depth}_{len(stmts)}"
+            stmts.append(Assign(counter, Const(rng.randrange(0, 4))))
+            body = random_stmts(rng, names, depth + 1)
+            body.append(Assign(counter, BinOp("-", Var(counter), Const(1))))
+            stmts.append(While(cond=CmpZero(expr=Var(counter), op="!="), body=body))
+    return stmts
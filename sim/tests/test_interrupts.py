@@ -0,0 +1,171 @@
+import pytest
+
+from retro16sim import Machine, build_test_rom
+from retro16sim.assembler import (
+    asm_add,
+    asm_addi,
+    asm_cmpi,
+    asm_halt,
+    asm_jmp,
+    asm_reti,
+    asm_st,
+    asm_wait,
+)
+from retro16sim.bus import Bus
+from retro16sim.const import FLAG_C, FLAG_N, FLAG_V, FLAG_Z, FRAME_CYCLES, VECTOR_BASE
+from retro16sim.cpu import CPU
+from retro16sim.interrupts import (
+    INT_ENABLE,
+    INT_FLAGS,
+    INT_MASTER,
+    IRQ_IO,
+    IRQ_TIMER,
+    IRQ_VBLANK,
+    TIMER_PERIOD,
+)
+
+HANDLER = 0x0100
+STACK = 0x7000
+
+
+def machine(engine: str, main: list[int], handler: list[int], enable: int) -> Machine:
+    m = Machine(engine=engine)
+    m.load_rom(build_test_rom(main))
+    m.load_rom(build_test_rom(handler), addr=HANDLER)
+    m.load_rom(build_test_rom([HANDLER] * 3), addr=VECTOR_BASE)
+    m.bus.store16(INT_ENABLE, enable)
+    m.cpu.sp = STACK
+    m.cpu.ime = True
+    return m
+
+
+def test_interrupt_entry_and_reti_restore_state() -> None:
+    bus = Bus()
+    cpu = CPU(bus)
+    bus.write(HANDLER, build_test_rom([asm_cmpi(rs=0, imm=1), asm_reti()]))
+    for flags in (FLAG_Z | FLAG_C, FLAG_N | FLAG_V, 0):
+        cpu.pc = 0x0042
+        cpu.flags = flags
+        cpu.sp = STACK
+        cpu.ime = True
+        cpu.interrupt(HANDLER)
+        assert (cpu.pc, cpu.sp, cpu.ime) == (HANDLER, STACK - 4, False)
+        assert bus.load16(STACK - 2) == 0x0042
+        assert bus.load16(STACK - 4) == flags
+
+        cpu.step()  # clobbers the flags
+        assert cpu.step() == 1
+        assert (cpu.pc, cpu.flags, cpu.sp, cpu.ime) == (0x0042, flags, STACK, True)
+
+
+@pytest.mark.parametrize("engine", ["interp", "block"])
+def test_vblank_handler_with_wait_loop(engine) -> None:
+    # main: WAIT forever; the handler counts frames in R1
+    m = machine(
+        engine,
+        [asm_wait(), asm_jmp(off_words=-2)],
+        [asm_addi(rd=1, rs=1, imm=1), asm_reti()],
+        1 << IRQ_VBLANK,
+    )
+    # idle time is skipped: 200 frames of mostly WAIT run in a few steps
+    for _ in range(200):
+        m.run_frame()
+    assert m.cpu.reg[1] == 199  # the last vblank is still pending
+    assert m.interrupts.delivered[IRQ_VBLANK] == 199
+    assert m.cycles == 200 * FRAME_CYCLES
+    assert m.cpu.waiting and m.cpu.sp == STACK
+
+
+@pytest.mark.parametrize("engine", ["interp", "block"])
+def test_timer_interrupts_and_masking(engine) -> None:
+    # main counts in R1, the handler in R2
+    m = machine(
+        engine,
+        [asm_addi(rd=1, rs=1, imm=1), asm_jmp(off_words=-2)],
+        [asm_addi(rd=2, rs=2, imm=1), asm_reti()],
+        1 << IRQ_TIMER,
+    )
+    m.bus.store16(TIMER_PERIOD, 100)
+    m.run_frame()
+    # ticks at 100, 200, ...; the one at the end of the frame is pending
+    assert m.cpu.reg[2] == FRAME_CYCLES // 100 - 1
+    assert 2 * (m.cpu.reg[1] + m.cpu.reg[2]) == FRAME_CYCLES  # 2 per loop
+    assert m.bus.load16(INT_FLAGS) == 1 << IRQ_TIMER | 1 << IRQ_VBLANK
+
+    # masked: requests are latched, not delivered
+    m.bus.store16(INT_MASTER, 0)
+    m.run_frame()
+    assert m.cpu.reg[2] == FRAME_CYCLES // 100 - 1
+    m.bus.store16(INT_MASTER, 1)
+    m.run_n_steps(3)
+    assert m.cpu.reg[2] == FRAME_CYCLES // 100
+
+    # the timer stops
+    m.bus.store16(TIMER_PERIOD, 0)
+    m.bus.store16(INT_FLAGS, 0xFFFF)  # acknowledge everything
+    m.run_frame()
+    assert m.cpu.reg[2] == FRAME_CYCLES // 100
+
+
+@pytest.mark.parametrize("engine, at", [("interp", 0), ("block", 3)])
+def test_store_enabling_interrupts_preempts_cpu(engine, at) -> None:
+    # the vblank is already pending; main sets INT_MASTER (R4) to R3
+    m = machine(
+        engine,
+        [asm_st(rs=3, base=4, off=0)] + [asm_addi(rd=5, rs=5, imm=1)] * 3,
+        [asm_add(rd=6, rs1=5, rs2=0), asm_reti()],
+        1 << IRQ_VBLANK,
+    )
+    m.load_rom(build_test_rom([asm_wait()]), addr=8)
+    m.cpu.ime = False
+    m.cpu.reg[3] = 1
+    m.cpu.reg[4] = INT_MASTER
+    m.interrupts.request(IRQ_VBLANK)
+
+    m.run_n_steps(20)
+    # taken after the store, or after its block
+    assert m.cpu.reg[6] == at
+    assert m.cpu.reg[5] == 3 and m.cpu.waiting
+    assert m.bus.load16(INT_MASTER) == 1
+
+
+def test_traced_run_takes_interrupts() -> None:
+    def run(trace: bool) -> Machine:
+        m = machine(
+            "interp",
+            [asm_addi(rd=1, rs=1, imm=1), asm_jmp(off_words=-2)],
+            [asm_addi(rd=2, rs=2, imm=1), asm_reti()],
+            1 << IRQ_TIMER,
+        )
+        m.bus.store16(TIMER_PERIOD, 7)
+        m.run_n_steps(120, trace=trace)
+        return m
+
+    plain, traced = run(False), run(True)
+    assert traced.cycles == plain.cycles == 120
+    assert traced.cpu.reg == plain.cpu.reg
+    assert traced.interrupts.delivered[IRQ_TIMER] == 120 // 7
+    assert len(traced.trace_buffer) == 120
+    assert HANDLER in {r.pc for r in traced.trace_buffer.records()}
+
+
+def test_wait_wakes_without_delivery_and_halt_stays() -> None:
+    m = machine(
+        "interp",
+        [asm_wait(), asm_addi(rd=1, rs=1, imm=1), asm_halt()],
+        [asm_addi(rd=2, rs=2, imm=1), asm_reti()],
+        1 << IRQ_IO,
+    )
+    m.cpu.ime = False
+    m.run_n_steps(500)
+    assert m.cpu.waiting and m.cpu.reg[1] == 0
+
+    m.interrupts.request(IRQ_IO)
+    m.run_n_steps(500)
+    assert m.cpu.halted and not m.cpu.waiting
+    assert m.cpu.reg[1] == 1 and m.cpu.reg[2] == 0
+    assert m.bus.load16(INT_FLAGS) == 1 << IRQ_IO
+
+    m.bus.store16(INT_MASTER, 1)
+    m.run_n_steps(500)
+    assert m.cpu.halted and m.cpu.reg[2] == 0
@@ -0,0 +1,204 @@
+import random
+
+import pytest
+
+from retro16sim.ir import build_ir, format_function, loop_blocks, lower_ir, verify
+from retro16sim.ir_passes import (
+    DEFAULT_PIPELINE,
+    PassManager,
+    common_subexpressions,
+    constant_folding,
+    copy_propagation,
+    dead_code_elimination,
+    loop_invariant_code_motion,
+)
+from retro16sim.lang import Assign, BinOp, Cmp, Compiler, Const, Program, Var, While
+from retro16sim.parser import parse_program
+
+from .test_helpers import exec_stmts, random_stmts, run_compiled, var_value
+
+
+def ops(fn) -> list[str]:
+    return [v.op for v in fn.values()]
+
+
+def test_build_ir_is_ssa() -> None:
+    src = """
+    x = 3; y = 0;
+    while (x != 0) {
+        if (x == 2) { y = y + x; } else { z = 1; }
+        x = x - 1;
+    }
+    """
+    fn = build_ir(parse_program(src))
+    verify(fn)
+
+    text = format_function(fn)
+    assert "phi" in text and "halt" in text
+    header = fn.loops()[0].header
+    assert sorted(phi.var for phi in header.phis) == ["x", "y", "z"]
+
+
+def test_copy_propagation_and_dce() -> None:
+    fn = build_ir(parse_program("a = 5; b = a; c = b + 1; d = c * 2;"), live_out=["c"])
+
+    assert copy_propagation(fn)
+    assert "copy" not in ops(fn)
+    assert dead_code_elimination(fn)
+    verify(fn)
+    assert fn.exit_values["c"].op == "+"
+    assert "*" not in ops(fn)
+    assert not dead_code_elimination(fn)
+
+
+def test_constant_folding() -> None:
+    src = parse_program("a = 5; b = a * 3 + 1;")
+    src.stmts.append(Assign("c", Cmp(Var("b"), op="==", right=Const(16))))
+    fn = build_ir(src)
+    copy_propagation(fn)
+
+    assert constant_folding(fn)
+    assert fn.exit_values["b"].const == 16
+    assert fn.exit_values["c"].const == 1
+
+
+def test_common_subexpressions() -> None:
+    fn = build_ir(
+        parse_program("x = a + b; if (x != 0) { y = b + a; } z = a + b;"),
+        live_out=["x", "y", "z"],
+    )
+    copy_propagation(fn)
+
+    assert common_subexpressions(fn)
+    verify(fn)
+    assert ops(fn).count("+") == 1
+    assert fn.exit_values["z"] is fn.exit_values["x"]
+
+
+def test_cse_does_not_merge_across_branches() -> None:
+    fn = build_ir(
+        parse_program("if (c != 0) { x = a * b; } else { y = a * b; }"),
+        live_out=["x", "y"],
+    )
+    copy_propagation(fn)
+    common_subexpressions(fn)
+    verify(fn)
+    assert ops(fn).count("*") == 2
+
+
+def test_loop_invariant_code_motion() -> None:
+    src = """
+    n = 4; k = 7;
+    while (n != 0) { t = k * 12; s = s + t; n = n - 1; }
+    """
+    fn = build_ir(parse_program(src))
+    copy_propagation(fn)
+    loop = fn.loops()[0]
+    (mul,) = [v for v in fn.values() if v.op == "*"]
+    assert mul.block in loop.body
+
+    assert loop_invariant_code_motion(fn)
+    verify(fn)
+    assert mul.block in loop.header.preds
+    assert mul.block is not loop.body[-1]
+
+
+@pytest.mark.parametrize(
+    "body, n",
+    [
+        ("if (d != 1) { q = k / d; s = s + q; } s = s + d * d;", 3),
+        ("q = k / d; s = s + q + d * d;", 0),
+    ],
+)
+def test_licm_does_not_speculate_loops(body: str, n: int) -> None:
+    # the division counts 60000 down and never runs: its If is false, or
+    # the loop runs zero times; d * d lowers to a loop as well. The setup
+    # loop keeps k and d from being constants
+    setup = "m = 1; while (m != 0) { k = 60000; d = 1; m = m - 1; }"
+    src = f"{setup} n = {n}; s = 0; while (n != 0) {{ {body} n = n - 1; }}"
+    fn = build_ir(parse_program(src))
+    PassManager(["copyprop", "licm"], check=True).run(fn)
+    inside = set(loop_blocks(fn.loops()[-1]))
+    assert all(v.block in inside for v in fn.values() if v.op in ("/", "*"))
+
+    c0, m0 = run_compiled(parse_program(src))
+    c1, m1 = run_compiled(parse_program(src), ir_passes=DEFAULT_PIPELINE)
+    assert m0.cycles < 1000 and m1.cycles < 1000
+    assert var_value(c1, m1, "s") == var_value(c0, m0, "s")
+
+
+def test_pass_manager() -> None:
+    with pytest.raises(ValueError):
+        PassManager(["nope"])
+
+    fn = build_ir(parse_program("a = 1; b = a + 2; c = b;"), live_out=["c"])
+    pm = PassManager(check=True)
+    pm.run(fn)
+    assert pm.stats["copyprop"] >= 1 and pm.stats["constfold"] >= 1
+    assert fn.exit_values["c"].const == 3
+    assert ops(fn) == ["const"]
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_random_programs_through_ir(seed: int) -> None:
+    rng = random.Random(seed)
+    names = [f"v{i}" for i in range(rng.randrange(2, 14))]
+    prog = Program(stmts=random_stmts(rng, names, 0))
+    env: dict[str, int] = {}
+    exec_stmts(prog.stmts, env)
+
+    fn = build_ir(prog)
+    PassManager(check=True).run(fn)
+    for pipeline in ((), DEFAULT_PIPELINE):
+        c, m = run_compiled(prog, ir_passes=pipeline)
+        for name, value in env.items():
+            assert var_value(c, m, name) == value, name
+
+    c, m = run_compiled(prog, ir_passes=DEFAULT_PIPELINE, live_out=names[:2])
+    for name in names[:2]:
+        if name in env:
+            assert var_value(c, m, name) == env[name], name
+
+
+def test_loop_swap_needs_parallel_copies() -> None:
+    src = """
+    a = 1; b = 2; n = 3;
+    while (n != 0) { t = a; a = b; b = t; n = n - 1; }
+    """
+    c, m = run_compiled(parse_program(src), ir_passes=DEFAULT_PIPELINE)
+    assert var_value(c, m, "a") == 2
+    assert var_value(c, m, "b") == 1
+
+
+def test_ir_pipeline_speeds_up_loops() -> None:
+    src = """
+    n = 20; s = 0; k = 7; a = 3;
+    while (n != 0) {
+        t = k * 12 + a;
+        s = s + t + k * 12;
+        if (s != 100) { u = a * k; s = s + u; }
+        n = n - 1;
+    }
+    """
+    c0, m0 = run_compiled(parse_program(src))
+    c1, m1 = run_compiled(parse_program(src), ir_passes=DEFAULT_PIPELINE)
+
+    for name in "nskatu":
+        assert var_value(c1, m1, name) == var_value(c0, m0, name)
+    assert m1.cycles < m0.cycles
+    assert c1.pass_stats["licm"] and c1.pass_stats["cse"]
+
+
+def test_lowered_statements_map_to_source() -> None:
+    inner = Assign("x", BinOp("-", Var("x"), Const(1)))
+    loop = While(cond=BinOp("+", Var("x"), Const(0)), body=[inner])
+    init = Assign("x", Const(3))
+    c = Compiler(ir_passes=DEFAULT_PIPELINE)
+    c.compile_program(Program(stmts=[init, loop]))
+
+    sources = {s for stack in c.line_table for s in map(id, stack)}
+    assert sources <= {id(init), id(loop), id(inner)}
+    assert any(stack[-1] is inner for stack in c.line_table if stack)
+
+    prog = lower_ir(build_ir(Program(stmts=[init, loop])))
+    assert sum(isinstance(s, While) for s in prog.stmts) == 1
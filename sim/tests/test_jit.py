@@ -0,0 +1,149 @@
+import random
+
+import pytest
+
+from retro16sim import Machine, build_test_rom
+from retro16sim.assembler import asm_addi, asm_halt, asm_ld, asm_st
+from retro16sim.parser import parse_program
+from retro16sim.lang import compile_program_to_rom
+from .test_helpers import (
+    prog_infinite_loop_r1_add,
+    prog_add_two_then_halt,
+    prog_countdown,
+    random_program,
+)
+
+
+def machine_state(m: Machine) -> tuple:
+    cpu = m.cpu
+    flags = (cpu.flag_z, cpu.flag_n, cpu.flag_c, cpu.flag_v)
+    return tuple(cpu.reg), cpu.pc, flags, cpu.halted, m.cycles
+
+
+def make_machines(rom_words: list[int], addr=0x0000) -> tuple[Machine, Machine]:
+    machines = (Machine(), Machine(engine="block"))
+    for m in machines:
+        m.reset()
+        m.load_rom(build_test_rom(rom_words), addr)
+        m.cpu.pc = addr
+    return machines
+
+
+LANG_SRC = """
+x = 20;
+y = 0;
+while (x != 0) {
+    x = x - 1;
+    if (x == 7) {
+        y = y + 3;
+    } else {
+        y = y - 1;
+    }
+}
+"""
+
+
+@pytest.mark.parametrize(
+    "rom_words",
+    [
+        prog_add_two_then_halt(),
+        prog_infinite_loop_r1_add(),
+        prog_countdown(),
+        compile_program_to_rom(parse_program(LANG_SRC)),
+    ],
+)
+@pytest.mark.parametrize("steps", [1, 2, 3, 7, 50, 1000])
+def test_block_engine_matches_interpreter(rom_words: list[int], steps: int) -> None:
+    interp, block = make_machines(rom_words)
+    interp.run_n_steps(steps)
+    block.run_n_steps(steps)
+    assert machine_state(block) == machine_state(interp)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_block_engine_matches_interpreter_random(seed: int) -> None:
+    rng = random.Random(seed)
+    interp, block = make_machines(random_program(rng, 40))
+    for _ in range(5):
+        n = rng.randrange(1, 200)
+        interp.run_n_steps(n)
+        block.run_n_steps(n)
+        assert machine_state(block) == machine_state(interp)
+
+
+def test_block_engine_run_frame_cycles() -> None:
+    interp, block = make_machines(prog_infinite_loop_r1_add())
+    for _ in range(3):
+        interp.run_frame()
+        block.run_frame()
+    assert block.cycles == interp.cycles == 30000
+    assert machine_state(block) == machine_state(interp)
+
+
+def test_block_engine_self_modifying_code() -> None:
+    rom_words = [
+        asm_ld(rd=2, base=3, off=0),  # 4000  LD R2, [R3]
+        asm_st(rs=2, base=4, off=0),  # 4002  ST R2, [R4]
+        asm_addi(rd=5, rs=5, imm=1),  # 4004  ADDI R5, R5, #1
+        asm_addi(rd=1, rs=1, imm=1),  # 4006  ADDI R1, R1, #1 (overwritten)
+        asm_halt(),  # 4008  HALT
+        asm_addi(rd=1, rs=1, imm=7),  # 400A  data: ADDI R1, R1, #7
+    ]
+    machines = make_machines(rom_words, 0x4000)
+    for m in machines:
+        m.cpu.reg[3] = 0x400A
+        m.cpu.reg[4] = 0x4006
+        m.run_n_steps(10)
+
+    interp, block = machines
+    assert interp.cpu.reg[1] == 7
+    assert machine_state(block) == machine_state(interp)
+
+
+WRAPAROUND_SRC = """
+x = 0;
+x = x - 1;
+y = 0;
+while (x != 0) {
+    x = x - 1;
+    if (y == 0) {
+        y = y + 1;
+    } else {
+        y = y - 1;
+    }
+}
+"""
+
+
+def test_hot_loop_is_traced() -> None:
+    rom_words = compile_program_to_rom(parse_program(WRAPAROUND_SRC))
+    interp, block = make_machines(rom_words)
+    for _ in range(5):
+        interp.run_frame()
+        block.run_frame()
+        assert machine_state(block) == machine_state(interp)
+
+    assert block.jit._traces
+
+
+def test_hot_loop_trace_runs_to_completion() -> None:
+    rom_words = compile_program_to_rom(parse_program(WRAPAROUND_SRC))
+    interp, block = make_machines(rom_words)
+    while not interp.cpu.halted:
+        interp.run_frame()
+    while not block.cpu.halted:
+        block.run_frame()
+
+    assert interp.cpu.reg[1] == 0
+    assert machine_state(block) == machine_state(interp)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_traces_match_interpreter_random(seed: int) -> None:
+    rng = random.Random(seed)
+    interp, block = make_machines(random_program(rng, 24))
+    for _ in range(5):
+        n = rng.randrange(1, 3000)
+        interp.run_n_steps(n)
+        block.run_n_steps(n)
+        assert machine_state(block) == machine_state(interp)
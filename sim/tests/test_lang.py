@@ -11,6 +11,7 @@ from retro16sim.lang import (
     Cmp,
     CmpZero,
     compile_program_to_rom,
+    Compiler,
 )
 from retro16sim import Machine, build_test_rom
 
@@ -184,3 +185,18 @@ def test_cmpzero_with_binop(machine: Machine) -> None:
 
     machine.run_n_steps(50, trace=False)
     assert machine.cpu.reg[1] == 1
+
+
+def test_compiler_line_table_maps_words_to_statements() -> None:
+    inner = Assign("x", BinOp("-", Var("x"), Const(1)))
+    loop = While(cond=CmpZero(expr=Var("x"), op="!="), body=[inner])
+    init = Assign("x", Const(3))
+    c = Compiler()
+    words = c.compile_program(Program(stmts=[init, loop]))
+
+    assert len(c.line_table) == len(words)
+    assert c.line_table[0] == (init,)
+    assert c.line_table[-1] == ()  # HALT
+    stacks = [s for s in c.line_table if s]
+    assert all(s[0] is init or s[0] is loop for s in stacks)
+    assert sum(1 for s in stacks if s == (loop, inner)) == 1
@@ -4,7 +4,7 @@ from .test_helpers import (
     prog_add_two_then_halt,
     prog_countdown,
 )
-from retro16sim import Machine
+from retro16sim import Machine, build_test_rom
 
 
 @pytest.mark.parametrize(
@@ -23,3 +23,53 @@ def test_r1_updates_as_expected(
 
     actual_r1 = m.cpu.reg[1]
     assert actual_r1 == expected_r1
+
+
+def test_build_test_rom_is_little_endian() -> None:
+    assert build_test_rom([0x1234, 0xABCD, -1]) == b"\x34\x12\xcd\xab\xff\xff"
+
+
+def test_load_rom_file_maps_rom(tmp_path) -> None:
+    path = tmp_path / "countdown.bin"
+    path.write_bytes(build_test_rom(prog_countdown()))
+
+    m = Machine()
+    m.reset()
+    m.load_rom_file(path)
+    m.run_n_steps(100)
+
+    assert m.cpu.halted
+    assert m.cpu.reg[1] == 0
+    assert m.bus.load16(0x0002) == prog_countdown()[1]
+    assert not any(m.bus.mem[:0x4000])  # served from the mapping, not copied
+
+
+def test_load_rom_after_load_rom_file(tmp_path) -> None:
+    path = tmp_path / "loop.bin"
+    path.write_bytes(build_test_rom(prog_infinite_loop_r1_add()))
+
+    m = Machine()
+    m.reset()
+    m.load_rom_file(path)
+    m.run_n_steps(4)
+    m.load_rom(build_test_rom(prog_add_two_then_halt()))
+    m.reset()
+    m.run_n_steps(10)
+
+    assert m.cpu.halted
+    assert m.cpu.reg[1] == 2
+
+
+def test_partial_write_keeps_rest_of_mapped_page(tmp_path) -> None:
+    path = tmp_path / "image.bin"
+    image = bytes(range(256)) * 2 + b"\x7f"
+    path.write_bytes(image)
+
+    m = Machine()
+    m.load_rom_file(path)
+    m.bus.write(0, b"\xaa\xbb")
+    m.bus.write(0x0201, b"\xcc")  # the image ends inside this page
+    assert m.bus.read(0, 4) == b"\xaa\xbb\x02\x03"
+    assert m.bus.load16(100) == image[100] | image[101] << 8
+    assert m.bus.read(0x0100, 256) == image[256:512]  # still mapped
+    assert m.bus.read(0x0200, 3) == b"\x7f\xcc\x00"
@@ -1,4 +1,14 @@
-from retro16sim.parser import parse_program
+import pytest
+
+from retro16sim.lang import BinOp, Cmp, CmpZero, Const, Var
+from retro16sim.parser import (
+    LexError,
+    Parser,
+    TokenArrays,
+    iter_tokens,
+    parse_program,
+    tokenize,
+)
 from retro16sim.lang import compile_program_to_rom
 from retro16sim import Machine, build_test_rom
 
@@ -89,3 +99,126 @@ def test_parse_if_else_else_taken(machine: Machine) -> None:
 
     machine.run_n_steps(100)
     assert machine.cpu.reg[1] == 10
+
+
+def test_parser_records_statement_spans() -> None:
+    src = "x = 3;\nwhile (x != 0) {\n  x = x - 1;\n}\n"
+    prog = parse_program(src)
+
+    assign, loop = prog.stmts
+    assert src[slice(*assign.span)] == "x = 3;"
+    assert src[slice(*loop.span)] == "while (x != 0) {\n  x = x - 1;\n}"
+    assert src[slice(*loop.body[0].span)] == "x = x - 1;"
+
+
+def test_tokenize_skips_whitespace_and_marks_keywords() -> None:
+    tokens = tokenize("while(x!=0){\n\tx = x-1;}")
+    assert [t.kind for t in tokens] == [
+        "WHILE",
+        "LPAREN",
+        "IDENT",
+        "NEQ",
+        "INT",
+        "RPAREN",
+        "LBRACE",
+        "IDENT",
+        "EQ",
+        "IDENT",
+        "MINUS",
+        "INT",
+        "SEMICOLON",
+        "RBRACE",
+        "EOF",
+    ]
+    assert tokens[7].value == "x" and tokens[7].pos == 14
+    assert tokens[-1].pos == 23
+
+
+def test_lex_error_reports_position() -> None:
+    src = "x = 1;\ny = x @ 2;"
+    with pytest.raises(LexError) as info:
+        tokenize(src)
+    assert info.value.pos == src.index("@")
+    assert "line 2, column 7" in str(info.value)
+
+    with pytest.raises(LexError):
+        TokenArrays(src)
+    with pytest.raises(LexError):
+        parse_program(src)
+
+
+def test_iter_tokens_is_lazy() -> None:
+    # the error is only reached once the tokens before it are consumed
+    tokens = iter_tokens("x = 1; $")
+    assert next(tokens).kind == "IDENT"
+
+
+def test_minus_without_spaces_is_subtraction() -> None:
+    (assign,) = parse_program("y = x-1;").stmts
+    assert assign.expr == BinOp("-", Var("x"), Const(1))
+
+
+def test_unary_minus() -> None:
+    a, b = parse_program("y = -5; z = -x;").stmts
+    assert a.expr == Const(-5)
+    assert b.expr == BinOp("-", Const(0), Var("x"))
+
+
+def test_token_arrays_match_tokenize() -> None:
+    src = "x = 3;\nif (x == 3) { y = x * 2 / 1; } else { y = 0; }\n"
+    arrays = TokenArrays(src)
+    assert list(arrays) == tokenize(src)
+    assert len(arrays) == len(tokenize(src))
+    assert arrays.kind(0) == "IDENT"
+
+    # a slice parses on its own, with spans in the original source
+    first = 4  # "if"
+    p = Parser(arrays.tokens(first, len(arrays) - 2))
+    stmt = p.parse_stmt()
+    assert p.cur().kind == "EOF"
+    assert src[slice(*stmt.span)].startswith("if (x == 3)")
+
+
+def test_precedence_and_associativity() -> None:
+    (assign,) = parse_program("y = a - b * 2 + c / d - 1;").stmts
+    x = BinOp("-", Var("a"), BinOp("*", Var("b"), Const(2)))
+    x = BinOp("+", x, BinOp("/", Var("c"), Var("d")))
+    assert assign.expr == BinOp("-", x, Const(1))
+
+    (assign,) = parse_program("y = (a - b) * (c - -2);").stmts
+    assert assign.expr == BinOp(
+        "*", BinOp("-", Var("a"), Var("b")), BinOp("-", Var("c"), Const(-2))
+    )
+
+
+def test_conditions() -> None:
+    loop, branch = parse_program(
+        "while ((x - 1 == y * 2)) { } if (x + 1 != 0) { }"
+    ).stmts
+    assert loop.cond == Cmp(
+        BinOp("-", Var("x"), Const(1)), "==", BinOp("*", Var("y"), Const(2))
+    )
+    assert branch.cond == CmpZero(BinOp("+", Var("x"), Const(1)), "!=")
+
+
+@pytest.mark.parametrize(
+    "src",
+    [
+        "y = a == b;",
+        "y = (a == b) + 1;",
+        "y = -(a == b);",
+        "while (x) { }",
+        "while (a == b == c) { }",
+        "while ((a == b) != 0) { }",
+        "y = a + ;",
+    ],
+)
+def test_rejected_expressions(src: str) -> None:
+    with pytest.raises(SyntaxError):
+        parse_program(src)
+
+
+def test_ast_nodes_have_no_instance_dict() -> None:
+    (assign,) = parse_program("y = x + 1;").stmts
+    for node in (assign, assign.expr, assign.expr.left, assign.expr.right):
+        assert not hasattr(node, "__dict__")
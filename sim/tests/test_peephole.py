@@ -0,0 +1,132 @@
+import random
+
+import pytest
+
+from retro16sim import Machine, build_test_rom
+from retro16sim.assembler import asm_add, asm_addi, asm_cmpi, asm_halt
+from retro16sim.isa import Op
+from retro16sim.lang import Compiler
+from retro16sim.parser import parse_program
+from retro16sim.peephole import Insn, optimize
+from retro16sim.lang import Assign, Cmp, CmpZero, Const, If, Program, Var
+from .test_helpers import random_stmts, run_compiled, var_value
+
+COUNTDOWN_SRC = "x = 30; y = 0; while (x != 0) { x = x - 1; y = y + 2; }"
+
+
+def compile_and_run(src: str, optimize: bool) -> tuple[Compiler, Machine]:
+    c = Compiler(optimize=optimize)
+    words = c.compile_program(parse_program(src))
+    m = Machine()
+    m.reset()
+    m.load_rom(build_test_rom(words))
+    m.run_n_steps(10000)
+    assert m.cpu.halted
+    return c, m
+
+
+def ops(words: list[int]) -> list[Op]:
+    return [Op(w >> 12) for w in words]
+
+
+def test_while_loop_becomes_direct_branch() -> None:
+    plain_c, plain = compile_and_run(COUNTDOWN_SRC, optimize=False)
+    c, m = compile_and_run(COUNTDOWN_SRC, optimize=True)
+
+    assert m.cpu.reg == plain.cpu.reg
+    # CMPI x, 0; JZ end; ADDI; ADDI; JMP head
+    assert ops(c.rom_words[2:7]) == [Op.CMPI, Op.JZ, Op.ADDI, Op.ADDI, Op.JMP]
+    assert m.cycles * 3 < plain.cycles * 2
+    assert len(c.line_table) == len(c.rom_words)
+
+
+def run_program(prog: Program, optimize: bool) -> Machine:
+    m = Machine()
+    m.reset()
+    m.load_rom(build_test_rom(Compiler(optimize=optimize).compile_program(prog)))
+    m.run_n_steps(10000)
+    assert m.cpu.halted
+    return m
+
+
+def test_if_else_and_comparison_values() -> None:
+    prog = Program(
+        stmts=[
+            Assign("x", Const(3)),
+            Assign("y", Const(3)),
+            Assign("z", Cmp(Var("x"), op="==", right=Var("y"))),
+            If(
+                cond=Cmp(Var("x"), op="!=", right=Var("y")),
+                then_body=[Assign("w", Const(1))],
+                else_body=[Assign("w", Const(2))],
+            ),
+            If(cond=Var("z"), then_body=[Assign("v", Const(7))]),
+        ]
+    )
+    plain = run_program(prog, optimize=False)
+    m = run_program(prog, optimize=True)
+    assert m.cpu.reg[1:6] == plain.cpu.reg[1:6] == [3, 3, 1, 2, 7]
+
+
+def test_materialized_value_kept_when_live() -> None:
+    # z is read later, so its 0/1 materialization must stay
+    prog = Program(
+        stmts=[
+            Assign("x", Const(1)),
+            Assign("z", CmpZero(expr=Var("x"), op="!=")),
+            If(cond=Var("z"), then_body=[Assign("x", Const(5))]),
+        ]
+    )
+    m = run_program(prog, optimize=True)
+    assert m.cpu.reg[1:3] == [5, 1]
+
+
+def test_addi_chain_and_self_move() -> None:
+    insns = [
+        Insn(Op.ADDI, asm_addi(rd=1, rs=0, imm=3)),
+        Insn(Op.ADDI, asm_addi(rd=1, rs=1, imm=4)),
+        Insn(Op.ADD, asm_add(rd=1, rs1=1, rs2=0)),
+        Insn(Op.HALT, asm_halt()),
+    ]
+    out = optimize(insns, exit_live=1 << 1)
+    assert [i.word for i in out] == [asm_addi(rd=1, rs=0, imm=7), asm_halt()]
+
+
+def test_redundant_cmpi_after_alu_and_jump_threading() -> None:
+    insns = [
+        Insn(Op.ADDI, asm_addi(rd=1, rs=1, imm=-1), labels=["top"]),
+        Insn(Op.CMPI, asm_cmpi(rs=1, imm=0)),
+        Insn(Op.JNZ, 0, target="hop"),
+        Insn(Op.HALT, asm_halt()),
+        Insn(Op.JMP, 0, target="top", labels=["hop"]),
+        Insn(Op.HALT, asm_halt()),
+    ]
+    out = optimize(insns, exit_live=1 << 1)
+
+    assert [i.op for i in out] == [Op.ADDI, Op.JNZ, Op.HALT, Op.HALT]
+    assert out[1].target == "top"
+
+
+def test_dead_temporaries_are_removed() -> None:
+    c = Compiler(live_out=["y"])
+    c.compile_program(parse_program("x = 5; y = 2; x = x + 1;"))
+    assert len(c.rom_words) == 2  # ADDI y, R0, 2; HALT
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_programs_unchanged_by_optimizer(seed: int) -> None:
+    rng = random.Random(seed + 1000)
+    names = [f"v{i}" for i in range(rng.randrange(2, 10))]
+    prog = Program(stmts=random_stmts(rng, names, 0))
+
+    results = []
+    for opt in (False, True):
+        c, m = run_compiled(prog, optimize=opt)
+        results.append(
+            {
+                name: var_value(c, m, name)
+                for name in names
+                if name in c.var_regs or name in c.var_slots
+            }
+        )
+    assert results[0] == results[1]
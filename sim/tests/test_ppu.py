@@ -0,0 +1,210 @@
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from retro16sim import Machine, build_test_rom
+from retro16sim.assembler import asm_halt
+from retro16sim.ppu import (
+    ATTR_HFLIP,
+    ATTR_VFLIP,
+    CTRL_BG,
+    CTRL_SPRITES,
+    OAM,
+    PALETTES,
+    PPU,
+    PPU_CTRL,
+    PPU_SCX,
+    PPU_SCY,
+    SCREEN_H,
+    SCREEN_W,
+    TILE_ATTR,
+    TILE_BYTES,
+    TILE_DATA,
+    TILE_MAP,
+)
+from retro16sim.bus import Bus
+
+
+def set_color(bus: Bus, palette: int, color: int, rgb555: int) -> None:
+    bus.store16(PALETTES + 2 * (palette * 16 + color), rgb555)
+
+
+def set_tile(bus: Bus, tile: int, rows: list[list[int]]) -> None:
+    data = bytearray()
+    for row in rows:
+        for left, right in zip(row[0::2], row[1::2]):
+            data.append((left << 4) | right)
+    bus.write(TILE_DATA + tile * TILE_BYTES, data)
+
+
+def solid(color: int) -> list[list[int]]:
+    return [[color] * 8 for _ in range(8)]
+
+
+def test_background_tiles_palettes_and_scroll() -> None:
+    bus = Bus()
+    ppu = PPU(bus)
+    set_tile(bus, 1, solid(3))
+    set_color(bus, 0, 0, 0x0000)
+    set_color(bus, 2, 3, 0x001F)  # red
+    bus.store8(TILE_MAP + 1, 1)  # map (0, 1)
+    bus.store8(TILE_ATTR + 1, 2)
+    bus.store16(PPU_CTRL, CTRL_BG)
+
+    fb = ppu.render()
+    assert fb.shape == (SCREEN_H, SCREEN_W, 3) and fb.dtype == np.uint8
+    assert (fb[0:8, 8:16] == [255, 0, 0]).all()
+    assert (fb[0:8, 0:8] == 0).all() and (fb[8:, :] == 0).all()
+    assert ppu.index[0, 8] == 2 * 16 + 3
+
+    # scrolling wraps around the 256-pixel map
+    bus.store16(PPU_SCX, 256 - 4)
+    bus.store16(PPU_SCY, 3)
+    ppu.render()
+    assert (ppu.index[0:5, 12:20] == 35).all()
+    assert ppu.index[5, 12] == 0 and ppu.index[0, 11] == 0
+
+    # the same array is reused
+    assert ppu.render() is fb
+
+
+def test_tile_pixels_and_flips() -> None:
+    bus = Bus()
+    ppu = PPU(bus)
+    rows = [[(x + y) % 16 for x in range(8)] for y in range(8)]
+    rows[0][0] = 15
+    set_tile(bus, 0, rows)
+    bus.store16(PPU_CTRL, CTRL_BG)
+
+    bus.store8(TILE_ATTR + 1, ATTR_HFLIP)
+    bus.store8(TILE_ATTR + 2, ATTR_VFLIP)
+    bus.store8(TILE_ATTR + 3, ATTR_HFLIP | ATTR_VFLIP)
+    ppu.render()
+    tile = np.array(rows)
+    assert (ppu.index[0:8, 0:8] == tile).all()
+    assert (ppu.index[0:8, 8:16] == tile[:, ::-1]).all()
+    assert (ppu.index[0:8, 16:24] == tile[::-1, :]).all()
+    assert (ppu.index[0:8, 24:32] == tile[::-1, ::-1]).all()
+
+
+def test_sprites_overlap_clip_and_transparency() -> None:
+    bus = Bus()
+    ppu = PPU(bus)
+    ring = solid(5)
+    ring[3][3] = 0  # transparent hole
+    set_tile(bus, 7, ring)
+    set_tile(bus, 8, solid(6))
+    bus.store16(PPU_CTRL, CTRL_BG | CTRL_SPRITES)
+
+    def sprite(i: int, y: int, x: int, tile: int, attr: int) -> None:
+        bus.write(OAM + 4 * i, bytes([y, x, tile, attr]))
+
+    # all entries start at (0, 0): fully off screen
+    sprite(0, 8 + 10, 8 + 20, 7, 1)
+    sprite(1, 8 + 12, 8 + 22, 8, 0)  # under sprite 0
+    sprite(2, 4, 8 + SCREEN_W - 4, 8, 2)  # clipped at the top right
+
+    ppu.render()
+    index = ppu.index
+    assert index[10, 20] == (4 + 1) * 16 + 5
+    assert index[13, 23] == 4 * 16 + 6  # through the hole in sprite 0
+    assert index[12, 22] == (4 + 1) * 16 + 5
+    assert index[19, 29] == 4 * 16 + 6
+    assert index[20, 20] == 0
+
+    assert (index[0:4, SCREEN_W - 4 :] == (4 + 2) * 16 + 6).all()
+    assert index[4, SCREEN_W - 1] == 0
+    assert (index[:, : SCREEN_W - 4][index[:, : SCREEN_W - 4] >= 96] == 0).all()
+
+    # sprites off
+    bus.store16(PPU_CTRL, CTRL_BG)
+    ppu.render()
+    assert not ppu.index.any()
+
+
+def test_machine_renders_every_frame(tmp_path) -> None:
+    m = Machine()
+    m.load_rom(build_test_rom([asm_halt()]))
+    set_color(m.bus, 0, 0, 0x7FFF)
+    m.run_frame()
+    m.run_frame()
+    assert m.ppu.frame == 2
+    assert (m.ppu.framebuffer == 255).all()
+
+    path = tmp_path / "frame.ppm"
+    m.ppu.write_ppm(path)
+    data = path.read_bytes()
+    assert data.startswith(b"P6 160 144 255\n")
+    assert len(data) == len(b"P6 160 144 255\n") + SCREEN_W * SCREEN_H * 3
+
+
+def test_only_changed_regions_are_redrawn() -> None:
+    bus = Bus()
+    ppu = PPU(bus)
+    set_tile(bus, 1, solid(2))
+    set_color(bus, 0, 2, 0x03E0)  # green
+    set_color(bus, 4, 6, 0x7C00)  # blue
+    set_tile(bus, 2, solid(6))
+    bus.store16(PPU_CTRL, CTRL_BG | CTRL_SPRITES)
+    ppu.render()
+    assert ppu.redrawn == SCREEN_W * SCREEN_H
+
+    ppu.render()
+    assert ppu.redrawn == 0
+
+    # a tile nobody shows
+    set_tile(bus, 9, solid(1))
+    ppu.render()
+    assert ppu.redrawn == 0
+
+    # one map row
+    bus.store8(TILE_MAP + 2 * 32 + 3, 1)
+    ppu.render()
+    assert ppu.redrawn == 8 * SCREEN_W
+    assert (ppu.framebuffer[16:24, 24:32] == [0, 255, 0]).all()
+
+    # a moving sprite: old and new place
+    bus.write(OAM, bytes([8 + 50, 8 + 50, 2, 0]))
+    ppu.render()
+    assert ppu.redrawn == 64
+    bus.store8(OAM + 1, 8 + 52)
+    ppu.render()
+    assert ppu.redrawn == 8 * 10
+    assert (ppu.framebuffer[50:58, 52:60] == [0, 0, 255]).all()
+    assert (ppu.framebuffer[50:58, 50:52] == 0).all()
+
+    # a sprite whose tile changes
+    set_tile(bus, 2, solid(0))
+    ppu.render()
+    assert ppu.redrawn == 64
+    assert not ppu.framebuffer[50:58, 52:60].any()
+
+    # a palette converts the screen again; a register redraws it
+    set_color(bus, 0, 2, 0x001F)
+    ppu.render()
+    assert (ppu.framebuffer[16:24, 24:32] == [255, 0, 0]).all()
+    bus.store16(PPU_SCY, 1)
+    ppu.render()
+    assert ppu.redrawn == SCREEN_W * SCREEN_H
+
+
+def test_incremental_frames_match_full_renders() -> None:
+    rng = random.Random(1)
+    bus = Bus()
+    ppu = PPU(bus)
+    bus.write(TILE_DATA, bytes(rng.randrange(256) for _ in range(0x2C00)))
+    bus.store16(PPU_CTRL, CTRL_BG | CTRL_SPRITES)
+    for _ in range(40):
+        for _ in range(rng.choice([0, 1, 4])):
+            addr = rng.randrange(TILE_DATA, PALETTES + 256)
+            bus.store8(addr, rng.randrange(256))
+        if rng.random() < 0.1:
+            bus.store16(PPU_SCX, rng.randrange(256))
+        ppu.render()
+
+        fresh = Bus()
+        fresh.write(0, bytes(bus.mem))
+        expected = PPU(fresh).render()
+        assert (ppu.framebuffer == expected).all()
@@ -0,0 +1,93 @@
+from retro16sim import Machine, build_test_rom
+from retro16sim.isa import Op
+from retro16sim.profiler import Profiler
+from .test_helpers import prog_countdown
+
+
+def profiled_countdown(machine: Machine) -> Profiler:
+    machine.load_rom(build_test_rom(prog_countdown()))
+    machine.profiler = Profiler()
+    machine.run_n_steps(100)
+    return machine.profiler
+
+
+def test_counts_per_pc_and_op(machine: Machine) -> None:
+    prof = profiled_countdown(machine)
+
+    assert machine.cpu.halted
+    assert machine.cpu.reg[1] == 0
+    assert [prof.pc_counts[pc] for pc in range(0, 12, 2)] == [1, 3, 3, 3, 3, 1]
+    assert prof.op_counts[Op.ADDI] == 4
+    assert prof.op_counts[Op.HALT] == 1
+    assert prof.total_cycles == machine.cycles == 13
+
+
+def test_branch_outcomes(machine: Machine) -> None:
+    prof = profiled_countdown(machine)
+
+    assert prof.branches[0x0004] == [0, 3]  # JZ never taken
+    assert prof.branches[0x0008] == [2, 1]  # JNZ loops twice
+
+
+def test_cycles_per_basic_block(machine: Machine) -> None:
+    prof = profiled_countdown(machine)
+
+    assert prof.block_cycles == {0x0000: 3, 0x0002: 4, 0x0006: 6, 0x000A: 0}
+    assert prof.block_counts == {0x0000: 1, 0x0002: 2, 0x0006: 3, 0x000A: 1}
+
+
+def test_flat_profile_and_collapsed_stacks(machine: Machine, tmp_path) -> None:
+    prof = profiled_countdown(machine)
+
+    rows = prof.flat_profile()
+    assert rows[0].cycles == 3
+    assert rows[-1].op == "HALT"
+    assert "CMPI" in prof.format_flat(limit=3)
+
+    path = tmp_path / "countdown.folded"
+    prof.write_collapsed(path)
+    lines = path.read_text().splitlines()
+    assert "block_0006;JNZ@0008 3" in lines
+    # CMPI runs inside the first block, later at the start of its own
+    assert "block_0000;CMPI@0002 1" in lines
+    assert "block_0002;CMPI@0002 2" in lines
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == 13
+
+
+def test_profiler_takes_over_block_engine() -> None:
+    m = Machine(engine="block")
+    m.reset()
+    m.load_rom(build_test_rom(prog_countdown()))
+    m.profiler = Profiler()
+    m.run_frame()
+
+    assert m.cpu.halted
+    assert m.profiler.pc_counts[0x0006] == 3
+
+
+def test_source_profile_attributes_cycles_to_statements(
+    machine: Machine, capsys
+) -> None:
+    src = "x = 20;\ny = 0;\nwhile (x != 0) {\n  x = x - 1;\n  y = y + 2;\n}\n"
+    rows = machine.run_source_profile(src)
+
+    assert machine.cpu.reg[2] == 40
+    assert machine.profiler is None
+    by_text = {src[slice(*r.stmt.span)].split("{")[0].strip(): r for r in rows}
+    loop = by_text["while (x != 0)"]
+    dec = by_text["x = x - 1;"]
+    assert dec.count == 20 and dec.self_cycles == 20
+    assert loop.total_cycles == machine.cycles - 2
+    assert loop.self_cycles == loop.total_cycles - 40
+    assert rows[0] is loop
+
+    out = capsys.readouterr().out
+    assert "3:1" in out and "while (x != 0)" in out
+
+    # a second profile starts over instead of from the halted machine
+    cycles = machine.cycles
+    again = machine.run_source_profile(src)
+    assert machine.cycles == cycles
+    assert [(r.count, r.self_cycles, r.total_cycles) for r in again] == [
+        (r.count, r.self_cycles, r.total_cycles) for r in rows
+    ]
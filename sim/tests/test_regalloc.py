@@ -0,0 +1,181 @@
+import random
+
+import pytest
+
+from retro16sim import Machine, build_test_rom
+from retro16sim.assembler import asm_reti
+from retro16sim.const import IMM6_MAX, SP, VECTOR_BASE
+from retro16sim.interrupts import INT_ENABLE, IRQ_TIMER, TIMER_PERIOD
+from retro16sim.lang import (
+    Assign,
+    BinOp,
+    Cmp,
+    CmpZero,
+    Compiler,
+    Const,
+    If,
+    Program,
+    Stmt,
+    Var,
+    While,
+)
+from retro16sim.regalloc import ALLOC_REGS, SP_FRAME_SLOTS
+
+from .test_helpers import exec_stmts, random_stmts, run_compiled, var_value
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_random_programs_match_reference(seed: int) -> None:
+    rng = random.Random(seed)
+    names = [f"v{i}" for i in range(rng.randrange(2, 14))]
+    prog = Program(stmts=random_stmts(rng, names, 0))
+
+    env: dict[str, int] = {}
+    exec_stmts(prog.stmts, env)
+    c, m = run_compiled(prog)
+
+    for name, value in env.items():
+        assert var_value(c, m, name) == value, name
+
+    # only the first two matter; the rest may share registers
+    c, m = run_compiled(prog, live_out=names[:2])
+    for name in names[:2]:
+        if name in env:
+            assert var_value(c, m, name) == env[name], name
+
+
+def test_first_variables_get_r1_r2_r3() -> None:
+    prog = Program(
+        stmts=[
+            Assign("x", Const(1)),
+            If(cond=Cmp(Var("x"), op="==", right=Const(1)), then_body=[]),
+            Assign("y", Const(2)),
+            Assign("z", CmpZero(expr=Var("y"), op="!=")),
+        ]
+    )
+    c, m = run_compiled(prog)
+
+    assert c.var_regs == {"x": 1, "y": 2, "z": 3}
+    assert m.cpu.reg[1:4] == [1, 2, 1]
+
+
+def test_many_variables_spill_to_stack_frame() -> None:
+    names = [f"v{i}" for i in range(10)]
+    stmts: list[Stmt] = [Assign(n, Const(i + 1)) for i, n in enumerate(names)]
+    stmts += [Assign(n, BinOp("+", Var(n), Const(1))) for n in names]
+    c, m = run_compiled(Program(stmts=stmts))
+
+    assert len(c.var_regs) == len(ALLOC_REGS) - 1  # one left for temporaries
+    assert c.var_slots
+    assert SP not in c.var_regs.values()
+    for i, n in enumerate(names):
+        assert var_value(c, m, n) == i + 2
+
+
+def test_spilled_variable_read_before_write_is_zero() -> None:
+    names = [f"v{i}" for i in range(8)]
+    stmts: list[Stmt] = [
+        Assign(n, BinOp("+", Var(n), Const(i))) for i, n in enumerate(names)
+    ]
+    c, m = run_compiled(Program(stmts=stmts))
+
+    assert c.var_slots
+    assert [var_value(c, m, n) for n in names] == list(range(8))
+
+
+def test_dead_variables_share_registers() -> None:
+    # each t_i is dead after it is copied into acc_i
+    stmts: list[Stmt] = []
+    for i in range(8):
+        stmts.append(Assign(f"t{i}", Const(i)))
+        stmts.append(Assign("acc", Cmp(Var("acc"), op="!=", right=Var(f"t{i}"))))
+    c, m = run_compiled(Program(stmts=stmts), live_out=["acc"])
+
+    assert not c.var_slots
+    assert len(set(c.var_regs.values())) <= 3
+    assert var_value(c, m, "acc") == 1
+
+
+def test_temporaries_are_reused() -> None:
+    # 5 variables plus many comparisons used to run past SP
+    names = ["a", "b", "c", "d", "e"]
+    stmts: list[Stmt] = [Assign(n, Const(i)) for i, n in enumerate(names)]
+    for _ in range(6):
+        stmts.append(
+            If(
+                cond=Cmp(Const(1), op="==", right=Const(1)),
+                then_body=[Assign("a", BinOp("+", Var("a"), Const(1)))],
+            )
+        )
+    c, m = run_compiled(Program(stmts=stmts))
+
+    assert not c.var_slots
+    assert m.cpu.reg[SP] == 0
+    assert var_value(c, m, "a") == 6
+
+
+def spill_program(n: int) -> Program:
+    # n variables live at once, each incremented
+    names = [f"v{i}" for i in range(n)]
+    stmts: list[Stmt] = [Assign(n, Const(i + 1)) for i, n in enumerate(names)]
+    stmts += [Assign(n, BinOp("+", Var(n), Const(1))) for n in names]
+    return Program(stmts=stmts)
+
+
+def run_with_timer_interrupts(words: list[int]) -> Machine:
+    # the handler only returns; every entry pushes PC and flags below SP
+    m = Machine()
+    m.load_rom(build_test_rom(words))
+    m.load_rom(build_test_rom([asm_reti()]), addr=0x3000)
+    m.load_rom(build_test_rom([0x3000] * 3), addr=VECTOR_BASE)
+    m.bus.store16(INT_ENABLE, 1 << IRQ_TIMER)
+    m.bus.store16(TIMER_PERIOD, 3)
+    m.cpu.ime = True
+    m.run_n_steps(100_000)
+    assert m.cpu.halted and m.interrupts.delivered[IRQ_TIMER] > 10
+    return m
+
+
+@pytest.mark.parametrize("n", [21, 24, 30, 48, 120])
+def test_spill_slots_stay_above_sp_under_interrupts(n: int) -> None:
+    # 21: 16 slots from SP; more: the frame is addressed from a register,
+    # from 30 on some slots are past the LD/ST offset reach
+    c = Compiler()
+    words = c.compile_program(spill_program(n))
+    if n == 21:
+        assert c.frame_reg == SP
+        assert len(set(c.var_slots.values())) == SP_FRAME_SLOTS
+    else:
+        assert c.frame_reg in ALLOC_REGS
+        assert c.frame_reg not in c.var_regs.values()
+        assert len(set(c.var_slots.values())) > SP_FRAME_SLOTS
+
+    m = run_with_timer_interrupts(words)
+    sp = m.cpu.reg[SP]
+    for i in range(n):
+        name = f"v{i}"
+        if name in c.var_slots:
+            assert m.cpu.reg[c.frame_reg] + c.var_slots[name] >= sp
+        assert var_value(c, m, name) == i + 2
+
+
+def test_large_frame_keeps_loop_variables_near() -> None:
+    # 50 variables live across a loop; the loop's are within direct reach
+    prog = spill_program(50)
+    loop = While(
+        cond=Var("v49"),
+        body=[
+            Assign("v48", BinOp("+", Var("v48"), Var("v47"))),
+            Assign("v49", BinOp("-", Var("v49"), Const(1))),
+        ],
+    )
+    prog.stmts.append(loop)
+    c, m = run_compiled(prog)
+
+    assert max(c.var_slots.values()) > IMM6_MAX
+    for name in ("v47", "v48", "v49"):
+        assert c.var_slots.get(name, 0) <= IMM6_MAX
+    assert var_value(c, m, "v49") == 0
+    assert var_value(c, m, "v48") == 50 + 51 * 49
+    for i in range(47):
+        assert var_value(c, m, f"v{i}") == i + 2
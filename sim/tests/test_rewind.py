@@ -0,0 +1,121 @@
+import pytest
+
+from retro16sim import Machine, build_test_rom
+from retro16sim.assembler import asm_addi, asm_jmp, asm_reti, asm_st
+from retro16sim.const import MEM_SIZE, VECTOR_BASE
+from retro16sim.interrupts import INT_ENABLE, IRQ_TIMER, TIMER_PERIOD
+from retro16sim.rewind import RewindBuffer
+
+
+def counter_machine() -> Machine:
+    m = Machine()
+    m.reset()
+    # R1 counts up and is stored to 0xFFFE, R2 counts down to 0xFF80
+    m.load_rom(
+        build_test_rom(
+            [
+                asm_addi(1, 1, 1),
+                asm_st(1, 0, -2),
+                asm_addi(2, 2, -1),
+                asm_st(2, 0, -32),
+                asm_jmp(-5),
+            ]
+        )
+    )
+    return m
+
+
+def machine_state(m: Machine) -> tuple:
+    cpu = m.cpu
+    return (tuple(cpu.reg), cpu.pc, cpu.flags, cpu.halted, m.cycles, bytes(m.bus.mem))
+
+
+def record_frames(buf: RewindBuffer, n: int) -> list[tuple]:
+    states = [machine_state(buf.machine)]
+    for i in range(n):
+        buf.machine.run_n_steps(7 + i % 3)
+        buf.record()
+        states.append(machine_state(buf.machine))
+    return states
+
+
+@pytest.mark.parametrize("n_frames", [0, 1, 3, 4, 9, 20])
+def test_rewind_restores_earlier_frame(n_frames: int) -> None:
+    buf = RewindBuffer(counter_machine(), keyframe_interval=4)
+    states = record_frames(buf, 20)
+
+    buf.rewind(n_frames)
+    assert machine_state(buf.machine) == states[-1 - n_frames]
+    assert len(buf) == len(states) - n_frames
+
+
+def test_rewind_then_record_continues_history() -> None:
+    buf = RewindBuffer(counter_machine(), keyframe_interval=5)
+    states = record_frames(buf, 12)
+    buf.rewind(6)
+    states = states[:-6] + record_frames(buf, 8)[1:]
+
+    for n in range(len(states)):
+        buf.rewind(0 if n == 0 else 1)
+        assert machine_state(buf.machine) == states[-1 - n]
+
+
+def test_deltas_are_small() -> None:
+    buf = RewindBuffer(counter_machine(), keyframe_interval=100)
+    start = buf.size_bytes
+    record_frames(buf, 10)
+    assert buf.size_bytes - start < 10 * 200
+
+
+def test_eviction_drops_oldest_keyframes() -> None:
+    buf = RewindBuffer(counter_machine(), keyframe_interval=4, max_bytes=3 * MEM_SIZE)
+    states = record_frames(buf, 30)
+
+    assert buf.size_bytes <= 3 * MEM_SIZE
+    kept = len(buf)
+    assert kept < len(states)
+    buf.rewind(kept - 1)
+    assert machine_state(buf.machine) == states[-kept]
+    with pytest.raises(ValueError):
+        buf.rewind(1)
+
+
+def timer_machine() -> Machine:
+    # main counts in R1, the timer handler in R2
+    m = Machine()
+    m.load_rom(build_test_rom([asm_addi(1, 1, 1), asm_jmp(-2)]))
+    m.load_rom(build_test_rom([asm_addi(2, 2, 1), asm_reti()]), addr=0x0100)
+    m.load_rom(build_test_rom([0x0100] * 3), addr=VECTOR_BASE)
+    m.cpu.sp = 0x7000
+    m.cpu.ime = True
+    m.bus.store16(INT_ENABLE, 1 << IRQ_TIMER)
+    m.bus.store16(TIMER_PERIOD, 7)  # preempts the CPU
+    return m
+
+
+def test_rewind_with_timer_interrupts() -> None:
+    m = timer_machine()
+    buf = RewindBuffer(m, keyframe_interval=2)
+    m.run_n_steps(20)
+    buf.record()
+    for _ in range(3):
+        m.run_n_steps(100)
+        buf.record()
+
+    buf.rewind(3)
+    assert m.cycles == 20 and not m.cpu.halted and m.cpu.ime
+    m.run_n_steps(100)
+
+    expected = timer_machine()
+    expected.run_n_steps(20)
+    expected.run_n_steps(100)
+    assert machine_state(m) == machine_state(expected)
+    assert m.cpu.reg[2] == 120 // 7
+
+    # straight from a snapshot taken while the CPU was preempted
+    m = timer_machine()
+    snap = m.snapshot()
+    m.run_n_steps(50)
+    m.restore(snap)
+    m.run_n_steps(120)
+    assert m.cycles == 120 and machine_state(m) == machine_state(expected)
@@ -0,0 +1,89 @@
+import pytest
+
+from retro16sim import Machine, build_test_rom
+from retro16sim.assembler import asm_addi, asm_halt, asm_jmp
+from retro16sim.const import FRAME_CYCLES
+from retro16sim.scheduler import Scheduler
+
+
+def test_events_run_in_cycle_order() -> None:
+    s = Scheduler(lambda: 100)
+    fired: list[tuple[str, int]] = []
+    s.at(30, lambda c: fired.append(("b", c)))
+    s.at(10, lambda c: fired.append(("a", c)))
+    s.at(30, lambda c: fired.append(("c", c)))  # same cycle: in order
+    late = s.after(5, lambda c: fired.append(("late", c)))
+    assert s.next_deadline() == 10 and len(s) == 4
+
+    s.run_due(29)
+    assert fired == [("a", 10)]
+    s.run_due(30)
+    assert fired == [("a", 10), ("b", 30), ("c", 30)]
+
+    s.cancel(late)
+    assert s.next_deadline() is None and len(s) == 0
+    s.run_due(1000)
+    assert len(fired) == 3
+
+
+def test_periodic_event_reschedules_itself() -> None:
+    s = Scheduler(lambda: 0)
+    ticks: list[int] = []
+
+    def tick(cycle: int) -> None:
+        ticks.append(cycle)
+        s.at(cycle + 7, tick)
+
+    s.at(7, tick)
+    s.run_due(30)
+    assert ticks == [7, 14, 21, 28]
+    assert s.next_deadline() == 35
+
+
+def counting_rom() -> bytes:
+    # R1 counts executed instructions
+    return build_test_rom([asm_addi(rd=1, rs=1, imm=1), asm_jmp(off_words=-2)])
+
+
+@pytest.mark.parametrize("engine", ["interp", "block"])
+def test_cpu_stops_exactly_at_deadlines(engine) -> None:
+    m = Machine(engine=engine)
+    m.load_rom(counting_rom())
+    seen: list[tuple[int, int, int]] = []
+
+    def probe(cycle: int) -> None:
+        seen.append((cycle, m.cycles, m.cpu.reg[1]))
+
+    for cycle in (1, 50, 51, 333, FRAME_CYCLES - 1):
+        m.scheduler.at(cycle, probe)
+    m.run_frame()
+
+    assert [c for c, _, _ in seen] == [1, 50, 51, 333, FRAME_CYCLES - 1]
+    for cycle, now, _ in seen:
+        assert now == cycle
+    # ADDI at even cycles, JMP at odd
+    assert [r1 for _, _, r1 in seen] == [1, 25, 26, 167, FRAME_CYCLES // 2]
+    assert m.cycles == FRAME_CYCLES
+
+
+def test_run_n_steps_runs_due_events() -> None:
+    m = Machine()
+    m.load_rom(counting_rom())
+    fired: list[int] = []
+    m.scheduler.after(10, lambda c: fired.append(m.cycles))
+    m.run_n_steps(9)
+    assert fired == []
+    m.run_n_steps(5)
+    assert fired == [10]
+    assert m.cycles == 14
+
+
+def test_frame_events_run_when_halted() -> None:
+    m = Machine()
+    m.load_rom(build_test_rom([asm_addi(rd=1, rs=1, imm=1), asm_halt()]))
+    fired: list[int] = []
+    m.scheduler.at(500, fired.append)
+    m.scheduler.at(FRAME_CYCLES + 1, fired.append)  # next frame
+    m.run_frame()
+    assert m.cpu.halted and m.cycles == 1
+    assert fired == [500]
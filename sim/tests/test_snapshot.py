@@ -0,0 +1,79 @@
+import pytest
+
+from retro16sim import Machine, build_test_rom
+from retro16sim.assembler import asm_addi, asm_halt, asm_jmp, asm_st
+from retro16sim.const import PAGE_COUNT
+from .test_helpers import prog_countdown
+
+
+def counter_rom() -> bytes:
+    # R1 counts up and is stored to 0xFFFE forever
+    return build_test_rom(
+        [
+            asm_addi(1, 1, 1),
+            asm_st(1, 0, -2),
+            asm_jmp(-3),
+        ]
+    )
+
+
+@pytest.mark.parametrize("engine", ["interp", "block"])
+def test_restore_returns_to_snapshot(engine: str) -> None:
+    m = Machine(engine=engine)
+    m.reset()
+    m.load_rom(counter_rom())
+    m.run_n_steps(30)
+
+    snap = m.snapshot()
+    state = (list(m.cpu.reg), m.cpu.pc, m.cpu.flags, m.cycles, bytes(m.bus.mem))
+
+    m.run_n_steps(100)
+    assert m.cpu.reg[1] != state[0][1]
+
+    m.restore(snap)
+    assert (list(m.cpu.reg), m.cpu.pc, m.cpu.flags, m.cycles, bytes(m.bus.mem)) == (
+        state
+    )
+
+    # runs on exactly as before
+    m.run_n_steps(100)
+    other = Machine()
+    other.reset()
+    other.load_rom(counter_rom())
+    other.run_n_steps(130)
+    assert m.cpu.reg == other.cpu.reg
+    assert m.bus.mem == other.bus.mem
+
+
+def test_snapshot_shares_unchanged_pages(machine: Machine) -> None:
+    machine.load_rom(counter_rom())
+    first = machine.snapshot()
+    machine.run_n_steps(3)
+    second = machine.snapshot()
+
+    shared = [a is b for a, b in zip(first.pages, second.pages)]
+    assert shared.count(False) == 1  # only the page holding 0xFFFE
+    assert not shared[PAGE_COUNT - 1]
+
+
+def test_restore_discards_translated_code(machine: Machine) -> None:
+    machine.load_rom(build_test_rom(prog_countdown()))
+    snap = machine.snapshot()
+    machine.load_rom(build_test_rom([asm_addi(2, 0, 7), asm_halt()]))
+    machine.run_n_steps(10)
+    assert machine.cpu.reg[2] == 7
+
+    machine.restore(snap)
+    machine.run_n_steps(100)
+    assert machine.cpu.reg[2] == 0
+    assert machine.cpu.halted
+
+
+def test_restore_after_direct_store_and_bulk_write(machine: Machine) -> None:
+    snap = machine.snapshot()
+    machine.bus.store16(0x4000, 0x1234)
+    machine.bus.write(0x5000, b"\xaa" * 300)
+    machine.restore(snap)
+
+    assert machine.bus.read(0x4000, 2) == b"\x00\x00"
+    assert machine.bus.read(0x5000, 300) == bytes(300)
@@ -0,0 +1,65 @@
+from retro16sim import Machine, build_test_rom
+from retro16sim.tracing import TraceBuffer, format_record, run_traced
+from .test_helpers import prog_add_two_then_halt, prog_countdown
+
+
+def test_trace_records_state_before_each_instruction(
+    machine: Machine,
+) -> None:
+    machine.load_rom(build_test_rom(prog_add_two_then_halt()))
+    machine.run_n_steps(10, trace=True)
+
+    recs = list(machine.trace_buffer.records())
+    assert [r.pc for r in recs] == [0x0000, 0x0002, 0x0004]
+    assert [r.regs[1] for r in recs] == [0, 1, 2]
+    assert recs[0].instr == machine.bus.load16(0x0000)
+    assert machine.cpu.reg[1] == 2
+    assert machine.cycles == 2
+
+
+def test_traced_run_matches_untraced_run() -> None:
+    rom = build_test_rom(prog_countdown())
+    plain, traced = Machine(), Machine()
+    for m in (plain, traced):
+        m.reset()
+        m.load_rom(rom)
+    plain.run_n_steps(50)
+    traced.run_n_steps(50, trace=True)
+
+    assert traced.cpu.reg == plain.cpu.reg
+    assert traced.cpu.pc == plain.cpu.pc
+    assert traced.cycles == plain.cycles
+    # ADDI, three rounds of CMPI/JZ/ADDI/JNZ (the last JNZ falls through), HALT
+    assert traced.cpu.halted
+    assert len(traced.trace_buffer) == 1 + 3 * 4 + 1
+
+
+def test_ring_buffer_keeps_latest_records(machine: Machine) -> None:
+    machine.load_rom(build_test_rom(prog_countdown()))
+    buf = TraceBuffer(capacity=4)
+    run_traced(machine.cpu, buf, 10)
+
+    assert len(buf) == 4
+    full = TraceBuffer(capacity=100)
+    machine.reset()
+    run_traced(machine.cpu, full, 10)
+    assert list(buf.records()) == list(full.records())[-4:]
+
+
+def test_format_record(machine: Machine) -> None:
+    machine.load_rom(build_test_rom(prog_add_two_then_halt()))
+    machine.run_n_steps(3, trace=True)
+
+    lines = list(machine.trace_buffer.lines())
+    assert lines[0].startswith("PC=0000 INSTR=")
+    assert "ADDI" in lines[0]
+    assert lines[2].split()[2] == "HALT"
+    assert lines[1].endswith("ZNCV=0000")
+    assert format_record(next(machine.trace_buffer.records())) == lines[0]
+
+
+def test_format_record_unknown_opcode(machine: Machine) -> None:
+    machine.load_rom(build_test_rom([0xC000]))
+    buf = TraceBuffer()
+    buf.append(0, 0xC000, machine.cpu.reg, 0)
+    assert format_record(next(buf.records())).split()[2] == "?C"